@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# Runs main.main against in-process fake CKAN and Dataspace Connector servers (see fake_servers.py) and reports
+# the wall time, the datasets per second and the requests per endpoint of each run. The first run fills the
+# connector, the next ones show the cost of a re-import.
+#
+#   python benchmarks/bench_import.py [--datasets 20] [--runs 2] [--collection-size 0]
+#                                     [--ckan-latency 0.0] [--connector-latency 0.0] [--shards 1]
+#                                     [--connector-capacity 0] [--connector-limit-max 32] [--json]
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+from collections import Counter
+
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SCRIPTS_PATH)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_servers import FakeCkan, FakeConnector  # noqa: E402
+
+
+def setup_environment(ckan: FakeCkan, connector: FakeConnector, dataset_list: str):
+    # config reads the environment when it is first imported, by main.main, so this has to run before
+    os.environ.update({
+        "DATA_SOURCE_URL": ckan.url,
+        "CONNECTOR_URL": connector.url,
+        "CONNECTOR_DOCKER_URL": connector.url,
+        "METADATA_BROKER_URL": connector.url,
+        "METADATA_BROKER_DOCKER_URL": connector.url,
+        "CONNECTOR_USER": "admin",
+        "CONNECTOR_PW": "password",
+        "DATASET_LIST": dataset_list,
+        "RULE_JSON": os.path.join(SCRIPTS_PATH, "input", "rule.json"),
+        "RULE_SAMPLE_JSON": os.path.join(SCRIPTS_PATH, "input", "rule_sample.json"),
+    })
+
+
+def endpoint_counts(server) -> dict:
+    with server.lock:
+        counts = {"{} {}".format(method, endpoint): count for (method, endpoint), count in server.counts.items()}
+        server.counts.clear()
+    return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+
+def run_import(main, connector_index, args, dataset_list: str, sync_state_db: str, journal_db: str,
+               sample_cache_db: str, shard_connectors: str = '') -> (float, str):
+    # each run starts without the entities known by the previous one, as a new process would
+    connector_index.reset()
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        main.main(input_file=dataset_list, ckan_workers=args.ckan_workers, connector_workers=args.connector_workers,
+                  sync_state_db=sync_state_db, harvest_mode=args.harvest_mode, journal_db=journal_db,
+                  transform_workers=args.transform_workers, sample_cache_db=sample_cache_db,
+                  shard_connectors=shard_connectors, connector_limit_max=args.connector_limit_max)
+    return time.perf_counter() - start, output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import against fake CKAN and connector servers")
+    parser.add_argument('--datasets', type=int, default=20)
+    parser.add_argument('--organizations', type=int, default=3)
+    parser.add_argument('--resources', type=int, default=2, help="CSV resources per dataset")
+    parser.add_argument('--fields', type=int, default=8, help="datastore columns per resource")
+    parser.add_argument('--rows', type=int, default=50, help="datastore rows per resource")
+    parser.add_argument('--collection-size', type=int, default=0,
+                        help="unrelated entities already in each connector collection")
+    parser.add_argument('--ckan-latency', type=float, default=0.0, help="seconds added to each CKAN request")
+    parser.add_argument('--connector-latency', type=float, default=0.0,
+                        help="seconds added to each connector request")
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--ckan-workers', type=int, default=1)
+    parser.add_argument('--connector-workers', type=int, default=1)
+    parser.add_argument('--transform-workers', type=int, default=0)
+    parser.add_argument('--harvest-mode', choices=['show', 'search'], default='show')
+    parser.add_argument('--sync-state', action='store_true', help="skip unchanged datasets in the later runs")
+    parser.add_argument('--sample-cache', action='store_true', help="reuse the samples of unchanged resources")
+    parser.add_argument('--shards', type=int, default=1, help="connectors of a sharded import")
+    parser.add_argument('--connector-capacity', type=int, default=0,
+                        help="writes in flight before the fake connector answers 503, each one adds its latency")
+    parser.add_argument('--connector-limit-max', type=int, default=32,
+                        help="most requests in flight per endpoint class, 0 for a fixed concurrency")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--output', action='store_true', help="print the output of the importer")
+    args = parser.parse_args()
+
+    ckan = FakeCkan(datasets=args.datasets, organizations=args.organizations, resources=args.resources,
+                    fields=args.fields, rows=args.rows, latency=args.ckan_latency).start()
+    connectors = [FakeConnector(collection_size=args.collection_size, latency=args.connector_latency,
+                                capacity=args.connector_capacity).start()
+                  for _ in range(args.shards)]
+    connector = connectors[0]
+    shard_connectors = ','.join(shard.url for shard in connectors) if args.shards > 1 else ''
+    workdir = tempfile.mkdtemp(prefix="bench_import_")
+    dataset_list = os.path.join(workdir, "dataset_selection.txt")
+    with open(dataset_list, 'w') as target:
+        target.write('\n'.join("{}/dataset/{}".format(ckan.url, name) for name in ckan.datasets))
+    sync_state_db = os.path.join(workdir, "sync_state.db") if args.sync_state else ''
+    sample_cache_db = os.path.join(workdir, "sample_cache.db") if args.sample_cache else ''
+
+    setup_environment(ckan, connector, dataset_list)
+    import main as importer  # noqa: E402
+    import connector_index  # noqa: E402
+
+    results = []
+    for run in range(args.runs):
+        elapsed, output = run_import(importer, connector_index, args, dataset_list, sync_state_db,
+                                     os.path.join(workdir, "import_journal.db"), sample_cache_db, shard_connectors)
+        if args.output:
+            print(output)
+        failed = output.count("*ERROR* Importing dataset")
+        results += [{
+            "run": run,
+            "datasets": args.datasets,
+            "failed": failed,
+            "seconds": round(elapsed, 3),
+            "datasets_per_second": round(args.datasets / elapsed, 2) if elapsed else None,
+            "connector_requests": dict(sum((Counter(endpoint_counts(shard)) for shard in connectors),
+                                           Counter()).most_common()),
+            "ckan_requests": endpoint_counts(ckan),
+            "connector_entities": {collection: sum(shard.count(collection) for shard in connectors)
+                                   for collection in connector.entities},
+            "shard_catalogs": [shard.count('catalogs') for shard in connectors],
+            "connector_rejected": sum(shard.rejected for shard in connectors),
+        }]
+        for shard in connectors:
+            shard.rejected = 0
+
+    ckan.stop()
+    for shard in connectors:
+        shard.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print("run {run}: {datasets} datasets ({failed} failed) in {seconds:.3f}s => {datasets_per_second} "
+              "datasets/s".format(**result))
+        for server in ["connector", "ckan"]:
+            counts = result["{}_requests".format(server)]
+            print("\t{} requests: {}".format(server, sum(counts.values())))
+            for endpoint, count in counts.items():
+                print("\t\t{:>6}  {}".format(count, endpoint))
+        print("\tconnector entities: {}".format(result["connector_entities"]))
+        if args.connector_capacity:
+            print("\tconnector writes rejected (503): {}".format(result["connector_rejected"]))
+        if args.shards > 1:
+            print("\tcatalogs per shard: {}".format(result["shard_catalogs"]))
+
+
+if __name__ == '__main__':
+    main()
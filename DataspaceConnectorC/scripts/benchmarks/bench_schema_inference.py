@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Compares the schema inference of generate_datapackage before and after schema_inference.infer_columns
+# on wide synthetic datastore_search payloads.
+#
+#   python benchmarks/bench_schema_inference.py [--columns 50 200 500] [--rows 100] [--repeat 3]
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from frictionless import describe  # noqa: E402
+import schema_inference  # noqa: E402
+
+
+def synthetic_datastore(columns: int, rows: int) -> dict:
+    # a third of the columns are integers, a third are text and a third stay empty in the first half of the rows
+    fields = [{"id": "_id", "type": "int"}] + [{"id": "col_{}".format(c), "type": "text"} for c in range(columns)]
+    records = []
+    for r in range(rows):
+        record = {"_id": r + 1}
+        for c in range(columns):
+            if c % 3 == 0:
+                record["col_{}".format(c)] = str(r * c)
+            elif c % 3 == 1:
+                record["col_{}".format(c)] = "text {} {}".format(r, c)
+            else:
+                record["col_{}".format(c)] = "" if r < rows // 2 else "{}.5".format(r)
+        records += [record]
+    return {"fields": fields, "records": records}
+
+
+def legacy_infer(datastore_info: dict) -> (dict, dict):
+    # the inference loop of generate_datapackage before the schema_inference stage
+    header = [k['id'] for k in datastore_info['fields']]
+    records = [list(v.values()) for v in datastore_info['records']]
+    new_schema = describe([header] + records, type="schema")
+    fields = new_schema.fields
+
+    examples = {}
+    inferred = {}
+    for name in header:
+        example_value = None
+        for record in datastore_info['records']:
+            value = record.get(name)
+            if value is not None and len(str(value)) > 0:
+                example_value = value
+                break
+        examples[name] = example_value
+        inferred[name] = [f for f in fields if f.name == name][0]
+    return {k: v for k, v in examples.items() if v is not None}, inferred
+
+
+def best_time(function, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times += [time.perf_counter() - start]
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the schema inference on wide datastore payloads")
+    parser.add_argument('--columns', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print("{:>8} {:>6} {:>12} {:>12} {:>8}".format("columns", "rows", "legacy (s)", "single (s)", "speedup"))
+    for columns in args.columns:
+        datastore_info = synthetic_datastore(columns, args.rows)
+
+        legacy_examples, legacy_fields = legacy_infer(datastore_info)
+        examples, fields = schema_inference.infer_columns(datastore_info['fields'], datastore_info['records'])
+        assert examples == legacy_examples
+        assert {k: f.to_dict() for k, f in fields.items()} == {k: f.to_dict() for k, f in legacy_fields.items()}
+
+        legacy = best_time(lambda: legacy_infer(datastore_info), args.repeat)
+        single = best_time(lambda: schema_inference.infer_columns(datastore_info['fields'],
+                                                                  datastore_info['records']), args.repeat)
+        print("{:>8} {:>6} {:>12.4f} {:>12.4f} {:>7.2f}x".format(columns, args.rows, legacy, single, legacy / single))
+
+
+if __name__ == '__main__':
+    main()
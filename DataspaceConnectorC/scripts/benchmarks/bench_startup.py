@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# Measures the start-up time of the command line, each target in new Python processes, and the modules that take
+# most of the import time of main. Exits with status 1 when a target is slower than its budget, to guard the
+# start-up latency of the cron and orchestration runs.
+#
+#   python benchmarks/bench_startup.py [--repeat 5] [--max-ms "cli stats=250"] [--top 10] [--json]
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+SCRIPTS_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+TARGETS = {
+    "python": ["-c", "pass"],
+    "cli --help": [os.path.join(SCRIPTS_PATH, "cli.py"), "--help"],
+    "cli stats": [os.path.join(SCRIPTS_PATH, "cli.py"), "stats"],
+    "import main": ["-c", "import main"],
+}
+# milliseconds, over the bare interpreter start-up
+BUDGETS = {
+    "cli --help": 100,
+    "cli stats": 100,
+}
+
+
+def run_target(args: list, workdir: str) -> float:
+    env = dict(os.environ, PYTHONPATH=SCRIPTS_PATH)
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def import_times(module: str, workdir: str, top: int) -> list:
+    # cumulative import time of the slowest top level imports of the module (python -X importtime)
+    env = dict(os.environ, PYTHONPATH=SCRIPTS_PATH)
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)], cwd=workdir,
+                            env=env, capture_output=True, text=True).stderr
+    times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # the imports of the module itself, one level below it
+        if name.startswith("   ") and not name.startswith("     "):
+            times += [(name.strip(), int(cumulative) / 1000)]
+    return sorted(times, key=lambda item: -item[1])[:top]
+
+
+def parse_budgets(values: list) -> dict:
+    budgets = dict(BUDGETS)
+    for value in values or []:
+        name, milliseconds = value.rsplit("=", 1)
+        budgets[name.strip()] = float(milliseconds)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the start-up time of the command line")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of each target, the median is reported")
+    parser.add_argument('--max-ms', action='append', metavar='TARGET=MS',
+                        help="budget of a target in ms over the bare interpreter (default: {})".format(
+                            ", ".join("{}={}".format(*budget) for budget in BUDGETS.items())))
+    parser.add_argument('--top', type=int, default=10, help="slowest imports of main")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+    budgets = parse_budgets(args.max_ms)
+
+    # an empty working directory: no .env file and no state files
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    for target_args in TARGETS.values():
+        run_target(target_args, workdir)
+    medians = {name: statistics.median(run_target(target_args, workdir) for _ in range(args.repeat))
+               for name, target_args in TARGETS.items()}
+    baseline = medians["python"]
+    results = {
+        "targets": {name: {"ms": round(ms, 1), "over_python_ms": round(ms - baseline, 1),
+                           "budget_ms": budgets.get(name),
+                           "ok": name not in budgets or ms - baseline <= budgets[name]}
+                    for name, ms in medians.items()},
+        "main_imports_ms": dict(import_times("main", workdir, args.top)),
+    }
+    failed = [name for name, result in results["targets"].items() if not result["ok"]]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results["targets"].items():
+            print("{:<12} {:>8.1f} ms  (+{:.1f} ms over python){}".format(
+                name, result["ms"], result["over_python_ms"],
+                "" if result["budget_ms"] is None else "  budget {} ms => {}".format(
+                    result["budget_ms"], "OK" if result["ok"] else "SLOW")))
+        print("slowest imports of main:")
+        for module, ms in results["main_imports_ms"].items():
+            print("\t{:>8.1f} ms  {}".format(ms, module))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
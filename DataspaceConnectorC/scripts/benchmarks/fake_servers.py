@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+import json
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# embedded collection names used by the Dataspace Connector HAL responses
+EMBEDDED_NAMES = {
+    "catalogs": "catalogs",
+    "offers": "resources",
+    "contracts": "contracts",
+    "rules": "rules",
+    "representations": "representations",
+    "artifacts": "artifacts",
+}
+
+# fields the connector keeps as attributes, anything else ends in 'additional'
+KNOWN_FIELDS = {
+    "catalogs": ["title", "description"],
+    "offers": ["title", "description", "keywords", "publisher", "language", "license", "sovereign",
+               "endpointDocumentation", "paymentMethod", "samples"],
+    "contracts": ["title", "description", "consumer", "provider", "start", "end"],
+    "rules": ["title", "description", "value"],
+    "representations": ["title", "description", "mediaType", "language", "standard"],
+    "artifacts": ["title", "description"],
+}
+
+# relations that can be linked from a parent entity
+RELATIONS = {
+    "catalogs": ["offers"],
+    "offers": ["catalogs", "contracts", "representations"],
+    "contracts": ["offers", "rules"],
+    "rules": ["contracts"],
+    "representations": ["offers", "artifacts"],
+    "artifacts": ["representations"],
+}
+
+PAGE_SIZE = 30
+
+
+def endpoint_template(path: str) -> str:
+    parts = []
+    for part in path.strip('/').split('/'):
+        try:
+            uuid.UUID(part)
+            parts += ['{id}']
+        except ValueError:
+            parts += [part]
+    return '/' + '/'.join(parts)
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler, latency: float = 0.0, capacity: int = 0):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latency = latency
+        # writes in flight before the server answers 503 with a Retry-After, each one in flight adds latency
+        self.capacity = capacity
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}".format(*self.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body) if body else None
+
+    def send_json(self, status: int, content=None, headers: dict = None):
+        body = json.dumps(content).encode('utf-8') if content is not None else b''
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if content is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def dispatch(self, method: str):
+        split = urlsplit(self.path)
+        limited = self.server.capacity and method != 'GET'
+        with self.server.lock:
+            self.server.counts[(method, endpoint_template(split.path))] += 1
+            overloaded = limited and self.server.in_flight >= self.server.capacity
+            if overloaded:
+                self.server.rejected += 1
+            elif limited:
+                self.server.in_flight += 1
+            in_flight = self.server.in_flight
+        if overloaded:
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            return self.send_json(503, {"message": "Overloaded"}, headers={'Retry-After': '1'})
+        try:
+            if self.server.latency:
+                time.sleep(self.server.latency * (in_flight if limited else 1))
+            params = {k: v[-1] for k, v in parse_qs(split.query).items()}
+            self.handle_request(method, split.path, params)
+        finally:
+            if limited:
+                with self.server.lock:
+                    self.server.in_flight -= 1
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+
+class CkanHandler(JSONHandler):
+
+    def handle_request(self, method: str, path: str, params: dict):
+        action = path.rsplit('/', 1)[-1]
+        if method == 'POST':
+            params.update(self.read_body() or {})
+        ckan = self.server
+        with ckan.lock:
+            result = ckan.action(action, params)
+        if result is None:
+            return self.send_json(404, {"success": False,
+                                        "error": {"message": "Not found", "__type": "Not Found Error"}})
+        etag = '"{}"'.format(hashlib.sha1(json.dumps(result, sort_keys=True).encode('utf-8')).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_json(304, headers={"ETag": etag})
+        self.send_json(200, {"success": True, "result": result}, headers={"ETag": etag})
+
+
+class FakeCkan(FakeServer):
+
+    def __init__(self, datasets: int = 10, organizations: int = 3, resources: int = 2, fields: int = 8,
+                 rows: int = 50, latency: float = 0.0):
+        super().__init__(CkanHandler, latency)
+        self.organizations = {}
+        self.datasets = {}
+        self.datastores = {}
+        for o in range(organizations):
+            name = "org-{}".format(o)
+            self.organizations[name] = {
+                "id": str(uuid.uuid5(uuid.NAMESPACE_URL, name)),
+                "name": name,
+                "title": json.dumps({"es": "Organization {}".format(o)}),
+                "description": json.dumps({"es": "Description of organization {}".format(o)}),
+                "source": "https://source-{}.example.org".format(o),
+            }
+        for d in range(datasets):
+            self.add_dataset(d, "org-{}".format(d % organizations), resources, fields, rows)
+
+    def add_dataset(self, number: int, organization: str, resources: int, fields: int, rows: int):
+        name = "dataset-{}".format(number)
+        dataset_id = str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+        org = self.organizations[organization]
+        dataset = {
+            "id": dataset_id,
+            "name": name,
+            "title": {"es": "Dataset {}".format(number)},
+            "notes": {"es": "<p>Notes of <b>dataset</b> {}</p>".format(number)},
+            "url": "https://source.example.org/{}".format(name),
+            "license_id": "cc-by",
+            "license_url": "https://creativecommons.org/licenses/by/4.0/",
+            "tag_string_schemaorg": "TOURISM-ES, ENVIRONMENT-ES",
+            "original_tags": "tag{}".format(number % 5),
+            "metadata_modified": "2024-01-01T00:00:00.000000",
+            "organization": {key: org[key] for key in ["id", "name", "title", "description"]},
+            "resources": [],
+        }
+        for r in range(resources):
+            resource_id = str(uuid.uuid5(uuid.NAMESPACE_URL, "{}-{}".format(name, r)))
+            dataset["resources"] += [{
+                "id": resource_id,
+                "package_id": dataset_id,
+                "name": {"es": "Resource {}".format(r)},
+                "description": {"es": "Resource {} of dataset {}".format(r, number)},
+                "format": "CSV",
+                "url": "https://source.example.org/{}/{}.csv".format(name, r),
+                "datastore_active": True,
+                "last_modified": "2024-01-01T00:00:00.000000",
+                "metadata_modified": "2024-01-01T00:00:00.000000",
+            }]
+            columns = [{"id": "_id", "type": "int"}] + \
+                      [{"id": "col_{}".format(f), "type": "text"} for f in range(fields)]
+            records = []
+            for row in range(rows):
+                record = {"_id": row + 1}
+                for f in range(fields):
+                    record["col_{}".format(f)] = str(row * f) if f % 2 == 0 else "value {}".format(row)
+                records += [record]
+            self.datastores[resource_id] = {"resource_id": resource_id, "fields": columns, "records": records}
+        if number % 5 == 4:
+            # a CSV resource that was never loaded in the datastore: its offer has no sample data
+            dataset["resources"] += [{
+                "id": str(uuid.uuid5(uuid.NAMESPACE_URL, "{}-raw".format(name))),
+                "package_id": dataset_id,
+                "name": {"es": "Raw resource"},
+                "description": {"es": "Resource without datastore of dataset {}".format(number)},
+                "format": "CSV",
+                "url": "https://source.example.org/{}/raw.csv".format(name),
+                "datastore_active": False,
+                "last_modified": "2024-01-01T00:00:00.000000",
+                "metadata_modified": "2024-01-01T00:00:00.000000",
+            }]
+        self.datasets[name] = dataset
+        return dataset
+
+    def touch_dataset(self, name: str, modified: str):
+        dataset = self.datasets[name]
+        dataset["metadata_modified"] = modified
+        for resource in dataset["resources"]:
+            resource["last_modified"] = modified
+
+    def find_dataset(self, key: str):
+        for dataset in self.datasets.values():
+            if key in (dataset["id"], dataset["name"]):
+                return dataset
+
+    def action(self, action: str, params: dict):
+        if action == "package_show":
+            return self.find_dataset(params.get("id"))
+        if action == "organization_show":
+            org = self.organizations.get(params.get("id"))
+            if org is None:
+                org = next((o for o in self.organizations.values() if o["id"] == params.get("id")), None)
+            return org
+        if action == "organization_list":
+            offset = int(params.get("offset", 0))
+            organizations = list(self.organizations.values())[offset:offset + int(params.get("limit", 25))]
+            if str(params.get("all_fields")).lower() == "true":
+                return organizations
+            return [o["name"] for o in organizations]
+        if action == "resource_show":
+            for dataset in self.datasets.values():
+                for resource in dataset["resources"]:
+                    if resource["id"] == params.get("id"):
+                        return resource
+            return None
+        if action == "package_search":
+            return self.package_search(params)
+        if action == "datastore_search":
+            datastore = self.datastores.get(params.get("resource_id"))
+            if datastore is None:
+                return None
+            offset = int(params.get("offset", 0))
+            limit = int(params.get("limit", 100))
+            records = datastore["records"][offset:offset + limit]
+            return {"resource_id": datastore["resource_id"], "fields": datastore["fields"], "records": records,
+                    "total": len(datastore["records"]), "limit": limit, "offset": offset}
+        return None
+
+    def package_search(self, params: dict):
+        datasets = sorted(self.datasets.values(), key=lambda d: d["name"])
+        fq = params.get("fq", "")
+        if fq.startswith("organization:"):
+            datasets = [d for d in datasets if d["organization"]["name"] == fq.split(":", 1)[1].strip('"')]
+        elif fq.startswith("name:("):
+            names = [n.strip('"') for n in fq[len("name:("):fq.index(")")].split(" OR ")]
+            datasets = [d for d in datasets if d["name"] in names or d["id"] in names]
+        start = int(params.get("start", 0))
+        rows = int(params.get("rows", 10))
+        return {"count": len(datasets), "results": datasets[start:start + rows]}
+
+
+class ConnectorHandler(JSONHandler):
+
+    def handle_request(self, method: str, path: str, params: dict):
+        connector = self.server
+        parts = path.strip('/').split('/')
+        body = self.read_body() if method in ('POST', 'PUT', 'DELETE') else None
+
+        if path.strip('/') == '':
+            return self.send_json(200, connector.self_description())
+        if parts[:2] == ['api', 'ids']:
+            with connector.lock:
+                connector.ids_messages += [(parts[2:], params)]
+            if parts[2:] == ['description'] and params.get('elementId') is None:
+                return self.send_json(200, connector.self_description())
+            if parts[2:] == ['description']:
+                return self.send_json(200, connector.catalog_description(params.get('elementId')))
+            return self.send_json(200, {"message": "ok"})
+        if len(parts) < 2 or parts[0] != 'api' or parts[1] not in EMBEDDED_NAMES:
+            return self.send_json(404, {"message": "Not found"})
+
+        collection = parts[1]
+        with connector.lock:
+            if len(parts) == 2:
+                if method == 'GET':
+                    return self.send_json(200, connector.page(collection, params))
+                if method == 'POST':
+                    return self.send_json(201, connector.create(collection, body))
+                return self.send_json(405, {"message": "Method not allowed"})
+
+            entity = connector.entities[collection].get(parts[2])
+            if entity is None:
+                return self.send_json(404, {"message": "Not found"})
+            if len(parts) == 3:
+                if method == 'GET':
+                    return self.send_json(200, entity)
+                if method == 'PUT':
+                    connector.update(collection, entity, body)
+                    return self.send_json(204)
+                if method == 'DELETE':
+                    connector.delete(collection, parts[2])
+                    return self.send_json(204)
+                return self.send_json(405, {"message": "Method not allowed"})
+
+            relation = parts[3]
+            if relation not in RELATIONS[collection]:
+                return self.send_json(404, {"message": "Not found"})
+            if method == 'POST':
+                connector.link(collection, parts[2], relation, body)
+                method = 'GET'
+            if method == 'DELETE':
+                connector.unlink(collection, parts[2], relation, body or [])
+                return self.send_json(204)
+            if method == 'GET':
+                return self.send_json(200, connector.relation_page(collection, parts[2], relation, params))
+            return self.send_json(405, {"message": "Method not allowed"})
+
+
+class FakeConnector(FakeServer):
+
+    def __init__(self, collection_size: int = 0, latency: float = 0.0, capacity: int = 0):
+        super().__init__(ConnectorHandler, latency, capacity)
+        self.entities = {collection: {} for collection in EMBEDDED_NAMES}
+        self.links = {}
+        self.ids_messages = []
+        for collection in EMBEDDED_NAMES:
+            for n in range(collection_size):
+                self.create(collection, {"title": "Filler {} {}".format(collection, n),
+                                         "resource_id": "filler-{}".format(n)})
+
+    def entity_url(self, collection: str, entity_id: str) -> str:
+        return "{}/api/{}/{}".format(self.url, collection, entity_id)
+
+    def create(self, collection: str, data: dict) -> dict:
+        entity_id = str(uuid.uuid4())
+        now = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        entity = {"creationDate": now, "modificationDate": now, "additional": {}}
+        for field in KNOWN_FIELDS[collection]:
+            entity[field] = None
+        self.apply(collection, entity, data)
+        entity["_links"] = {"self": {"href": self.entity_url(collection, entity_id)}}
+        for relation in RELATIONS[collection]:
+            entity["_links"][relation] = {"href": "{}/{}{{?page,size}}".format(self.entity_url(collection, entity_id),
+                                                                               relation)}
+        self.entities[collection][entity_id] = entity
+        return entity
+
+    def apply(self, collection: str, entity: dict, data: dict):
+        entity["additional"] = {}
+        for k, v in (data or {}).items():
+            if k in KNOWN_FIELDS[collection]:
+                entity[k] = v
+            elif k != "additional":
+                entity["additional"][k] = v if isinstance(v, str) else json.dumps(v)
+        for k, v in (data or {}).get("additional", {}).items():
+            entity["additional"][k] = str(v)
+
+    def update(self, collection: str, entity: dict, data: dict):
+        self.apply(collection, entity, data)
+        entity["modificationDate"] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+
+    def delete(self, collection: str, entity_id: str):
+        self.entities[collection].pop(entity_id, None)
+        url = self.entity_url(collection, entity_id)
+        for key in list(self.links):
+            self.links[key].discard(url)
+            if key[0] == url:
+                del self.links[key]
+
+    def link(self, collection: str, entity_id: str, relation: str, urls: list):
+        parent_url = self.entity_url(collection, entity_id)
+        inverse = collection
+        for url in urls:
+            self.links.setdefault((parent_url, relation), set()).add(url)
+            self.links.setdefault((url, inverse), set()).add(parent_url)
+
+    def unlink(self, collection: str, entity_id: str, relation: str, urls: list):
+        parent_url = self.entity_url(collection, entity_id)
+        for url in urls:
+            self.links.get((parent_url, relation), set()).discard(url)
+            self.links.get((url, collection), set()).discard(parent_url)
+
+    def paginate(self, base_url: str, items: list, name: str, params: dict) -> dict:
+        page = int(params.get('page', 0))
+        size = int(params.get('size', PAGE_SIZE))
+        result = {"_embedded": {name: items[page * size:(page + 1) * size]},
+                  "_links": {"self": {"href": "{}?page={}&size={}".format(base_url, page, size)}},
+                  "page": {"size": size, "totalElements": len(items),
+                           "totalPages": (len(items) + size - 1) // size, "number": page}}
+        if (page + 1) * size < len(items):
+            result["_links"]["next"] = {"href": "{}?page={}&size={}".format(base_url, page + 1, size)}
+        return result
+
+    def page(self, collection: str, params: dict) -> dict:
+        items = list(self.entities[collection].values())
+        return self.paginate("{}/api/{}".format(self.url, collection), items, EMBEDDED_NAMES[collection], params)
+
+    def relation_page(self, collection: str, entity_id: str, relation: str, params: dict) -> dict:
+        parent_url = self.entity_url(collection, entity_id)
+        items = []
+        for url in sorted(self.links.get((parent_url, relation), set())):
+            child = self.entities[relation].get(url.rsplit('/', 1)[-1])
+            if child is not None:
+                items += [child]
+        return self.paginate("{}/{}".format(parent_url, relation), items, EMBEDDED_NAMES[relation], params)
+
+    def self_description(self) -> dict:
+        return {"@type": "ids:BaseConnector", "@id": "https://connector_C",
+                "ids:resourceCatalog": [{"@id": url} for url in
+                                        (self.entity_url("catalogs", k) for k in self.entities["catalogs"])]}
+
+    def catalog_description(self, element_id: str) -> dict:
+        catalog_id = (element_id or '').rsplit('/', 1)[-1]
+        with self.lock:
+            offers = sorted(self.links.get((self.entity_url("catalogs", catalog_id), "offers"), set()))
+            resources = []
+            for url in offers:
+                offer = self.entities["offers"].get(url.rsplit('/', 1)[-1], {})
+                resources += [{"@id": url, "@type": "ids:Resource",
+                               "ids:title": [{"@value": offer.get("title"), "@language": "es"}],
+                               "ids:description": [{"@value": offer.get("description"), "@language": "es"}],
+                               "ids:keyword": [{"@value": k} for k in offer.get("keywords") or []],
+                               "ids:modified": {"@value": offer.get("modificationDate"),
+                                                "@type": "http://www.w3.org/2001/XMLSchema#dateTimeStamp"}}]
+        return {"@id": element_id, "@type": "ids:ResourceCatalog", "ids:offeredResource": resources}
+
+    def count(self, collection: str) -> int:
+        return len(self.entities[collection])
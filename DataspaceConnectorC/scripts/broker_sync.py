@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+import time
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import http_client
+import connector_index
+from config import BROKER_WORKERS
+
+
+def resource_version(offer: dict) -> str:
+    # what the broker was told about an offer: its payload hash, or its modification date before the hashes
+    return connector_index.entity_key(offer, 'payload_hash') or offer.get('modificationDate')
+
+
+def post_resource_message(message: str, broker_url: str, connector_url: str, resource_url: str, auth: tuple) -> int:
+    # ResourceUpdateMessage / ResourceUnavailableMessage of one offer, sent by the connector to the broker
+    request_url = "{0}/api/ids/resource/{1}?recipient={2}&resourceId={3}".format(connector_url, message, broker_url,
+                                                                                 resource_url)
+    response = http_client.post(request_url, data={}, auth=auth, verify=False)
+    print(" \t\t\t\t - Request POST resource {0} to broker {1}\t => {2}".format(message, request_url,
+                                                                              response.status_code))
+    response.raise_for_status()
+    return response.status_code
+
+
+class BrokerRegistry:
+    # What each broker last received from the connector: its catalogs (full registration) and the version
+    # of each offer. Kept in the SQLite file of the sync state.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS broker_connectors (
+                connector_url TEXT NOT NULL,
+                broker_url TEXT NOT NULL,
+                catalogs TEXT,
+                registered_at REAL,
+                PRIMARY KEY (connector_url, broker_url)
+            );
+            CREATE TABLE IF NOT EXISTS broker_resources (
+                connector_url TEXT NOT NULL,
+                broker_url TEXT NOT NULL,
+                resource_url TEXT NOT NULL,
+                version TEXT,
+                registered_at REAL,
+                PRIMARY KEY (connector_url, broker_url, resource_url)
+            );""")
+        self.connection.commit()
+
+    def catalogs(self, connector_url: str, broker_url: str) -> list:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT catalogs FROM broker_connectors WHERE connector_url = ? AND broker_url = ?",
+                (connector_url, broker_url)).fetchone()
+        if row is None:
+            return None
+        return sorted(row[0].split('\n')) if row[0] else []
+
+    def resources(self, connector_url: str, broker_url: str) -> dict:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT resource_url, version FROM broker_resources WHERE connector_url = ? AND broker_url = ?",
+                (connector_url, broker_url)).fetchall()
+        return dict(rows)
+
+    def record_connector(self, connector_url: str, broker_url: str, catalogs: list, resources: dict):
+        # a full registration: the broker knows all the catalogs and offers
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO broker_connectors VALUES (?, ?, ?, ?)",
+                                    (connector_url, broker_url, '\n'.join(sorted(catalogs)), time.time()))
+            self.connection.execute("DELETE FROM broker_resources WHERE connector_url = ? AND broker_url = ?",
+                                    (connector_url, broker_url))
+            self.connection.executemany("INSERT INTO broker_resources VALUES (?, ?, ?, ?, ?)",
+                                        [(connector_url, broker_url, url, version, time.time())
+                                         for url, version in resources.items()])
+            self.connection.commit()
+
+    def record_resource(self, connector_url: str, broker_url: str, resource_url: str, version: str):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO broker_resources VALUES (?, ?, ?, ?, ?)",
+                                    (connector_url, broker_url, resource_url, version, time.time()))
+            self.connection.commit()
+
+    def remove_resource(self, connector_url: str, broker_url: str, resource_url: str):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM broker_resources WHERE connector_url = ? AND broker_url = ? AND resource_url = ?",
+                (connector_url, broker_url, resource_url))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class BrokerSync:
+    # Compares the offers of the connector with what the broker last received and sends only the differences:
+    # a resource update per new or changed offer, a resource unavailable per removed offer. A full connector
+    # registration is only needed when the connector itself changed (first registration, catalogs added or
+    # removed). Messages that fail are sent again in the next run.
+
+    def __init__(self, registry: BrokerRegistry, index: connector_index.EntityIndex, broker_url: str,
+                 workers: int = BROKER_WORKERS):
+        self.registry = registry
+        self.index = index
+        self.connector_url = index.connector_url
+        self.auth = index.auth
+        self.broker_url = broker_url
+        self.workers = workers
+
+    def plan(self, full: bool = False) -> dict:
+        catalogs = sorted(self.index.load('catalogs'))
+        offers = {url: resource_version(offer) for url, offer in self.index.load('offers').items()}
+        registered_catalogs = self.registry.catalogs(self.connector_url, self.broker_url)
+        registered = self.registry.resources(self.connector_url, self.broker_url)
+        return {
+            'full': full or registered_catalogs is None or registered_catalogs != catalogs,
+            'catalogs': catalogs,
+            'offers': offers,
+            'update': sorted(url for url, version in offers.items() if registered.get(url) != version),
+            'unavailable': sorted(url for url in registered if url not in offers),
+        }
+
+    def registered(self, plan: dict):
+        self.registry.record_connector(self.connector_url, self.broker_url, plan['catalogs'], plan['offers'])
+
+    def send_message(self, message: str, resource_url: str, version: str = None):
+        post_resource_message(message, self.broker_url, self.connector_url, resource_url, self.auth)
+        if message == 'update':
+            self.registry.record_resource(self.connector_url, self.broker_url, resource_url, version)
+        else:
+            self.registry.remove_resource(self.connector_url, self.broker_url, resource_url)
+
+    def update_resources(self, plan: dict) -> dict:
+        stats = Counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.send_message, 'update', url, plan['offers'][url]): ('update', url)
+                       for url in plan['update']}
+            futures.update({pool.submit(self.send_message, 'unavailable', url): ('unavailable', url)
+                            for url in plan['unavailable']})
+            for future in as_completed(futures):
+                message, url = futures[future]
+                try:
+                    future.result()
+                    stats[message] += 1
+                except requests.RequestException as err:
+                    print("\t\t - *ERROR* Sending resource {} of {} to broker => {}".format(message, url, err))
+                    stats['failed'] += 1
+        return dict(stats)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import http_client
+from config import (CONNECTOR_URL, CONNECTOR_USER, CONNECTOR_PW, CRAWLER_DB, CRAWLER_PROVIDERS, CRAWLER_WORKERS,
+                    CRAWLER_PROVIDER_WORKERS, CRAWLER_MAX_AGE)
+
+# broker and provider fields copied from the provider document to its catalogs and resources
+CATALOG_KEYS = ["_broker_id", "_broker_catalog_id", "_broker_connector_id", "_provider_url"]
+RESOURCE_KEYS = CATALOG_KEYS + ["_provider_id"]
+
+
+def ids_text(value) -> str:
+    # plain text of an IDS JSON-LD property: a string, a {"@value"} object or a list of them
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ' '.join(t for t in (ids_text(v) for v in value) if t)
+    if isinstance(value, dict):
+        return str(value.get('@value', value.get('@id', '')))
+    return str(value)
+
+
+def ids_modified(document: dict) -> str:
+    return ids_text(document.get('ids:modified')) or None
+
+
+def catalog_modified(catalog: dict, resources: list) -> str:
+    # the catalog date if the provider sends it, else the date of its last modified resource
+    dates = [d for d in [ids_modified(r) for r in resources] if d]
+    return ids_modified(catalog) or (max(dates) if dates else None)
+
+
+def get_description(connector_url: str, auth: tuple, provider_url: str, element_id: str = None) -> dict:
+    # IDS description request sent by our connector to a provider connector, of an element or of the connector
+    request_url = "{0}/api/ids/description?recipient={1}".format(connector_url, provider_url)
+    if element_id is not None:
+        request_url += "&elementId={0}".format(element_id)
+    response = http_client.post(request_url, data={}, auth=auth, verify=False)
+    print(" \t - Request POST {0} \t => {1}".format(request_url, response.status_code))
+    response.raise_for_status()
+    return json.loads(response.content)
+
+
+def get_provider_doc(provider_url: str, connector_url: str, auth: tuple) -> dict:
+    # provider document as expected by get_catalog_description, from the provider self-description
+    description = get_description(connector_url, auth, provider_url)
+    catalogs = description.get('ids:resourceCatalog', [])
+    provider = {'@id': description.get('@id', provider_url), '_provider_url': provider_url,
+                '_catalogs': [c if isinstance(c, dict) else {'@id': c} for c in catalogs]}
+    for k in ["_broker_id", "_broker_catalog_id", "_broker_connector_id"]:
+        provider[k] = None
+    return provider
+
+
+def get_catalog_description(provider: dict, provider_catalog: dict, connector_url: str, auth: tuple) -> (dict, list):
+    provider_catalog_id = provider_catalog['@id']
+    catalog = get_description(connector_url, auth, provider["_provider_url"], provider_catalog_id)
+
+    catalog["_provider_id"] = provider['@id']
+    for k in CATALOG_KEYS:
+        catalog[k] = provider.get(k)
+
+    catalog_resources = catalog.get("ids:offeredResource", [])
+    catalog["ids:offeredResource"] = [str(r['@id']) for r in catalog_resources]
+    for resource in catalog_resources:
+        for k in RESOURCE_KEYS:
+            resource[k] = catalog[k]
+        resource["_catalog_id"] = str(catalog['@id'])
+    return catalog, catalog_resources
+
+
+class CatalogIndex:
+    # Catalogs and offered resources of the provider connectors, kept in a SQLite file with a full-text index
+    # (FTS5) over the resource titles, descriptions and keywords
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS catalogs (
+                id TEXT PRIMARY KEY,
+                provider_id TEXT,
+                provider_url TEXT,
+                title TEXT,
+                description TEXT,
+                modified TEXT,
+                resources INTEGER,
+                crawled_at REAL,
+                document TEXT
+            );
+            CREATE TABLE IF NOT EXISTS resources (
+                id TEXT NOT NULL,
+                catalog_id TEXT NOT NULL,
+                provider_id TEXT,
+                provider_url TEXT,
+                title TEXT,
+                description TEXT,
+                keywords TEXT,
+                modified TEXT,
+                document TEXT,
+                PRIMARY KEY (catalog_id, id)
+            );
+            CREATE INDEX IF NOT EXISTS resources_id ON resources (id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS resources_fts USING fts5(
+                id UNINDEXED, catalog_id UNINDEXED, title, description, keywords
+            );""")
+        self.connection.commit()
+
+    def get_catalog(self, catalog_id: str) -> dict:
+        with self.lock:
+            row = self.connection.execute("SELECT modified, crawled_at, provider_url FROM catalogs WHERE id = ?",
+                                          (catalog_id,)).fetchone()
+        if row is None:
+            return None
+        return {'modified': row[0], 'crawled_at': row[1], 'provider_url': row[2]}
+
+    def touch_catalog(self, catalog_id: str):
+        with self.lock:
+            self.connection.execute("UPDATE catalogs SET crawled_at = ? WHERE id = ?", (time.time(), catalog_id))
+            self.connection.commit()
+
+    def _delete_resources(self, catalog_id: str):
+        self.connection.execute("DELETE FROM resources WHERE catalog_id = ?", (catalog_id,))
+        self.connection.execute("DELETE FROM resources_fts WHERE catalog_id = ?", (catalog_id,))
+
+    def store_catalog(self, catalog: dict, resources: list):
+        # the resources of the catalog replace the ones of the previous crawl
+        catalog_id = str(catalog['@id'])
+        with self.lock:
+            self._delete_resources(catalog_id)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO catalogs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (catalog_id, catalog.get('_provider_id'), catalog.get('_provider_url'),
+                 ids_text(catalog.get('ids:title')), ids_text(catalog.get('ids:description')),
+                 catalog_modified(catalog, resources), len(resources), time.time(), json.dumps(catalog)))
+            for resource in resources:
+                row = (str(resource['@id']), catalog_id, resource.get('_provider_id'), resource.get('_provider_url'),
+                       ids_text(resource.get('ids:title')), ids_text(resource.get('ids:description')),
+                       ids_text(resource.get('ids:keyword')))
+                self.connection.execute("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        row + (ids_modified(resource), json.dumps(resource)))
+                self.connection.execute("INSERT INTO resources_fts VALUES (?, ?, ?, ?, ?)",
+                                        row[:2] + row[4:])
+            self.connection.commit()
+
+    def remove_catalogs(self, provider_url: str, keep: list) -> int:
+        # catalogs no longer offered by the provider
+        with self.lock:
+            rows = self.connection.execute("SELECT id FROM catalogs WHERE provider_url = ?", (provider_url,)).fetchall()
+            keep = set(keep)
+            removed = [row[0] for row in rows if row[0] not in keep]
+            for catalog_id in removed:
+                self._delete_resources(catalog_id)
+                self.connection.execute("DELETE FROM catalogs WHERE id = ?", (catalog_id,))
+            self.connection.commit()
+        return len(removed)
+
+    def search(self, text: str, limit: int = 20) -> list:
+        # every word of text must match, best matches (bm25) first
+        query = ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+        with self.lock:
+            rows = self.connection.execute("""
+                SELECT r.id, r.catalog_id, r.provider_url, r.title, r.description, r.keywords, r.modified
+                FROM resources_fts f JOIN resources r ON r.id = f.id AND r.catalog_id = f.catalog_id
+                WHERE resources_fts MATCH ? ORDER BY bm25(resources_fts) LIMIT ?""", (query, limit)).fetchall()
+        keys = ['id', 'catalog_id', 'provider_url', 'title', 'description', 'keywords', 'modified']
+        return [dict(zip(keys, row)) for row in rows]
+
+    def get_resource(self, resource_id: str) -> dict:
+        with self.lock:
+            row = self.connection.execute("SELECT document FROM resources WHERE id = ?", (resource_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'providers': self.connection.execute("SELECT COUNT(DISTINCT provider_url) FROM catalogs").fetchone()[0],
+                'catalogs': self.connection.execute("SELECT COUNT(*) FROM catalogs").fetchone()[0],
+                'resources': self.connection.execute("SELECT COUNT(*) FROM resources").fetchone()[0],
+            }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class CatalogCrawler:
+    # Requests the catalog descriptions of the providers concurrently, with at most provider_workers requests
+    # in flight per provider connector. A catalog is only requested again when it is older than max_age
+    # seconds, and only rewritten in the index when its modification date changed.
+
+    def __init__(self, index: CatalogIndex, connector_url: str, auth: tuple, workers: int = CRAWLER_WORKERS,
+                 provider_workers: int = CRAWLER_PROVIDER_WORKERS, max_age: int = CRAWLER_MAX_AGE):
+        self.index = index
+        self.connector_url = connector_url
+        self.auth = auth
+        self.workers = workers
+        self.provider_workers = provider_workers
+        self.max_age = max_age
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def semaphore(self, provider_url: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            if provider_url not in self.semaphores:
+                self.semaphores[provider_url] = threading.BoundedSemaphore(self.provider_workers)
+            return self.semaphores[provider_url]
+
+    def count(self, key: str, value: int = 1):
+        with self.lock:
+            self.stats[key] += value
+
+    def provider_doc(self, provider_url: str) -> dict:
+        with self.semaphore(provider_url):
+            return get_provider_doc(provider_url, self.connector_url, self.auth)
+
+    def crawl_catalog(self, provider: dict, provider_catalog: dict, force: bool = False):
+        known = self.index.get_catalog(str(provider_catalog['@id']))
+        if known is not None and not force:
+            listed_modified = ids_modified(provider_catalog)
+            if listed_modified is not None and listed_modified == known['modified']:
+                self.count('unchanged')
+                return
+            if listed_modified is None and time.time() - known['crawled_at'] < self.max_age:
+                self.count('fresh')
+                return
+
+        with self.semaphore(provider['_provider_url']):
+            catalog, resources = get_catalog_description(provider, provider_catalog, self.connector_url, self.auth)
+        self.count('requested')
+        if known is not None and not force and known['modified'] is not None and \
+                known['modified'] == catalog_modified(catalog, resources):
+            self.index.touch_catalog(str(catalog['@id']))
+            self.count('unchanged')
+            return
+        self.index.store_catalog(catalog, resources)
+        self.count('updated')
+        self.count('resources', len(resources))
+
+    def crawl(self, providers: list, force: bool = False) -> dict:
+        # providers are connector urls, or provider documents with their '_catalogs' as the broker gives them
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            docs = []
+            futures = {pool.submit(self.provider_doc, p): p for p in providers if isinstance(p, str)}
+            docs += [p for p in providers if not isinstance(p, str)]
+            for future in as_completed(futures):
+                try:
+                    docs += [future.result()]
+                except (requests.RequestException, ValueError) as err:
+                    print("\t\t - *ERROR* Requesting provider {} => {}".format(futures[future], err))
+                    self.count('errors')
+
+            futures = {}
+            for provider in docs:
+                removed = self.index.remove_catalogs(provider['_provider_url'],
+                                                     [str(c['@id']) for c in provider['_catalogs']])
+                self.count('removed', removed)
+                for provider_catalog in provider['_catalogs']:
+                    futures[pool.submit(self.crawl_catalog, provider, provider_catalog, force)] = provider_catalog
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (requests.RequestException, ValueError, KeyError) as err:
+                    print("\t\t - *ERROR* Requesting catalog {} => {}".format(futures[future]['@id'], err))
+                    self.count('errors')
+        return dict(self.stats)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Crawl the catalogs of the provider connectors into a local index")
+    parser.add_argument('--db', default=CRAWLER_DB, help="file of the catalog index")
+    commands = parser.add_subparsers(dest='command', required=True)
+    crawl = commands.add_parser('crawl', help="request the catalogs of the providers and update the index")
+    crawl.add_argument('providers', nargs='*', default=CRAWLER_PROVIDERS, help="provider connector urls")
+    crawl.add_argument('--workers', type=int, default=CRAWLER_WORKERS)
+    crawl.add_argument('--provider-workers', type=int, default=CRAWLER_PROVIDER_WORKERS)
+    crawl.add_argument('--max-age', type=int, default=CRAWLER_MAX_AGE,
+                       help="seconds before a catalog without modification date is requested again")
+    crawl.add_argument('--force', action='store_true', help="request and rewrite every catalog")
+    search = commands.add_parser('search', help="full-text search of the indexed resources")
+    search.add_argument('text')
+    search.add_argument('--limit', type=int, default=20)
+    show = commands.add_parser('show', help="indexed description of a resource")
+    show.add_argument('resource_id')
+    commands.add_parser('stats', help="providers, catalogs and resources in the index")
+    args = parser.parse_args(argv)
+
+    index = CatalogIndex(args.db)
+    if args.command == 'crawl':
+        auth = (CONNECTOR_USER, CONNECTOR_PW)
+        http_client.configure(CONNECTOR_URL, auth=auth, verify=False)
+        crawler = CatalogCrawler(index, CONNECTOR_URL, auth, args.workers, args.provider_workers, args.max_age)
+        print(" * Crawling {} providers through {}...".format(len(args.providers), CONNECTOR_URL))
+        print("\t\t ... Crawled: {} => OK".format(crawler.crawl(args.providers, args.force)))
+        print("\t\t ... Index: {}".format(index.stats()))
+        http_client.close()
+    elif args.command == 'search':
+        for resource in index.search(args.text, args.limit):
+            print("{id}\t{title}\t{provider_url}".format(**resource))
+    elif args.command == 'show':
+        print(json.dumps(index.get_resource(args.resource_id), indent=2))
+    else:
+        print(json.dumps(index.stats(), indent=2))
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+
+# seconds a cached response is used without asking CKAN again, per API action (not listed => not cached)
+DEFAULT_TTLS = {
+    "organization_show": 24 * 3600,
+    "organization_list": 24 * 3600,
+    "package_show": 3600,
+    "package_search": 3600,
+    "resource_show": 3600,
+    "datastore_search": 3600,
+}
+MEMORY_ENTRIES = 1024
+
+
+def cache_key(url: str, params: dict) -> str:
+    content = json.dumps([url, sorted((str(k), str(v)) for k, v in (params or {}).items())])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    # Cache of CKAN API GET responses: an in-memory LRU in front of a SQLite file. Expired entries are
+    # revalidated with If-None-Match / If-Modified-Since when CKAN sent an ETag or Last-Modified header.
+
+    def __init__(self, path: str, ttls: dict = None, memory_entries: int = MEMORY_ENTRIES):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT,
+                url TEXT,
+                body TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL
+            )""")
+        self.connection.commit()
+
+    def ttl(self, endpoint: str) -> int:
+        return self.ttls.get(endpoint, 0)
+
+    def cacheable(self, endpoint: str) -> bool:
+        return self.ttl(endpoint) > 0
+
+    def _remember(self, key: str, entry: dict):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def lookup(self, endpoint: str, key: str) -> dict:
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                source = 'memory'
+            else:
+                row = self.connection.execute(
+                    "SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.stats['miss'] += 1
+                    return None
+                entry = {'body': json.loads(row[0]), 'etag': row[1], 'last_modified': row[2], 'stored_at': row[3]}
+                self._remember(key, entry)
+                source = 'disk'
+            entry['fresh'] = time.time() - entry['stored_at'] < self.ttl(endpoint)
+            self.stats['{}_hit'.format(source) if entry['fresh'] else 'stale'] += 1
+            return entry
+
+    def store(self, endpoint: str, key: str, url: str, body: dict, etag: str = None, last_modified: str = None):
+        entry = {'body': body, 'etag': etag, 'last_modified': last_modified, 'stored_at': time.time()}
+        with self.lock:
+            self._remember(key, entry)
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (key, endpoint, url, json.dumps(body), etag, last_modified, entry['stored_at']))
+            self.connection.commit()
+            self.stats['store'] += 1
+
+    def revalidated(self, key: str, entry: dict):
+        # CKAN answered 304 Not Modified: the entry is fresh again
+        entry['stored_at'] = time.time()
+        with self.lock:
+            self._remember(key, entry)
+            self.connection.execute("UPDATE responses SET stored_at = ? WHERE key = ?", (entry['stored_at'], key))
+            self.connection.commit()
+            self.stats['revalidated'] += 1
+
+    def conditional_headers(self, entry: dict) -> dict:
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def report(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        hits = stats.get('memory_hit', 0) + stats.get('disk_hit', 0) + stats.get('revalidated', 0)
+        requests = hits + stats.get('miss', 0) + stats.get('stale', 0) - stats.get('revalidated', 0)
+        stats['hit_ratio'] = round(hits / requests, 3) if requests else 0.0
+        return stats
+
+    def entries(self) -> dict:
+        # stored responses per API action
+        with self.lock:
+            rows = self.connection.execute("SELECT endpoint, COUNT(*) FROM responses GROUP BY endpoint").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import argparse
+from collections import Counter
+
+# Command line of the connector scripts. The options override the environment and the .env file: they are
+# written to the environment before the modules that read their settings (config) are imported. Each command
+# imports only the modules it needs, so the light ones (stats, --help) start without requests, frictionless
+# or dplib.
+
+
+def setting(parser, option: str, env: str, help: str, **kwargs):
+    # an option of an environment setting, unset options keep the environment value
+    parser.add_argument(option, dest=env, default=None, help="{} (env {})".format(help, env), **kwargs)
+
+
+def flag(parser, option: str, env: str, help: str):
+    setting(parser, option, env, help, action='store_const', const='true')
+
+
+def apply_settings(args: argparse.Namespace):
+    for name, value in vars(args).items():
+        if name.isupper() and value is not None and value != []:
+            os.environ[name] = ','.join(value) if isinstance(value, list) else str(value)
+
+
+def add_connector_settings(parser):
+    setting(parser, '--connector-url', 'CONNECTOR_URL', "url of the connector")
+    setting(parser, '--connector-user', 'CONNECTOR_USER', "user of the connector API")
+    setting(parser, '--connector-password', 'CONNECTOR_PW', "password of the connector API")
+
+
+def add_broker_settings(parser):
+    setting(parser, '--broker-url', 'METADATA_BROKER_URL', "url of the metadata broker")
+    setting(parser, '--broker-docker-url', 'METADATA_BROKER_DOCKER_URL', "url of the broker seen by the connector")
+    setting(parser, '--sync-state', 'SYNC_STATE_DB', "file of the sync state, empty to disable it")
+    flag(parser, '--broker-full-registration', 'BROKER_FULL_REGISTRATION',
+         "register the whole connector in the broker instead of the modified offers")
+    setting(parser, '--broker-workers', 'BROKER_WORKERS', "concurrent resource messages to the broker", type=int)
+
+
+def add_shard_settings(parser):
+    setting(parser, '--shard-connectors', 'SHARD_CONNECTORS',
+            "spread the catalogs of the organizations over these connectors: url|docker_url,...")
+
+
+def add_limit_settings(parser):
+    setting(parser, '--connector-limit-initial', 'CONNECTOR_LIMIT_INITIAL',
+            "requests in flight to the connector per endpoint class at the start, adapted to its latency and errors",
+            type=int)
+    setting(parser, '--connector-limit-max', 'CONNECTOR_LIMIT_MAX',
+            "most requests in flight to the connector per endpoint class, 0 to disable the adaptive limit", type=int)
+
+
+def add_output_settings(parser):
+    setting(parser, '--metrics-json', 'METRICS_JSON', "file of the JSON summary of the requests")
+    setting(parser, '--metrics-prometheus', 'METRICS_PROMETHEUS',
+            "file of the request metrics in the Prometheus text format")
+    setting(parser, '--log-format', 'LOG_FORMAT', "plain text output or one JSON record per line",
+            choices=['text', 'json'])
+
+
+def add_import_settings(parser):
+    add_connector_settings(parser)
+    add_broker_settings(parser)
+    add_shard_settings(parser)
+    add_limit_settings(parser)
+    add_output_settings(parser)
+    setting(parser, '--connector-docker-url', 'CONNECTOR_DOCKER_URL', "url of the connector seen by the broker")
+    setting(parser, '--ckan-url', 'DATA_SOURCE_URL', "url of the CKAN portal")
+    setting(parser, '--rule', 'RULE_JSON', "file of the usage policy of the resources")
+    setting(parser, '--sample-rule', 'RULE_SAMPLE_JSON', "file of the usage policy of the samples")
+    setting(parser, '--harvest-mode', 'HARVEST_MODE',
+            "get the datasets one by one (package_show) or in bulk (package_search)", choices=['show', 'search'])
+    setting(parser, '--ckan-workers', 'CKAN_WORKERS', "datasets read from CKAN at the same time", type=int)
+    setting(parser, '--connector-workers', 'CONNECTOR_WORKERS', "offers written to the connector at the same time",
+            type=int)
+    setting(parser, '--transform-workers', 'TRANSFORM_WORKERS',
+            "processes for the schema inference and metadata transforms (0: in the import threads)", type=int)
+    flag(parser, '--force-resync', 'FORCE_RESYNC', "import all datasets, even if not modified")
+    setting(parser, '--journal', 'JOURNAL_DB', "file of the import journal, empty to disable it")
+    setting(parser, '--journal-max-attempts', 'JOURNAL_MAX_ATTEMPTS', "attempts of a failing dataset", type=int)
+    setting(parser, '--journal-keep-runs', 'JOURNAL_KEEP_RUNS',
+            "runs of each connector kept in the journal, the older ones are removed (0: keep all)", type=int)
+    setting(parser, '--ckan-cache', 'CKAN_CACHE', "file of the CKAN responses cache (disabled if empty)")
+    setting(parser, '--sample-cache', 'SAMPLE_CACHE',
+            "file of the cache of datastore samples and datapackages (disabled if empty)")
+    setting(parser, '--sample-cache-max-mb', 'SAMPLE_CACHE_MAX_MB',
+            "size of the sample cache, the least recently used samples are evicted", type=float)
+    setting(parser, '--datastore-page-size', 'DATASTORE_PAGE_SIZE', "records per datastore_search request",
+            type=int)
+    setting(parser, '--datastore-row-budget', 'DATASTORE_ROW_BUDGET', "records read per datastore", type=int)
+    setting(parser, '--inference-sample-rows', 'INFERENCE_SAMPLE_ROWS', "records used to infer the schema",
+            type=int)
+    flag(parser, '--shared-contracts', 'SHARED_CONTRACTS', "one contract per organization and usage policy")
+    setting(parser, '--contract-renewal-days', 'CONTRACT_RENEWAL_DAYS',
+            "update the dates of the contracts that end within these days, even if unchanged", type=int)
+    setting(parser, '--sample-format', 'SAMPLE_FORMAT',
+            "legacy (default): the whole sample as JSON, compact: shared schema and column-wise records",
+            choices=['compact', 'legacy'])
+    flag(parser, '--sample-gzip', 'SAMPLE_GZIP', "gzip the compact samples (base64 artifact values)")
+    setting(parser, '--sample-max-bytes', 'SAMPLE_MAX_BYTES', "size cap of a compact sample artifact", type=int)
+    setting(parser, '--download-proxy-url', 'DOWNLOAD_PROXY_URL',
+            "url of the download proxy seen by the connector, the artifacts download through it")
+    setting(parser, '--profile', 'PROFILE_DIR',
+            "write the wall time, CPU time and peak memory of each import stage to DIR", nargs='?',
+            const='profile', metavar='DIR')
+    flag(parser, '--cprofile', 'PROFILE_CPROFILE', "with --profile, also dump a cProfile per stage")
+    setting(parser, '--profile-top', 'PROFILE_TOP', "datasets in the slowest list", type=int)
+    parser.add_argument('--no-register', action='store_true', help="do not update the broker after the import")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Import the TDATA datasets as resources of the connector and "
+                                                 "register them in the broker")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('import', help="import the datasets of the dataset list or of a CKAN query")
+    setting(run, '--input', 'DATASET_LIST', "file of the dataset list, '-' to read it from stdin")
+    setting(run, '--query', 'DATASET_QUERY', "select the datasets with a package_search fq query")
+    setting(run, '--organization', 'DATASET_ORGANIZATION', "select the datasets of an organization")
+    run.add_argument('--resume', action='store_true',
+                     help="continue the last run: skip the datasets and offers already imported")
+    add_import_settings(run)
+
+    one = commands.add_parser('import-one', help="import some datasets, given by name or url")
+    one.add_argument('datasets', nargs='+', help="dataset names or urls")
+    add_import_settings(one)
+
+    register = commands.add_parser('register', help="register the connector and its resources in the broker")
+    add_connector_settings(register)
+    add_broker_settings(register)
+    add_shard_settings(register)
+    add_limit_settings(register)
+    add_output_settings(register)
+
+    shards = commands.add_parser('shards', help="connector of each organization imported before, and the catalogs "
+                                                "that the shard connectors would move, without requests")
+    setting(shards, '--sync-state', 'SYNC_STATE_DB', "file of the sync state")
+    add_shard_settings(shards)
+
+    crawl = commands.add_parser('crawl', help="crawl the catalogs of the provider connectors into the local index")
+    crawl.add_argument('CRAWLER_PROVIDERS', nargs='*', default=None, metavar='providers',
+                       help="provider connector urls (env CRAWLER_PROVIDERS)")
+    add_connector_settings(crawl)
+    setting(crawl, '--crawler-db', 'CRAWLER_DB', "file of the catalog index")
+    setting(crawl, '--workers', 'CRAWLER_WORKERS', "catalogs requested at the same time", type=int)
+    setting(crawl, '--provider-workers', 'CRAWLER_PROVIDER_WORKERS', "catalogs requested at the same time per "
+                                                                     "provider", type=int)
+    setting(crawl, '--max-age', 'CRAWLER_MAX_AGE',
+            "seconds before a catalog without modification date is requested again", type=int)
+    crawl.add_argument('--force', action='store_true', help="request and rewrite every catalog")
+
+    prune = commands.add_parser('prune', help="delete the entities of the datasets no longer in the source, and "
+                                              "the leftovers of failed imports")
+    setting(prune, '--input', 'DATASET_LIST', "file of the dataset list, '-' to read it from stdin")
+    setting(prune, '--query', 'DATASET_QUERY', "the source is the datasets of a package_search fq query")
+    setting(prune, '--organization', 'DATASET_ORGANIZATION', "the source is the datasets of an organization")
+    setting(prune, '--ckan-url', 'DATA_SOURCE_URL', "url of the CKAN portal")
+    setting(prune, '--workers', 'CONNECTOR_WORKERS', "relation listings and deletions at the same time", type=int)
+    add_connector_settings(prune)
+    add_broker_settings(prune)
+    add_shard_settings(prune)
+    add_limit_settings(prune)
+    add_output_settings(prune)
+    prune.add_argument('--dry-run', action='store_true', help="list the orphans and their size, delete nothing")
+    prune.add_argument('--no-register', action='store_true', help="do not update the broker after the deletions")
+
+    stats = commands.add_parser('stats', help="state of the last runs, caches and catalog index, without requests")
+    setting(stats, '--sync-state', 'SYNC_STATE_DB', "file of the sync state")
+    setting(stats, '--journal', 'JOURNAL_DB', "file of the import journal")
+    setting(stats, '--ckan-cache', 'CKAN_CACHE', "file of the CKAN responses cache")
+    setting(stats, '--sample-cache', 'SAMPLE_CACHE', "file of the cache of datastore samples")
+    setting(stats, '--crawler-db', 'CRAWLER_DB', "file of the catalog index")
+    stats.add_argument('--runs', type=int, default=5, help="runs of the journal")
+    return parser
+
+
+def get_stats(runs: int = 5) -> dict:
+    # only the state files that exist are opened, none is created
+    import config
+    stats = {}
+    if config.JOURNAL_DB and os.path.exists(config.JOURNAL_DB):
+        import import_journal
+        journal = import_journal.ImportJournal(config.JOURNAL_DB)
+        stats['journal'] = {'path': config.JOURNAL_DB, 'runs': journal.runs(runs)}
+        journal.close()
+    if config.SYNC_STATE_DB and os.path.exists(config.SYNC_STATE_DB):
+        import sync_state
+        state = sync_state.SyncState(config.SYNC_STATE_DB)
+        stats['sync_state'] = {'path': config.SYNC_STATE_DB, 'connectors': state.summary(),
+                               'sharded_organizations': len(state.shards())}
+        state.close()
+    if config.CKAN_CACHE and os.path.exists(config.CKAN_CACHE):
+        import ckan_cache
+        cache = ckan_cache.ResponseCache(config.CKAN_CACHE)
+        stats['ckan_cache'] = {'path': config.CKAN_CACHE, 'entries': cache.entries()}
+        cache.close()
+    if config.SAMPLE_CACHE and os.path.exists(config.SAMPLE_CACHE):
+        import sample_cache
+        cache = sample_cache.SampleCache(config.SAMPLE_CACHE, read_only=True)
+        entries, size = cache.size()
+        stats['sample_cache'] = {'path': config.SAMPLE_CACHE, 'entries': entries, 'bytes': size}
+        cache.close()
+    if config.CRAWLER_DB and os.path.exists(config.CRAWLER_DB):
+        import catalog_crawler
+        index = catalog_crawler.CatalogIndex(config.CRAWLER_DB)
+        stats['catalog_index'] = dict(index.stats(), path=config.CRAWLER_DB)
+        index.close()
+    return stats
+
+
+def get_shards() -> dict:
+    # the rebalancing of the organizations recorded in the sync state over the configured shard connectors
+    import config
+    import sharding
+    import sync_state
+    if not (config.SYNC_STATE_DB and os.path.exists(config.SYNC_STATE_DB)):
+        return {}
+    state = sync_state.SyncState(config.SYNC_STATE_DB)
+    shards = state.shards()
+    state.close()
+    connectors = sharding.parse_connectors(config.SHARD_CONNECTORS)
+    ring = sharding.HashRing(list(connectors)) if connectors else None
+    assignments = {organization_id: shard['connector_url'] for organization_id, shard in shards.items()}
+    moves = sharding.moves(assignments, ring) if ring is not None else {}
+    return {
+        'path': config.SYNC_STATE_DB,
+        'organizations': len(shards),
+        'connectors': dict(Counter(assignments.values())),
+        'rebalanced': dict(Counter(ring.assign(assignments).values())) if ring is not None else None,
+        'moves': {shards[organization_id]['name']: {'from': previous, 'to': current}
+                  for organization_id, (previous, current) in moves.items()},
+    }
+
+
+def main(argv: list = None) -> int:
+    # the exit status: not 0 when an import leaves failed datasets
+    args = get_parser().parse_args(argv)
+    apply_settings(args)
+
+    if args.command in ('import', 'import-one'):
+        import main as importer
+        return importer.main(datasets=args.datasets if args.command == 'import-one' else None,
+                             resume=args.command == 'import' and args.resume, register=not args.no_register)
+    elif args.command == 'register':
+        import main as importer
+        importer.register()
+    elif args.command == 'prune':
+        import main as importer
+        importer.prune(dry_run=args.dry_run, register=not args.no_register)
+    elif args.command == 'shards':
+        json.dump(get_shards(), sys.stdout, indent=2)
+        print()
+    elif args.command == 'crawl':
+        import catalog_crawler
+        catalog_crawler.main(['crawl'] + (['--force'] if args.force else []))
+    else:
+        json.dump(get_stats(args.runs), sys.stdout, indent=2, default=str)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,33 @@
 #!/usr/bin/env python
-import requests
+import http_client
+import ckan_cache
 from requests.exceptions import HTTPError
 import csv
 
 # constants
 LANGS = ["es", "ca", "en"]
+PACKAGE_SEARCH_ROWS = 1000
+ORGANIZATION_LIST_LIMIT = 25
+
+# opt-in cache of the GET responses, see enable_cache
+_cache = None
+
+
+def enable_cache(path: str, ttls: dict = None) -> ckan_cache.ResponseCache:
+    global _cache
+    _cache = ckan_cache.ResponseCache(path, ttls=ttls)
+    return _cache
+
+
+def get_cache() -> ckan_cache.ResponseCache:
+    return _cache
 
 
 def ckan_api_request(ckan_url: str, endpoint: str, method: str, data: dict = {},
                      params: dict = {}, files: list = [],
                      token: str = None,
                      content: str = 'application/json',
-                     verbose=True) -> (int, dict):
+                     verbose=True, cache=True) -> (int, dict):
 
     api_url = "{}/api/3/action/".format(ckan_url)
 
@@ -22,17 +38,34 @@ def ckan_api_request(ckan_url: str, endpoint: str, method: str, data: dict = {},
     if content:
         headers['Content-Type'] = content
 
+    # cached response, if still fresh
+    cached = None
+    use_cache = cache and _cache is not None and method != 'post' and not token and _cache.cacheable(endpoint)
+    if use_cache:
+        key = ckan_cache.cache_key('{}{}'.format(api_url, endpoint), params)
+        cached = _cache.lookup(endpoint, key)
+        if cached is not None and cached['fresh']:
+            return 0, cached['body']
+        headers.update(_cache.conditional_headers(cached))
+
     # do the actual call
     try:
         if method == 'post':
-            response = requests.post('{}{}'.format(api_url, endpoint), json=data, params=params,
-                                     files=files, headers=headers)
+            response = http_client.post('{}{}'.format(api_url, endpoint), json=data, params=params,
+                                        files=files, headers=headers)
         else:
-            response = requests.get('{}{}'.format(api_url, endpoint), params=params, headers=headers)
+            response = http_client.get('{}{}'.format(api_url, endpoint), params=params, headers=headers)
+
+        if use_cache and cached is not None and response.status_code == 304:
+            _cache.revalidated(key, cached)
+            return 0, cached['body']
 
         # If the response was successful, no Exception will be raised
         response.raise_for_status()
         result = response.json()
+        if use_cache:
+            _cache.store(endpoint, key, '{}{}'.format(api_url, endpoint), result, response.headers.get('ETag'),
+                         response.headers.get('Last-Modified'))
         return 0, result
 
     except HTTPError as http_err:
@@ -47,6 +80,43 @@ def ckan_api_request(ckan_url: str, endpoint: str, method: str, data: dict = {},
     return -1, result
 
 
+def ckan_package_search(ckan_url: str, q: str = "*:*", fq: str = None, rows: int = PACKAGE_SEARCH_ROWS,
+                        verbose=True):
+    # yield all the datasets matching the query, paging through package_search
+    start = 0
+    while True:
+        params = {"q": q, "rows": rows, "start": start, "sort": "name asc"}
+        if fq:
+            params["fq"] = fq
+        success, result = ckan_api_request(ckan_url, endpoint="package_search", method="get", params=params,
+                                           verbose=verbose)
+        if success < 0:
+            raise Exception("ERROR: package_search {} failed on {}: {}".format(params, ckan_url, result))
+        datasets = result["result"]["results"]
+        yield from datasets
+        start += len(datasets)
+        if len(datasets) == 0 or start >= result["result"]["count"]:
+            break
+
+
+def ckan_organization_list(ckan_url: str, limit: int = ORGANIZATION_LIST_LIMIT, verbose=True) -> dict:
+    # all the organizations with all their fields, by name (all_fields responses are capped, so page them)
+    organizations = {}
+    offset = 0
+    while True:
+        params = {"all_fields": True, "include_extras": True, "limit": limit, "offset": offset}
+        success, result = ckan_api_request(ckan_url, endpoint="organization_list", method="get", params=params,
+                                           verbose=verbose)
+        if success < 0:
+            raise Exception("ERROR: organization_list failed on {}: {}".format(ckan_url, result))
+        for organization in result["result"]:
+            organizations[organization["name"]] = organization
+        offset += len(result["result"])
+        if len(result["result"]) < limit:
+            break
+    return organizations
+
+
 def read_groups(file_path: str) -> list:
     # read the groups file
     print(" - Read input file: {}".format(file_path))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import time
+import threading
+from collections import Counter
+from email.utils import parsedate_to_datetime
+
+# defaults, overridden by the CONNECTOR_LIMIT_* settings
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 32
+# a class whose smoothed latency is over LATENCY_TOLERANCE times its baseline is congested
+LATENCY_TOLERANCE = 2.0
+BACKOFF_RATIO = 0.5
+LATENCY_SMOOTHING = 0.2
+# the baseline latency rises slowly, so a connector that stays slower (a bigger database) is not taken for a
+# congested one forever
+BASELINE_DRIFT = 1.002
+MAX_RETRY_AFTER = 120
+# the connector did not process the request: retried with any method after Retry-After
+OVERLOAD_STATUS = (429, 503)
+ERROR_STATUS = (500, 502, 504)
+
+
+def endpoint_class(method: str, path: str) -> str:
+    # collection scans (GET of the collections and relation pages), entity writes (POST/PUT/DELETE of an
+    # entity), link POSTs (the relations of an entity) and the IDS messages sent by the connector
+    parts = [part for part in path.split('/') if part]
+    if parts[:2] == ['api', 'ids']:
+        return 'message'
+    if method == 'GET':
+        return 'scan'
+    return 'link' if len(parts) >= 4 else 'write'
+
+
+def retry_after_seconds(value: str) -> float:
+    # Retry-After in seconds or as an HTTP date
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class AdaptiveLimit:
+    # AIMD limit of the requests in flight of an endpoint class: +1 per round of successful requests,
+    # halved when the requests are throttled (429/503), fail or get slower than the baseline latency. A
+    # Retry-After stops the class until it expires.
+
+    def __init__(self, initial: int = INITIAL_LIMIT, minimum: int = MIN_LIMIT, maximum: int = MAX_LIMIT):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.stats = Counter()
+        self.lowest = self.limit
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.blocked_until > now:
+                    self.condition.wait(self.blocked_until - now)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.in_flight)
+
+    def release(self, seconds: float, status: int = None, error: bool = False, retry_after: float = None):
+        with self.condition:
+            self.in_flight -= 1
+            self.stats['requests'] += 1
+            throttled = status in OVERLOAD_STATUS
+            failed = error or status in ERROR_STATUS
+            self.stats['throttled'] += 1 if throttled else 0
+            self.stats['errors'] += 1 if failed else 0
+            congested = False
+            if not (throttled or failed):
+                self.latency = seconds if self.latency is None else \
+                    (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * seconds
+                self.baseline = self.latency if self.baseline is None else \
+                    min(self.baseline * BASELINE_DRIFT, self.latency)
+                congested = self.latency > LATENCY_TOLERANCE * self.baseline
+            now = time.monotonic()
+            if throttled or failed or congested:
+                # once per round trip: the requests in flight when the connector slowed down report the same
+                # congestion
+                if now - self.last_decrease > (self.latency or seconds):
+                    self.limit = max(self.minimum, self.limit * BACKOFF_RATIO)
+                    self.lowest = min(self.lowest, self.limit)
+                    self.last_decrease = now
+                    self.stats['decreases'] += 1
+            elif self.in_flight + 1 >= int(self.limit):
+                # only a limit in use grows, the requests of an idle class say nothing of the connector capacity
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                self.stats['retry_after'] += 1
+            self.condition.notify_all()
+
+    def report(self) -> dict:
+        with self.condition:
+            return dict(self.stats, limit=round(self.limit, 1), lowest=round(self.lowest, 1),
+                        latency_ms=round(self.latency * 1000, 1) if self.latency is not None else None,
+                        baseline_ms=round(self.baseline * 1000, 1) if self.baseline is not None else None)
+
+
+class ConcurrencyLimiter:
+    # The adaptive limits of the endpoint classes of a connector
+
+    def __init__(self, initial: int = INITIAL_LIMIT, minimum: int = MIN_LIMIT, maximum: int = MAX_LIMIT):
+        self.settings = (initial, minimum, maximum)
+        self.lock = threading.Lock()
+        self.limits = {}
+
+    def get(self, method: str, path: str) -> AdaptiveLimit:
+        name = endpoint_class(method, path)
+        with self.lock:
+            if name not in self.limits:
+                self.limits[name] = AdaptiveLimit(*self.settings)
+            return self.limits[name]
+
+    def report(self) -> dict:
+        with self.lock:
+            limits = dict(self.limits)
+        return {name: limit.report() for name, limit in sorted(limits.items())}
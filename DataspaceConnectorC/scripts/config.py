@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import os
+from dotenv import load_dotenv
+
+import sample_cache
+import import_journal
+import sample_encoding
+import concurrency_limiter
+
+# Settings of the scripts, from the environment and the .env file. The variables already set win over the
+# .env file, so the options of cli.py override both (cli.py sets them before importing the other modules).
+load_dotenv('.env')
+
+
+def env_flag(name: str) -> bool:
+    return os.getenv(name, '').lower() in ('1', 'true', 'yes')
+
+
+METADATA_BROKER_URL = os.getenv("METADATA_BROKER_URL")
+METADATA_BROKER_DOCKER_URL = os.getenv("METADATA_BROKER_DOCKER_URL")
+CONNECTOR_URL = os.getenv("CONNECTOR_URL")
+CONNECTOR_DOCKER_URL = os.getenv("CONNECTOR_DOCKER_URL")
+CONNECTOR_USER = os.getenv('CONNECTOR_USER')
+CONNECTOR_PW = os.getenv('CONNECTOR_PW')
+DATA_SOURCE_URL = os.getenv('DATA_SOURCE_URL')
+DATASET_LIST = os.getenv('DATASET_LIST')
+RULE_JSON = os.getenv('RULE_JSON')
+RULE_SAMPLE_JSON = os.getenv('RULE_SAMPLE_JSON')
+
+CKAN_WORKERS = int(os.getenv('CKAN_WORKERS', 1))
+CONNECTOR_WORKERS = int(os.getenv('CONNECTOR_WORKERS', 1))
+CONNECTOR_LIMIT_INITIAL = int(os.getenv('CONNECTOR_LIMIT_INITIAL', concurrency_limiter.INITIAL_LIMIT))
+CONNECTOR_LIMIT_MAX = int(os.getenv('CONNECTOR_LIMIT_MAX', concurrency_limiter.MAX_LIMIT))
+SYNC_STATE_DB = os.getenv('SYNC_STATE_DB', 'sync_state.db')
+FORCE_RESYNC = env_flag('FORCE_RESYNC')
+HARVEST_MODE = os.getenv('HARVEST_MODE', 'show')
+DATASET_QUERY = os.getenv('DATASET_QUERY')
+DATASET_ORGANIZATION = os.getenv('DATASET_ORGANIZATION')
+
+DATASTORE_PAGE_SIZE = int(os.getenv('DATASTORE_PAGE_SIZE', 1000))
+DATASTORE_ROW_BUDGET = int(os.getenv('DATASTORE_ROW_BUDGET', 10000))
+INFERENCE_SAMPLE_ROWS = int(os.getenv('INFERENCE_SAMPLE_ROWS', 1000))
+CKAN_CACHE = os.getenv('CKAN_CACHE')
+SAMPLE_CACHE = os.getenv('SAMPLE_CACHE')
+SAMPLE_CACHE_MAX_MB = float(os.getenv('SAMPLE_CACHE_MAX_MB', sample_cache.MAX_BYTES / 1024 / 1024))
+METRICS_JSON = os.getenv('METRICS_JSON')
+METRICS_PROMETHEUS = os.getenv('METRICS_PROMETHEUS')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+BROKER_WORKERS = int(os.getenv('BROKER_WORKERS', 4))
+BROKER_FULL_REGISTRATION = env_flag('BROKER_FULL_REGISTRATION')
+TRANSFORM_WORKERS = int(os.getenv('TRANSFORM_WORKERS', 0))
+JOURNAL_DB = os.getenv('JOURNAL_DB', 'import_journal.db')
+JOURNAL_MAX_ATTEMPTS = int(os.getenv('JOURNAL_MAX_ATTEMPTS', import_journal.MAX_ATTEMPTS))
+JOURNAL_KEEP_RUNS = int(os.getenv('JOURNAL_KEEP_RUNS', import_journal.KEEP_RUNS))
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+PROFILE_CPROFILE = env_flag('PROFILE_CPROFILE')
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', 10))
+
+SHARED_CONTRACTS = env_flag('SHARED_CONTRACTS')
+# connector_index.RENEWAL_DAYS, not imported: config is read by the commands that start without requests
+CONTRACT_RENEWAL_DAYS = int(os.getenv('CONTRACT_RENEWAL_DAYS', 365))
+SAMPLE_FORMAT = os.getenv('SAMPLE_FORMAT', 'legacy')
+SAMPLE_GZIP = env_flag('SAMPLE_GZIP')
+SAMPLE_MAX_BYTES = int(os.getenv('SAMPLE_MAX_BYTES', sample_encoding.MAX_BYTES))
+DOWNLOAD_PROXY_URL = os.getenv('DOWNLOAD_PROXY_URL')
+SHARD_CONNECTORS = os.getenv('SHARD_CONNECTORS', '')
+
+CRAWLER_DB = os.getenv('CRAWLER_DB', 'catalog_index.db')
+CRAWLER_PROVIDERS = [url.strip() for url in os.getenv('CRAWLER_PROVIDERS', '').split(',') if url.strip()]
+CRAWLER_WORKERS = int(os.getenv('CRAWLER_WORKERS', 8))
+CRAWLER_PROVIDER_WORKERS = int(os.getenv('CRAWLER_PROVIDER_WORKERS', 2))
+CRAWLER_MAX_AGE = int(os.getenv('CRAWLER_MAX_AGE', 3600))
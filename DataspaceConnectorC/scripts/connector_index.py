@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+import json
+import hashlib
+import datetime
+import threading
+import http_client
+
+# name of the embedded list in the HAL collection responses when it differs from the collection name
+EMBEDDED_NAMES = {'offers': 'resources'}
+
+# fields left out of the payload hash: the contract validity dates are computed from the current date
+VOLATILE_FIELDS = ['start', 'end', 'payload_hash']
+# an unchanged contract is still updated, with new validity dates, once it ends within this many days
+RENEWAL_DAYS = 365
+
+# relations whose children are all set by the importer each time the parent is imported: the children linked
+# before and not set anymore (a per-resource contract replaced by a shared one) are unlinked. The offers of a
+# catalog come from many datasets, they are only added.
+EXCLUSIVE_RELATIONS = ['contracts', 'rules', 'representations', 'artifacts']
+
+# one index per connector, shared by all the upserts of a run
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(connector_url: str, auth: tuple) -> 'EntityIndex':
+    with _indexes_lock:
+        index = _indexes.get(connector_url)
+        if index is None:
+            index = EntityIndex(connector_url, auth)
+            _indexes[connector_url] = index
+    return index
+
+
+def reset():
+    # a new run: the entities are listed again from the connectors
+    with _indexes_lock:
+        _indexes.clear()
+
+
+def entity_url(entity: dict) -> str:
+    return entity["_links"]["self"]["href"]
+
+
+def entity_key(entity: dict, key: str):
+    return entity.get("additional", {}).get(key)
+
+
+def payload_hash(data: dict) -> str:
+    canonical = json.dumps({k: v for k, v in data.items() if k not in VOLATILE_FIELDS}, sort_keys=True,
+                           separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def expires_within(entity: dict, days: int = RENEWAL_DAYS) -> bool:
+    # the end of the validity of a contract is close, or cannot be read
+    end = entity.get('end') or entity_key(entity, 'end')
+    try:
+        end = datetime.datetime.fromisoformat(end.replace('Z', '+00:00')).replace(tzinfo=None)
+    except (AttributeError, ValueError):
+        return True
+    return end - datetime.datetime.now() < datetime.timedelta(days=days)
+
+
+def with_payload_hash(data: dict) -> dict:
+    # copy of the entity payload with its hash, the connector keeps it in the 'additional' data
+    return dict(data, payload_hash=payload_hash(data))
+
+
+def merge_entity(entity: dict, data: dict) -> dict:
+    # local view of the entity after a PUT of data: known attributes are replaced, others go to 'additional'
+    merged = dict(entity)
+    additional = {}
+    for k, v in data.items():
+        if k in entity and not k.startswith('_') and k != 'additional':
+            merged[k] = v
+        else:
+            additional[k] = v if isinstance(v, str) else json.dumps(v)
+    merged['additional'] = additional
+    return merged
+
+
+class EntityIndex:
+    # In-memory view of the connector entities, looked up by a field of their 'additional' data
+    # (resource_id, organization_id...). Each collection is listed once, on first use, and then kept
+    # up to date with the entities returned by the POST/PUT requests of the importer. It is shared by
+    # the import workers, so every access goes through the lock.
+
+    def __init__(self, connector_url: str, auth: tuple):
+        self.connector_url = connector_url
+        self.auth = auth
+        self.entities = {}
+        self.keys = {}
+        self.created = set()
+        self.children = {}
+        self.lock = threading.RLock()
+
+    def load(self, entity_name: str) -> dict:
+        with self.lock:
+            if entity_name not in self.entities:
+                self.entities[entity_name] = self.list_collection(entity_name)
+            return self.entities[entity_name]
+
+    def list_collection(self, entity_name: str) -> dict:
+        request_url = "{0}/api/{1}".format(self.connector_url, entity_name)
+        return {entity_url(entity): entity for entity in self.list_pages(request_url, entity_name)}
+
+    def list_pages(self, request_url: str, entity_name: str) -> list:
+        entities = []
+        while request_url is not None:
+            response = http_client.get(request_url, data={}, auth=self.auth, verify=False)
+            print(" \t\t\t\t - Request GET {0} {1}\t => {2}".format(entity_name, request_url, response.status_code))
+            response.raise_for_status()
+            result = json.loads(response.content)
+            entities += result.get('_embedded', {}).get(EMBEDDED_NAMES.get(entity_name, entity_name), [])
+            request_url = result.get('_links', {}).get("next", {}).get("href")
+        return entities
+
+    def key_map(self, entity_name: str, key: str) -> dict:
+        with self.lock:
+            if (entity_name, key) not in self.keys:
+                key_map = {}
+                for url, entity in self.load(entity_name).items():
+                    key_map.setdefault(entity_key(entity, key), set()).add(url)
+                self.keys[(entity_name, key)] = key_map
+            return self.keys[(entity_name, key)]
+
+    def find(self, entity_name: str, key: str, value: str) -> list:
+        with self.lock:
+            entities = self.load(entity_name)
+            return [entities[url] for url in sorted(self.key_map(entity_name, key).get(value, []))]
+
+    def add(self, entity_name: str, entity: dict, created: bool = False):
+        with self.lock:
+            entities = self.load(entity_name)
+            url = entity_url(entity)
+            if created:
+                self.created.add(url)
+            previous = entities.get(url)
+            for (name, key), key_map in self.keys.items():
+                if name != entity_name:
+                    continue
+                if previous is not None:
+                    key_map.get(entity_key(previous, key), set()).discard(url)
+                key_map.setdefault(entity_key(entity, key), set()).add(url)
+            entities[url] = entity
+
+    def remove(self, entity_name: str, url: str):
+        # an entity deleted in the connector, and its links
+        with self.lock:
+            entity = self.load(entity_name).pop(url, None)
+            for (name, key), key_map in self.keys.items():
+                if name == entity_name and entity is not None:
+                    key_map.get(entity_key(entity, key), set()).discard(url)
+            for (parent_url, relation), children in list(self.children.items()):
+                if parent_url == url:
+                    del self.children[(parent_url, relation)]
+                else:
+                    children.discard(url)
+
+    def linked(self, parent_url: str, relation: str) -> set:
+        # urls of the entities already linked to the parent, the parents created in this run have none
+        key = (parent_url, relation)
+        with self.lock:
+            if key not in self.children and parent_url in self.created:
+                self.children[key] = set()
+            if key in self.children:
+                return self.children[key]
+        children = {entity_url(e) for e in self.list_pages("{}/{}".format(parent_url, relation), relation)}
+        with self.lock:
+            return self.children.setdefault(key, children)
+
+    def add_links(self, parent_url: str, relation: str, urls: list):
+        with self.lock:
+            self.children.setdefault((parent_url, relation), set()).update(urls)
+
+    def remove_links(self, parent_url: str, relation: str, urls: list):
+        with self.lock:
+            self.children.get((parent_url, relation), set()).difference_update(urls)
+
+
+class LinkBatch:
+    # Links between connector entities, collected per parent entity and relation while the entities are
+    # upserted, and sent with one POST per parent. Links that already exist in the connector are skipped, and
+    # the stale children of the EXCLUSIVE_RELATIONS are unlinked with one DELETE per parent.
+
+    def __init__(self, index: EntityIndex):
+        self.index = index
+        self.links = {}
+        self.lock = threading.Lock()
+
+    def add(self, parent: dict, relation: str, child: dict):
+        self.add_url(entity_url(parent), relation, entity_url(child))
+
+    def add_url(self, parent_url: str, relation: str, child_url: str):
+        with self.lock:
+            children = self.links.setdefault((parent_url, relation), [])
+            if child_url not in children:
+                children.append(child_url)
+
+    def pending(self) -> list:
+        # the links not sent yet, as [parent_url, relation, child_url]
+        with self.lock:
+            return [[parent_url, relation, url] for (parent_url, relation), urls in self.links.items() for url in urls]
+
+    def extend(self, links: list):
+        for parent_url, relation, child_url in links:
+            self.add_url(parent_url, relation, child_url)
+
+    def flush(self) -> int:
+        with self.lock:
+            links, self.links = self.links, {}
+        requests_sent = 0
+        for (parent_url, relation), children in links.items():
+            existing = self.index.linked(parent_url, relation)
+            with self.index.lock:
+                missing = [url for url in children if url not in existing]
+                stale = sorted(existing - set(children)) if relation in EXCLUSIVE_RELATIONS else []
+            request_url = "{}/{}".format(parent_url, relation)
+            if missing:
+                response = http_client.post(request_url, json=missing, auth=self.index.auth, verify=False)
+                print(" \t\t\t\t - Request POST add {0} {1} {2} \t => {3}".format(len(missing), relation,
+                                                                                request_url, response.status_code))
+                response.raise_for_status()
+                self.index.add_links(parent_url, relation, missing)
+                requests_sent += 1
+            if stale:
+                response = http_client.delete(request_url, json=stale, auth=self.index.auth, verify=False)
+                print(" \t\t\t\t - Request DELETE remove {0} {1} {2} \t => {3}".format(len(stale), relation,
+                                                                                     request_url,
+                                                                                     response.status_code))
+                response.raise_for_status()
+                self.index.remove_links(parent_url, relation, stale)
+                requests_sent += 1
+        return requests_sent
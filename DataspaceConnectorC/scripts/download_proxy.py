@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, quote
+
+# Caching proxy of the artifact downloads of the connector: GET /download?url=<resource url> serves the resource
+# from a disk cache, revalidated with ETag / Last-Modified once older than PROXY_MAX_AGE, with range requests and
+# sendfile responses. Only the standard library is used, so it runs in a bare python image next to the connector.
+
+PROXY_HOST = os.getenv('PROXY_HOST', '0.0.0.0')
+PROXY_PORT = int(os.getenv('PROXY_PORT', 8090))
+PROXY_CACHE_DIR = os.getenv('PROXY_CACHE_DIR', 'download_cache')
+PROXY_MAX_BYTES = int(os.getenv('PROXY_MAX_BYTES', 5 * 1024 ** 3))
+PROXY_MAX_AGE = int(os.getenv('PROXY_MAX_AGE', 3600))
+PROXY_TIMEOUT = int(os.getenv('PROXY_TIMEOUT', 60))
+PROXY_WARM_WORKERS = int(os.getenv('PROXY_WARM_WORKERS', 4))
+# hosts the proxy downloads from, by default the CKAN portal
+PROXY_ALLOWED_HOSTS = [host.strip() for host in os.getenv('PROXY_ALLOWED_HOSTS', '').split(',') if host.strip()] or \
+                      [urlsplit(url).hostname for url in [os.getenv('DATA_SOURCE_URL')] if url]
+DATA_SOURCE_URL = os.getenv('DATA_SOURCE_URL')
+DATASET_LIST = os.getenv('DATASET_LIST')
+
+CHUNK_SIZE = 1024 * 1024
+# locks of the downloads in progress, a url uses the lock of its hash: the locks do not grow with the urls
+LOCK_STRIPES = 64
+
+
+def proxy_url(proxy_base_url: str, url: str) -> str:
+    # url of a resource through the proxy
+    return "{}/download?url={}".format(proxy_base_url.rstrip('/'), quote(url, safe=''))
+
+
+def parse_range(header: str, size: int) -> (int, int):
+    # first and last byte of a single "bytes=" range, None to send the whole file (no or multiple ranges),
+    # ValueError if the range cannot be satisfied
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, last = header[len('bytes='):].split('-', 1)
+    if first.strip() == '':
+        length = int(last)
+        if length <= 0:
+            raise ValueError(header)
+        first, last = max(0, size - length), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last.strip() else size - 1
+    if first > last or first >= size:
+        raise ValueError(header)
+    return first, last
+
+
+class AllowedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # urllib follows the redirects by itself: each target is checked like the requested url, so a redirect cannot
+    # send the proxy to a host that is not allowed
+
+    def __init__(self, allowed):
+        super().__init__()
+        self.allowed = allowed
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not self.allowed(newurl):
+            raise urllib.error.HTTPError(newurl, 403, "Redirect to a host not allowed: {}".format(newurl), headers,
+                                         fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class UpstreamError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class DownloadCache:
+    # Files downloaded from the allowed hosts, in cache_dir, indexed by url in a SQLite file. An entry is served
+    # without asking the origin for max_age seconds, then revalidated with If-None-Match / If-Modified-Since.
+    # When the origin fails, the stale entry is served. The least recently used files are removed once the
+    # cache holds more than max_bytes.
+
+    def __init__(self, cache_dir: str = PROXY_CACHE_DIR, max_bytes: int = PROXY_MAX_BYTES,
+                 max_age: int = PROXY_MAX_AGE, allowed_hosts: list = None, timeout: int = PROXY_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.allowed_hosts = PROXY_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(AllowedRedirectHandler(self.allowed))
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.url_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        os.makedirs(os.path.join(cache_dir, 'data'), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_type TEXT,
+                size INTEGER,
+                stored_at REAL,
+                validated_at REAL,
+                used_at REAL
+            )""")
+        self.connection.commit()
+
+    def allowed(self, url: str) -> bool:
+        parts = urlsplit(url)
+        return parts.scheme in ('http', 'https') and parts.hostname in self.allowed_hosts
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, 'data', key[:2], key)
+
+    def lookup(self, key: str) -> dict:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT url, etag, last_modified, content_type, size, validated_at FROM downloads WHERE key = ?",
+                (key,)).fetchone()
+        if row is None or not os.path.exists(self.path(key)):
+            return None
+        return {'key': key, 'url': row[0], 'etag': row[1], 'last_modified': row[2], 'content_type': row[3],
+                'size': row[4], 'validated_at': row[5], 'path': self.path(key)}
+
+    def touch(self, key: str, validated: bool = False):
+        now = time.time()
+        with self.lock:
+            if validated:
+                self.connection.execute("UPDATE downloads SET validated_at = ?, used_at = ? WHERE key = ?",
+                                        (now, now, key))
+            else:
+                self.connection.execute("UPDATE downloads SET used_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+
+    def url_lock(self, key: str) -> threading.Lock:
+        # one download of a url at a time, the other requests wait for it
+        return self.url_locks[int(key[:8], 16) % len(self.url_locks)]
+
+    def fetch(self, url: str, force: bool = False) -> dict:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        with self.url_lock(key):
+            entry = self.lookup(key)
+            if entry is not None and not force and time.time() - entry['validated_at'] < self.max_age:
+                self.count('hit')
+                self.touch(key)
+                return entry
+            headers = {}
+            if entry is not None and entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry is not None and entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                response = self.opener.open(urllib.request.Request(url, headers=headers), timeout=self.timeout)
+            except urllib.error.HTTPError as err:
+                if err.code == 304 and entry is not None:
+                    self.count('revalidated')
+                    self.touch(key, validated=True)
+                    return entry
+                if entry is not None and err.code >= 500:
+                    self.count('stale')
+                    return entry
+                raise UpstreamError(err.code, "{} => {}".format(url, err.reason))
+            except (urllib.error.URLError, OSError) as err:
+                if entry is not None:
+                    self.count('stale')
+                    return entry
+                raise UpstreamError(502, "{} => {}".format(url, err))
+            with response:
+                entry = self.store(key, url, response)
+            self.count('miss')
+            return entry
+
+    def open_entry(self, url: str) -> (dict, object):
+        # the entry of a url and its open file, which stays readable when the entry is replaced or evicted. It is
+        # opened under the cache lock, so the eviction cannot remove it meanwhile; if it was evicted between the
+        # fetch and the open, it is downloaded again.
+        for attempt in range(2):
+            entry = self.fetch(url)
+            with self.lock:
+                try:
+                    return entry, open(entry['path'], 'rb')
+                except FileNotFoundError:
+                    if attempt:
+                        raise
+        return None
+
+    def store(self, key: str, url: str, response) -> dict:
+        # the file is written aside and moved in place, requests being served keep reading the previous one
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = 0
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.download_')
+        try:
+            with os.fdopen(descriptor, 'wb') as target:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        now = time.time()
+        entry = {'key': key, 'url': url, 'etag': response.headers.get('ETag'),
+                 'last_modified': response.headers.get('Last-Modified'),
+                 'content_type': response.headers.get('Content-Type', 'application/octet-stream'), 'size': size,
+                 'validated_at': now, 'path': path}
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (key, url, entry['etag'], entry['last_modified'], entry['content_type'], size,
+                                     now, now, now))
+            self.connection.commit()
+            self.stats['downloaded_bytes'] += size
+            self.evict(keep=key)
+        return entry
+
+    def evict(self, keep: str = None):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM downloads").fetchone()[0]
+        for key, size in self.connection.execute("SELECT key, size FROM downloads ORDER BY used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.connection.execute("DELETE FROM downloads WHERE key = ?", (key,))
+            if os.path.exists(self.path(key)):
+                os.unlink(self.path(key))
+            total -= size
+            self.stats['evicted'] += 1
+        self.connection.commit()
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.stats[name] += value
+
+    def report(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'], stats['bytes'] = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM downloads").fetchone()
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    def warm(self, urls: list, workers: int = PROXY_WARM_WORKERS, force: bool = False) -> dict:
+        results = Counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.fetch, url, force): url for url in urls if self.allowed(url)}
+            results['not_allowed'] = len(urls) - len(futures)
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    results['cached'] += 1
+                except UpstreamError as err:
+                    print("\t\t - *ERROR* Downloading {} => {}".format(futures[future], err))
+                    results['failed'] += 1
+        return dict(results, **self.report())
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    server_version = 'DownloadProxy/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def send_json(self, status: int, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def serve(self, send_body: bool):
+        cache = self.server.cache
+        parts = urlsplit(self.path)
+        if parts.path == '/stats':
+            return self.send_json(200, cache.report())
+        if parts.path != '/download':
+            return self.send_json(404, {'error': 'not found'})
+        url = parse_qs(parts.query).get('url', [None])[0]
+        if not url:
+            return self.send_json(400, {'error': 'missing url'})
+        if not cache.allowed(url):
+            return self.send_json(403, {'error': 'host not allowed'})
+        try:
+            entry, source = cache.open_entry(url)
+        except UpstreamError as err:
+            return self.send_json(err.status, {'error': str(err)})
+        except FileNotFoundError:
+            return self.send_json(503, {'error': 'download evicted meanwhile, try again'})
+        with source:
+            self.send_entry(entry, source, send_body)
+
+    def send_entry(self, entry: dict, source, send_body: bool):
+        if entry['etag'] and self.headers.get('If-None-Match') == entry['etag']:
+            self.send_response(304)
+            self.send_header('ETag', entry['etag'])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        # the source file may be replaced or evicted meanwhile, the open file stays readable
+        size = os.fstat(source.fileno()).st_size
+        byte_range = None
+        if self.headers.get('If-Range') in (None, entry['etag'], entry['last_modified']):
+            try:
+                byte_range = parse_range(self.headers.get('Range'), size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        first, last = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', entry['content_type'])
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if byte_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, size))
+        if entry['etag']:
+            self.send_header('ETag', entry['etag'])
+        if entry['last_modified']:
+            self.send_header('Last-Modified', entry['last_modified'])
+        self.end_headers()
+        if send_body and last >= first:
+            # zero-copy from the file to the socket (sendfile), socket.sendfile falls back to send otherwise
+            self.wfile.flush()
+            self.connection.sendfile(source, offset=first, count=last - first + 1)
+
+    def log_message(self, format, *args):
+        print(" \t\t\t\t - Request {} {}".format(self.address_string(), format % args))
+
+
+def iter_dataset_names(input_file: str):
+    # same format as the dataset list of main.py: dataset names or urls, # comments
+    source = sys.stdin if input_file == '-' else open(input_file, 'r')
+    try:
+        for line in source:
+            if len(line.strip()) > 3 and not line.strip().startswith('#'):
+                yield line.strip().split('/')[-1] if line.strip().startswith('http') else line.strip()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def get_resource_urls(dataset: str, ckan_url: str = DATA_SOURCE_URL) -> list:
+    request_url = "{}/api/3/action/package_show?id={}".format(ckan_url.rstrip('/'), quote(dataset))
+    # redirects stay in the CKAN host
+    opener = urllib.request.build_opener(AllowedRedirectHandler(
+        lambda url: urlsplit(url).hostname == urlsplit(ckan_url).hostname))
+    with opener.open(request_url, timeout=PROXY_TIMEOUT) as response:
+        metadata = json.loads(response.read())['result']
+    return [resource['url'] for resource in metadata.get('resources', []) if resource.get('url')]
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Caching proxy of the artifact downloads of the connector")
+    parser.add_argument('--cache-dir', default=PROXY_CACHE_DIR)
+    parser.add_argument('--max-bytes', type=int, default=PROXY_MAX_BYTES)
+    parser.add_argument('--max-age', type=int, default=PROXY_MAX_AGE,
+                        help="seconds a download is served before asking the origin again")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="serve the downloads")
+    serve.add_argument('--host', default=PROXY_HOST)
+    serve.add_argument('--port', type=int, default=PROXY_PORT)
+    warm = commands.add_parser('warm', help="download the resources of the datasets of the dataset list")
+    warm.add_argument('--input', default=DATASET_LIST, help="file of the dataset list, '-' to read it from stdin")
+    warm.add_argument('--ckan-url', default=DATA_SOURCE_URL)
+    warm.add_argument('--workers', type=int, default=PROXY_WARM_WORKERS)
+    warm.add_argument('--force', action='store_true', help="revalidate the fresh downloads too")
+    commands.add_parser('stats', help="downloads and size of the cache")
+    args = parser.parse_args(argv)
+
+    cache = DownloadCache(args.cache_dir, args.max_bytes, args.max_age)
+    if args.command == 'serve':
+        if not cache.allowed_hosts:
+            print(" * *WARNING* No PROXY_ALLOWED_HOSTS nor DATA_SOURCE_URL: every download will be refused")
+        server = ThreadingHTTPServer((args.host, args.port), ProxyHandler)
+        server.daemon_threads = True
+        server.cache = cache
+        print(" * Serving downloads of {} on {}:{} (cache {})".format(', '.join(cache.allowed_hosts), args.host,
+                                                                     args.port, args.cache_dir))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+    elif args.command == 'warm':
+        urls = []
+        for dataset in iter_dataset_names(args.input):
+            try:
+                urls += get_resource_urls(dataset, args.ckan_url)
+            except (urllib.error.URLError, OSError, ValueError, KeyError) as err:
+                print("\t\t - *ERROR* Requesting dataset {} => {}".format(dataset, err))
+        print(" * Warming {} downloads...".format(len(urls)))
+        print("\t\t ... Warmed: {} => OK".format(cache.warm(urls, args.workers, args.force)))
+    else:
+        print(json.dumps(cache.report(), indent=2))
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+import os
+import time
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import concurrency_limiter
+
+# defaults, overridden by the HTTP_* environment variables
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+POOL_SIZE = 10
+RETRY_STATUS = (429, 502, 503, 504)
+
+# one keep-alive session per scheme://host:port, with its auth and verify settings, and the adaptive
+# concurrency limiter of the hosts configured with one
+_sessions = {}
+_settings = {}
+_limiters = {}
+_lock = threading.Lock()
+
+
+def _env(name: str, default, cast=float):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, '') else default
+
+
+def get_timeout() -> tuple:
+    return _env('HTTP_CONNECT_TIMEOUT', CONNECT_TIMEOUT), _env('HTTP_READ_TIMEOUT', READ_TIMEOUT)
+
+
+def host_key(url: str) -> str:
+    split = urlsplit(url)
+    return "{}://{}".format(split.scheme, split.netloc)
+
+
+def configure(url: str, auth: tuple = None, verify: bool = None,
+              limiter: concurrency_limiter.ConcurrencyLimiter = None):
+    # default auth and TLS verification for every request sent to the host of url. With a limiter, the requests
+    # in flight to the host are adapted to its latency and errors, and the limiter retries the throttled ones.
+    key = host_key(url)
+    with _lock:
+        settings = _settings.setdefault(key, {})
+        if auth is not None:
+            settings['auth'] = auth
+        if verify is not None:
+            settings['verify'] = verify
+        if limiter is not None and key not in _limiters:
+            _limiters[key] = limiter
+            # the bad status are retried by the limiter, a new session is created without retrying them
+            settings['limited'] = True
+            _sessions.pop(key, None)
+        session = _sessions.get(key)
+        if session is not None:
+            _apply_settings(session, settings)
+
+
+def _apply_settings(session: requests.Session, settings: dict):
+    if 'auth' in settings:
+        session.auth = settings['auth']
+    if 'verify' in settings:
+        session.verify = settings['verify']
+
+
+def _new_session(settings: dict) -> requests.Session:
+    # only idempotent methods are retried on bad status/read errors, failed connections are retried for all
+    retry = Retry(total=_env('HTTP_RETRIES', RETRIES, int), backoff_factor=_env('HTTP_BACKOFF', BACKOFF_FACTOR),
+                  status_forcelist=() if settings.get('limited') else RETRY_STATUS,
+                  allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                  respect_retry_after_header=True, raise_on_status=False)
+    pool_size = _env('HTTP_POOL_SIZE', POOL_SIZE, int)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    _apply_settings(session, settings)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    key = host_key(url)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _new_session(_settings.get(key, {}))
+            _sessions[key] = session
+    return session
+
+
+def body_size(body) -> int:
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+def get_limiter(url: str) -> concurrency_limiter.ConcurrencyLimiter:
+    with _lock:
+        return _limiters.get(host_key(url))
+
+
+def limits_report() -> dict:
+    with _lock:
+        limiters = dict(_limiters)
+    return {key: limiter.report() for key, limiter in limiters.items()}
+
+
+def _send_limited(limit: concurrency_limiter.AdaptiveLimit, method: str, url: str,
+                  **kwargs) -> (requests.Response, int):
+    # the throttled requests (429/503) are retried with any method after their Retry-After, the other bad
+    # status only with the idempotent methods
+    attempts = 0
+    while True:
+        limit.acquire()
+        start = time.perf_counter()
+        try:
+            response = get_session(url).request(method, url, **kwargs)
+        except requests.RequestException:
+            limit.release(time.perf_counter() - start, error=True)
+            raise
+        status = response.status_code
+        retry_after = concurrency_limiter.retry_after_seconds(response.headers.get('Retry-After')) \
+            if status in concurrency_limiter.OVERLOAD_STATUS else None
+        retry = status in concurrency_limiter.OVERLOAD_STATUS or \
+            (status in RETRY_STATUS and method.upper() in Retry.DEFAULT_ALLOWED_METHODS)
+        backoff = _env('HTTP_BACKOFF', BACKOFF_FACTOR) * 2 ** attempts
+        if retry and retry_after is None and status in concurrency_limiter.OVERLOAD_STATUS:
+            # throttled without Retry-After: the class waits the backoff
+            retry_after = backoff
+        limit.release(time.perf_counter() - start, status=status, retry_after=retry_after)
+        if not retry or attempts >= _env('HTTP_RETRIES', RETRIES, int):
+            return response, attempts
+        if retry_after is None:
+            time.sleep(backoff)
+        response.close()
+        attempts += 1
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    # every request is recorded in the run metrics, see metrics.py
+    kwargs.setdefault('timeout', get_timeout())
+    split = urlsplit(url)
+    limiter = get_limiter(url)
+    start = time.perf_counter()
+    limited_retries = 0
+    try:
+        if limiter is not None:
+            response, limited_retries = _send_limited(limiter.get(method, split.path), method, url, **kwargs)
+        else:
+            response = get_session(url).request(method, url, **kwargs)
+    except requests.RequestException as err:
+        seconds = time.perf_counter() - start
+        metrics.get_metrics().record(host_key(url), method, split.path, seconds, error=type(err).__name__)
+        metrics.log_request(method, url, seconds, error=type(err).__name__)
+        raise
+    seconds = time.perf_counter() - start
+    retries = getattr(response.raw, 'retries', None)
+    retries = (len(retries.history) if retries is not None else 0) + limited_retries
+    received = len(response.content) if not kwargs.get('stream') else int(response.headers.get('Content-Length', 0))
+    metrics.get_metrics().record(host_key(url), method, split.path, seconds, status=response.status_code,
+                                 retries=retries, bytes_sent=body_size(response.request.body),
+                                 bytes_received=received)
+    metrics.log_request(method, url, seconds, status=response.status_code, retries=retries, bytes_received=received)
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request('PUT', url, **kwargs)
+
+
+def delete(url: str, **kwargs) -> requests.Response:
+    return request('DELETE', url, **kwargs)
+
+
+def close():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        for key in _limiters:
+            _settings.get(key, {}).pop('limited', None)
+        _limiters.clear()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+import json
+import time
+import datetime
+import sqlite3
+import threading
+
+MAX_ATTEMPTS = 3
+# runs of each connector kept in the journal, the steps of the older ones are removed
+KEEP_RUNS = 10
+
+
+class ImportJournal:
+    # Append-only journal of the import steps of each dataset (catalog, offer with its links, links sent,
+    # done or failed), in a SQLite file. A resumed run skips the datasets already done, the datasets failed
+    # max_attempts times and, inside a dataset, the offers already imported, whose links are sent again.
+    # Only the last keep_runs runs of each connector are kept (0 keeps them all).
+
+    def __init__(self, path: str, max_attempts: int = MAX_ATTEMPTS, keep_runs: int = KEEP_RUNS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.keep_runs = keep_runs
+        self.run_id = None
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                connector_url TEXT NOT NULL,
+                source TEXT,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS steps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER NOT NULL,
+                dataset TEXT NOT NULL,
+                step TEXT NOT NULL,
+                item TEXT,
+                data TEXT,
+                at REAL
+            );
+            CREATE INDEX IF NOT EXISTS steps_dataset ON steps (run_id, dataset);""")
+        self.connection.commit()
+
+    def start(self, connector_url: str, source: str, resume: bool = False) -> int:
+        # resume continues the last run on the connector, if any
+        with self.lock:
+            row = self.connection.execute("SELECT run_id FROM runs WHERE connector_url = ? ORDER BY run_id DESC",
+                                          (connector_url,)).fetchone() if resume else None
+            if row is not None:
+                self.run_id = row[0]
+                self.connection.execute("UPDATE runs SET finished_at = NULL WHERE run_id = ?", (self.run_id,))
+            else:
+                cursor = self.connection.execute(
+                    "INSERT INTO runs (connector_url, source, started_at) VALUES (?, ?, ?)",
+                    (connector_url, source, time.time()))
+                self.run_id = cursor.lastrowid
+            self.connection.commit()
+        return self.run_id
+
+    def record(self, dataset: str, step: str, item: str = None, data=None):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO steps (run_id, dataset, step, item, data, at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.run_id, dataset, step, item, json.dumps(data) if data is not None else None, time.time()))
+            self.connection.commit()
+
+    def status(self, dataset: str) -> (str, int):
+        # last outcome of the dataset in the run (done, failed or None) and its failed attempts
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT step FROM steps WHERE run_id = ? AND dataset = ? AND step IN ('done', 'failed') ORDER BY id",
+                (self.run_id, dataset)).fetchall()
+        steps = [row[0] for row in rows]
+        return (steps[-1] if steps else None), steps.count('failed')
+
+    def should_import(self, dataset: str) -> bool:
+        status, attempts = self.status(dataset)
+        return status != 'done' and attempts < self.max_attempts
+
+    def imported_offers(self, dataset: str) -> dict:
+        # links of the offers of the dataset imported in the run, by resource_id
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT item, data FROM steps WHERE run_id = ? AND dataset = ? AND step = 'offer' ORDER BY id",
+                (self.run_id, dataset)).fetchall()
+        return {item: json.loads(data) for item, data in rows}
+
+    def failures(self) -> dict:
+        # datasets of the run whose last attempt failed: attempts, last error and if they will be retried
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT dataset, step, data FROM steps WHERE run_id = ? AND step IN ('done', 'failed') ORDER BY id",
+                (self.run_id,)).fetchall()
+        failures = {}
+        for dataset, step, data in rows:
+            if step == 'done':
+                failures.pop(dataset, None)
+                continue
+            attempts = failures.get(dataset, {}).get('attempts', 0) + 1
+            failures[dataset] = {'attempts': attempts, 'error': json.loads(data),
+                                 'permanent': attempts >= self.max_attempts}
+        return failures
+
+    def runs(self, limit: int = 5) -> list:
+        # last runs of all the connectors, with their datasets done and failed (not done after a failure)
+        with self.lock:
+            rows = self.connection.execute("""
+                SELECT runs.run_id, connector_url, source, started_at, finished_at,
+                       COUNT(DISTINCT CASE WHEN step = 'done' THEN dataset END),
+                       COUNT(DISTINCT CASE WHEN step = 'failed' AND dataset NOT IN (
+                           SELECT dataset FROM steps AS done WHERE done.run_id = runs.run_id AND done.step = 'done')
+                           THEN dataset END)
+                FROM runs LEFT JOIN steps ON steps.run_id = runs.run_id
+                GROUP BY runs.run_id ORDER BY runs.run_id DESC LIMIT ?""", (limit,)).fetchall()
+        return [{'run_id': run_id, 'connector_url': connector_url, 'source': source,
+                 'started_at': datetime.datetime.fromtimestamp(started_at).isoformat() if started_at else None,
+                 'finished_at': datetime.datetime.fromtimestamp(finished_at).isoformat() if finished_at else None,
+                 'done': done, 'failed': failed}
+                for run_id, connector_url, source, started_at, finished_at, done, failed in rows]
+
+    def prune(self) -> int:
+        # removes the runs of each connector older than its last keep_runs runs, and their steps
+        if not self.keep_runs:
+            return 0
+        with self.lock:
+            old_runs = [row[0] for row in self.connection.execute("""
+                SELECT run_id FROM runs AS old WHERE (
+                    SELECT COUNT(*) FROM runs AS newer
+                    WHERE newer.connector_url = old.connector_url AND newer.run_id > old.run_id) >= ?""",
+                                                                  (self.keep_runs,)).fetchall()]
+            for run_id in old_runs:
+                self.connection.execute("DELETE FROM steps WHERE run_id = ?", (run_id,))
+                self.connection.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self.connection.commit()
+        return len(old_runs)
+
+    def finish(self):
+        with self.lock:
+            self.connection.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), self.run_id))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
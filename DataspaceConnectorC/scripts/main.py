@@ -1,135 +1,73 @@
-import os
 import json
-import requests
 import commons
-import lxml.html
-from dotenv import load_dotenv
+import http_client
+import metrics
+import profiling
+import connector_index
+import policy_registry
 import datetime
-from frictionless import describe
+import sys
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-from dplib.plugins.ckan.models import CkanPackage, CkanSchema
-from dplib.models import Schema, IntegerField, GeopointField, NumberField, GeojsonField, YearmonthField, \
-                         DatetimeField, DateField
-
-load_dotenv('.env')
-
-METADATA_BROKER_URL = os.getenv("METADATA_BROKER_URL")
-METADATA_BROKER_DOCKER_URL = os.getenv("METADATA_BROKER_DOCKER_URL")
-CONNECTOR_URL = os.getenv("CONNECTOR_URL")
-CONNECTOR_DOCKER_URL = os.getenv("CONNECTOR_DOCKER_URL")
-CONNECTOR_USER = os.getenv('CONNECTOR_USER')
-CONNECTOR_PW = os.getenv('CONNECTOR_PW')
-DATA_SOURCE_URL = os.getenv('DATA_SOURCE_URL')
-DATASET_LIST = os.getenv('DATASET_LIST')
-RULE_JSON = os.getenv('RULE_JSON')
-RULE_SAMPLE_JSON = os.getenv('RULE_SAMPLE_JSON')
+# The settings are read from the environment by config, which is imported when the functions run, not with this
+# module: cli.py (the command line entry point) sets its options in the environment first. The modules of a single
+# step (sharding, journal, caches, broker sync, orphans...) are imported by the functions that use them.
 
 MAX_SAMPLE_RECORDS = 10
+SEARCH_IDS_CHUNK = 50
 
-
-def fix_multilingual(ckan_dataset_original: dict, resource_id: str, lang: str = 'es'):
-
-    ckan_dataset = ckan_dataset_original.copy()
-    ckan_dataset["notes"] = ckan_dataset["notes"].get(lang, ckan_dataset["notes"])
-    ckan_dataset["title"] = ckan_dataset["title"].get(lang, ckan_dataset["title"])
-    ckan_dataset["tags"] = [{"name": k, "display_name": k, "state": "active", "id": k, "vocabulary": None}
-                            for k in get_keywords(ckan_dataset)]
-
-    resources = []
-    for resource_original in ckan_dataset["resources"]:
-        resource = resource_original.copy()
-        if resource['id'] == resource_id:
-            resource["name"] = resource["name"].get(lang, resource["name"])
-            resource["description"] = resource["description"].get(lang, resource["description"])
-            resources = [resource]
-            break
-
-    ckan_dataset["resources"] = resources
-    return ckan_dataset
+POLICIES = policy_registry.PolicyRegistry()
+# schema artifacts of the compact samples, one per connector and schema_hash in a run
+SAMPLE_SCHEMAS = policy_registry.SharedEntities()
 
 
-def generate_datapackage(ckan_dataset: dict, datastore_info: dict, resource_id: str) -> dict:
-    fixed_ckan_dataset = fix_multilingual(ckan_dataset, resource_id)
+def setting(value, name: str):
+    # an argument left to None is the setting of config
+    import config
+    return getattr(config, name) if value is None else value
 
-    datapackage = CkanPackage.from_dict(fixed_ckan_dataset).to_dp()
-    ckan_schema = CkanSchema.from_dict(datastore_info).to_dp()
 
-    # guess data types
-    header = [k['id'] for k in datastore_info['fields']]
-    records = [list(v.values()) for v in datastore_info['records']]
-    new_schema = describe([header] + records, type="schema")
-    fields = new_schema.fields
+def disable_insecure_warnings():
+    # the connector and the broker are requested without certificate verification
+    import requests
+    requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
 
-    new_schema = Schema()
-    for field in ckan_schema.fields:
 
-        # add example value
-        example_value = None
-        for record in datastore_info['records']:
-            value = record.get(field.name)
-            if value is not None and len(str(value)) > 0:
-                example_value = value
-                break
-        field.example = example_value
-
-        field_new = [f for f in fields if f.name == field.name][0]
-
-        if field.type == 'string' and field_new.type != 'string' and example_value is not None:
-            # print(field)
-            if field.title:
-                field_new.title = field.title
-            if field.description:
-                field_new.description = field.description
-            field_new.example = field.example
-
-            # print('=>', field_new)
-            match field_new.type:
-                case "integer":
-                    new_schema.add_field(IntegerField(**field_new.to_dict()))
-                case "number":
-                    new_schema.add_field(NumberField(**field_new.to_dict()))
-                case "geopoint":
-                    new_schema.add_field(GeopointField(**field_new.to_dict()))
-                case "geojson":
-                    new_schema.add_field(GeojsonField(**field_new.to_dict()))
-                case"yearmonth":
-                    new_schema.add_field(YearmonthField(**field_new.to_dict()))
-                case "datetime":
-                    new_schema.add_field(DatetimeField(**field_new.to_dict()))
-                case "date":
-                    new_schema.add_field(DateField(**field_new.to_dict()))
-                case _:
-                    raise Exception("Unknown type: " + field_new.type)
-        else:
-            new_schema.add_field(field)
+def iter_dataset_names(lines):
+    # dataset names of the lines of a dataset list: names or dataset urls, and # comments
+    for line in lines:
+        if len(line.strip()) > 3 and not line.strip().startswith('#'):
+            dataset = line.strip()
+            if dataset.startswith('http'):
+                dataset = dataset.split('/')[-1]
+            yield dataset
 
-    datapackage.resources[0].schema = new_schema
-    datapackage.resources[0].type = "table"
 
-    return datapackage.to_dict()
+def iter_dataset_list(input_file: str = None):
+    # dataset names read line by line, from the file or from stdin with '-'
+    input_file = setting(input_file, 'DATASET_LIST')
+    source = sys.stdin if input_file == '-' else open(input_file, 'r')
+    try:
+        yield from iter_dataset_names(source)
+    finally:
+        if source is not sys.stdin:
+            source.close()
 
 
-def get_dataset_list(input_file: str = DATASET_LIST):
-    datasets = []
-    with open(input_file, 'r') as source:
-        for line in source.readlines():
-            if len(line.strip()) > 3 and not line.strip().startswith('#'):
-                dataset = line.strip()
-                if dataset.startswith('http'):
-                    dataset = dataset.split('/')[-1]
-                datasets += [dataset]
-    return datasets
+def get_dataset_list(input_file: str = None):
+    input_file = setting(input_file, 'DATASET_LIST')
+    return list(iter_dataset_list(input_file))
 
 
-def get_rule(input_file: str = RULE_JSON):
-    with open(input_file, 'r') as source:
-        rule = source.read()
-    return rule
+def get_rule(input_file: str = None):
+    input_file = setting(input_file, 'RULE_JSON')
+    return POLICIES.rule(input_file)
 
 
 # Get broker description
 def get_broker_description(metadata_broker_url: str) -> dict:
-    response = requests.get(metadata_broker_url, verify=False)
+    response = http_client.get(metadata_broker_url, verify=False)
     print(" \t * Request GET {0} \t => {1}".format(metadata_broker_url, response.status_code))
     content = response.content
     description = json.loads(content)
@@ -140,7 +78,7 @@ def get_broker_description(metadata_broker_url: str) -> dict:
 def get_self_description(connector_url: str, auth: tuple) -> list:
 
     request_url = "{0}".format(connector_url)
-    response = requests.get(request_url, data={}, auth=auth, verify=False)
+    response = http_client.get(request_url, data={}, auth=auth, verify=False)
     print(" \t - Request GET {0} \t => {1}".format(request_url, response.status_code))
     description = json.loads(response.content)
 
@@ -148,70 +86,61 @@ def get_self_description(connector_url: str, auth: tuple) -> list:
 
 
 def get_provider_catalog_description(provider_docs: list, connector_url: str, auth: tuple) -> (list, list):
+    # see catalog_crawler.CatalogCrawler to request the catalogs concurrently and keep them in a local index
     catalogs = []
     resources = []
 
+    import catalog_crawler
     for provider in provider_docs:
-        provider_url = provider["_provider_url"]
         for provider_catalog in provider["_catalogs"]:
-            provider_catalog_id = provider_catalog['@id']
-            request_url = "{0}/api/ids/description?recipient={1}&elementId={2}".format(connector_url, provider_url,
-                                                                                       provider_catalog_id)
-            response = requests.post(request_url, data={}, auth=auth, verify=False)
-            print(" \t - Request POST {0} \t => {1}".format(request_url, response.status_code))
-            content = response.content
-            catalog = json.loads(content)
-
-            catalog["_provider_id"] = provider['@id']
-            for k in ["_broker_id", "_broker_catalog_id", "_broker_connector_id", "_provider_url"]:
-                catalog[k] = provider[k]
-
-            catalog_resources = catalog["ids:offeredResource"]
-            catalog["ids:offeredResource"] = [str(r['@id']) for r in catalog_resources]
+            catalog, catalog_resources = catalog_crawler.get_catalog_description(provider, provider_catalog,
+                                                                                 connector_url, auth)
             catalogs += [catalog]
-
-            for resource in catalog_resources:
-                for k in ["_broker_id", "_broker_catalog_id", "_broker_connector_id", "_provider_url", "_provider_id"]:
-                    resource[k] = catalog[k]
-                resource["_catalog_id"] = str(catalog['@id'])
-                resources += [resource]
+            resources += catalog_resources
     return catalogs, resources
 
 
+def update_entity(existing: dict, entity_data: dict, entity_name: str, label: str, auth: tuple,
+                  index: connector_index.EntityIndex) -> dict:
+    # PUT only when the payload hash changed or a contract is about to expire, the updated entity is built from
+    # the known state
+    import config
+    request_url = existing["_links"]["self"]["href"]
+    renew = entity_name == 'contracts' and connector_index.expires_within(existing, config.CONTRACT_RENEWAL_DAYS)
+    if connector_index.entity_key(existing, 'payload_hash') == entity_data['payload_hash'] and not renew:
+        print(" \t\t\t\t - Unchanged {0} {1}".format(label, request_url))
+        return existing
+
+    response = http_client.put(request_url, json=entity_data, auth=auth, verify=False)
+    print(" \t\t\t\t - Request PUT updated {0} {1} \t => {2}".format(label, request_url, response.status_code))
+    response.raise_for_status()
+    if response.status_code != 204:
+        raise Exception("*ERROR* Could not update {} {}: {}".format(label, request_url, response))
+    updated_entity = connector_index.merge_entity(existing, entity_data)
+    index.add(entity_name, updated_entity)
+    return updated_entity
+
+
 def upsert_catalog(catalog_data: dict, connector_url: str, auth: tuple) -> dict:
     catalog_org_id = catalog_data["organization_id"]
+    catalog_data = connector_index.with_payload_hash(catalog_data)
+    index = connector_index.get_index(connector_url, auth)
 
     # check if catalog exists
-    catalog_list = []
-    request_url = "{0}/api/catalogs".format(connector_url)
-    while request_url is not None:
-        response = requests.get(request_url, data={}, auth=auth, verify=False)
-        print(" \t\t\t\t - Request GET Catalogs {0} \t => {1}".format(request_url, response.status_code))
-        result = json.loads(response.content)
-        catalog_list += result.get('_embedded', {}).get('catalogs', [])
-        request_url = result.get('_links', {}).get("next", {}).get("href")
-
-    existing_catalogs = [c for c in catalog_list if c.get("additional", {}).get("organization_id") == catalog_org_id]
+    existing_catalogs = index.find('catalogs', 'organization_id', catalog_org_id)
 
     if len(existing_catalogs) == 0:
         # POST
         request_url = "{0}/api/catalogs".format(connector_url)
-        response = requests.post(request_url, json=catalog_data, auth=auth, verify=False)
+        response = http_client.post(request_url, json=catalog_data, auth=auth, verify=False)
         print(" \t\t\t\t - Request POST new Catalog {0} \t => {1}".format(request_url, response.status_code))
+        response.raise_for_status()
         new_catalog = json.loads(response.content)
+        index.add('catalogs', new_catalog, created=True)
         return new_catalog
     elif len(existing_catalogs) == 1:
         # PUT
-        request_url = existing_catalogs[0]["_links"]["self"]["href"]
-        response = requests.put(request_url, json=catalog_data, auth=auth, verify=False)
-        print(" \t\t\t\t - Request PUT updated Catalog {0} \t => {1}".format(request_url, response.status_code))
-        if response.status_code == 204:
-            response = requests.get(request_url, data={}, auth=auth, verify=False)
-            print(" \t\t\t\t - Request GET Catalog {0} \t => {1}".format(request_url, response.status_code))
-            updated_catalog = json.loads(response.content)
-            return updated_catalog
-        else:
-            raise("*ERROR* Could not update catalog {}: {}".format(catalog_org_id, response))
+        return update_entity(existing_catalogs[0], catalog_data, 'catalogs', 'Catalog', auth, index)
     else:
         raise Exception("*ERROR: Multiple catalogs matching current organization {}: {}".format(catalog_org_id,
                                                                                                 existing_catalogs))
@@ -219,136 +148,141 @@ def upsert_catalog(catalog_data: dict, connector_url: str, auth: tuple) -> dict:
 
 def upsert_offer(offer_data: dict, connector_url: str, auth: tuple) -> dict:
     resource_id = offer_data['resource_id']
+    offer_data = connector_index.with_payload_hash(offer_data)
+    index = connector_index.get_index(connector_url, auth)
 
     # check if offer exists
-    request_url = "{0}/api/offers".format(connector_url)
-    offer_list = []
-    while request_url is not None:
-        response = requests.get(request_url, data={}, auth=auth, verify=False)
-        print(" \t\t\t\t - Request GET offers {0} \t => {1}".format(request_url, response.status_code))
-        response.raise_for_status()
-        result = json.loads(response.content)
-        offer_list += result.get('_embedded', {}).get('resources', [])
-        request_url = result.get('_links', {}).get("next", {}).get("href")
-    existing_offers = [o for o in offer_list if o.get("additional", {}).get("resource_id") == resource_id]
+    existing_offers = index.find('offers', 'resource_id', resource_id)
 
     if len(existing_offers) == 0:
         # POST
         request_url = "{0}/api/offers".format(connector_url)
-        response = requests.post(request_url, json=offer_data, auth=auth, verify=False)
+        response = http_client.post(request_url, json=offer_data, auth=auth, verify=False)
         print(" \t\t\t\t - Request POST new Offer {0} \t => {1}".format(request_url, response.status_code))
         response.raise_for_status()
         new_offer = json.loads(response.content)
+        index.add('offers', new_offer, created=True)
         return new_offer
     elif len(existing_offers) == 1:
         # PUT
-        request_url = existing_offers[0]["_links"]["self"]["href"]
-        response = requests.put(request_url, json=offer_data, auth=auth, verify=False)
-        print(" \t\t\t\t - Request PUT updated Offer {0} \t => {1}".format(request_url, response.status_code))
-        response.raise_for_status()
-        if response.status_code == 204:
-            response = requests.get(request_url, data={}, auth=auth, verify=False)
-            print(" \t\t\t\t - Request GET Offer {0} \t => {1}".format(request_url, response.status_code))
-            response.raise_for_status()
-            updated_offer = json.loads(response.content)
-            return updated_offer
-        else:
-            raise("*ERROR* Could not update offer {}: {}".format(resource_id, response))
+        return update_entity(existing_offers[0], offer_data, 'offers', 'Offer', auth, index)
     else:
         raise Exception("*ERROR: Multiple offers matching current organization {}: {}".format(resource_id,
                                                                                               existing_offers))
 
 
-def upsert_resource_entity(entity_data: dict, entity_name: str, connector_url: str, auth: tuple) -> dict:
+def upsert_resource_entity(entity_data: dict, entity_name: str, connector_url: str, auth: tuple,
+                           key: str = 'resource_id') -> dict:
+    resource_id = entity_data[key]
+    entity_data = connector_index.with_payload_hash(entity_data)
+    index = connector_index.get_index(connector_url, auth)
+
     # check if entity exists
     request_url_base = "{0}/api/{1}".format(connector_url, entity_name)
-    request_url = request_url_base
-    entity_list = []
-    while request_url is not None:
-        response = requests.get(request_url, data={}, auth=auth, verify=False)
-        print(" \t\t\t\t - Request GET {0} {1}\t => {2}".format(entity_name, request_url, response.status_code))
-        response.raise_for_status()
-        resource_id = entity_data['resource_id']
-        result = json.loads(response.content)
-        entity_list += result.get('_embedded', {}).get(entity_name, [])
-        request_url = result.get('_links', {}).get("next", {}).get("href")
-    existing_entities = [o for o in entity_list if o.get("additional", {}).get("resource_id") == resource_id]
+    existing_entities = index.find(entity_name, key, resource_id)
 
     if len(existing_entities) == 0:
         # POST
-        response = requests.post(request_url_base, json=entity_data, auth=auth, verify=False)
-        print(" \t\t\t\t - Request POST new {0} {1} \t => {2}".format(entity_name, request_url, response.status_code))
+        response = http_client.post(request_url_base, json=entity_data, auth=auth, verify=False)
+        print(" \t\t\t\t - Request POST new {0} {1} \t => {2}".format(entity_name, request_url_base,
+                                                                        response.status_code))
         response.raise_for_status()
         new_entity = json.loads(response.content)
+        index.add(entity_name, new_entity, created=True)
         return new_entity
     elif len(existing_entities) == 1:
         # PUT
-        request_url = existing_entities[0]["_links"]["self"]["href"]
-        response = requests.put(request_url_base, json=entity_data, auth=auth, verify=False)
-        print(" \t\t\t\t - Request PUT updated entity {0} {1}\t => {2}".format(entity_name, request_url, response.status_code))
-        response.raise_for_status()
-        if response.status_code == 204:
-            response = requests.get(request_url_base, data={}, auth=auth, verify=False)
-            print(" \t\t\t\t - Request GET entity {0} \t => {1}".format(request_url, response.status_code))
-            response.raise_for_status()
-            updated_entity = json.loads(response.content)
-            return updated_entity
-        else:
-            raise("*ERROR* Could not update entity {}: {}".format(resource_id, response))
+        return update_entity(existing_entities[0], entity_data, entity_name, 'entity ' + entity_name, auth, index)
     else:
         raise Exception("*ERROR: Multiple entities matching current organization {}: {}".format(
             resource_id, existing_entities))
 
 
-def add_artifact_to_representation(artifact: dict, representation: dict, auth: tuple) -> dict:
+def upsert_contract_and_rule(contract_data: dict, rule_data: dict, connector_url: str, auth: tuple,
+                             links: connector_index.LinkBatch = None) -> dict:
+    # one rule per distinct policy, shared by all the contracts, and with SHARED_CONTRACTS one contract per
+    # organization and policy, shared by all its offers
+    import config
+    rule_hash = policy_registry.policy_hash(rule_data['value'])
+    rule = POLICIES.shared(('rules', connector_url, rule_hash), upsert_resource_entity,
+                           policy_registry.rule_data(rule_data, rule_hash), 'rules', connector_url, auth, 'policy_hash')
+    if config.SHARED_CONTRACTS:
+        shared_data = policy_registry.contract_data(contract_data, rule_hash)
+        contract = POLICIES.shared(('contracts', connector_url, shared_data['contract_key']), upsert_resource_entity,
+                                   shared_data, 'contracts', connector_url, auth, 'contract_key')
+    else:
+        contract = upsert_resource_entity(contract_data, 'contracts', connector_url, auth)
+    add_rule_to_contract(rule, contract, auth, links)
+    return contract
+
+
+def add_artifact_to_representation(artifact: dict, representation: dict, auth: tuple,
+                                   links: connector_index.LinkBatch = None) -> dict:
+    if links is not None:
+        links.add(representation, 'artifacts', artifact)
+        return
     representation_url = representation["_links"]["self"]["href"]
     artifact_url = artifact["_links"]["self"]["href"]
     request_url = "{}/artifacts".format(representation_url)
-    response = requests.post(request_url, json=[artifact_url], auth=auth, verify=False)
+    response = http_client.post(request_url, json=[artifact_url], auth=auth, verify=False)
     print(" \t\t\t\t - Request POST add artifact to representation {0} \t => {1}".format(request_url,
                                                                                       response.status_code))
     response.raise_for_status()
 
 
-def add_offer_to_catalog(offer: dict, catalog: dict, auth: tuple) -> dict:
+def add_offer_to_catalog(offer: dict, catalog: dict, auth: tuple, links: connector_index.LinkBatch = None) -> dict:
+    if links is not None:
+        links.add(catalog, 'offers', offer)
+        return
     catalog_url = catalog["_links"]["self"]["href"]
     offer_url = offer["_links"]["self"]["href"]
     request_url = "{}/offers".format(catalog_url)
-    response = requests.post(request_url, json=[offer_url], auth=auth, verify=False)
+    response = http_client.post(request_url, json=[offer_url], auth=auth, verify=False)
     print(" \t\t\t\t - Request POST add offer to catalog {0} \t => {1}".format(request_url, response.status_code))
     response.raise_for_status()
 
 
-def add_representation_to_offer(representation: dict, offer: dict, auth: tuple) -> dict:
+def add_representation_to_offer(representation: dict, offer: dict, auth: tuple,
+                                links: connector_index.LinkBatch = None) -> dict:
+    if links is not None:
+        links.add(offer, 'representations', representation)
+        return
     offer_url = offer["_links"]["self"]["href"]
     representation_url = representation["_links"]["self"]["href"]
     request_url = "{}/representations".format(offer_url)
-    response = requests.post(request_url, json=[representation_url], auth=auth, verify=False)
+    response = http_client.post(request_url, json=[representation_url], auth=auth, verify=False)
     print(" \t\t\t\t - Request POST add artifact to representation {0} \t => {1}".format(request_url,
                                                                                       response.status_code))
     response.raise_for_status()
 
 
-def add_rule_to_contract(rule: dict, contract: dict, auth: tuple) -> dict:
+def add_rule_to_contract(rule: dict, contract: dict, auth: tuple, links: connector_index.LinkBatch = None) -> dict:
+    if links is not None:
+        links.add(contract, 'rules', rule)
+        return
     contract_url = contract["_links"]["self"]["href"]
     rule_url = rule["_links"]["self"]["href"]
     request_url = "{}/rules".format(contract_url)
-    response = requests.post(request_url, json=[rule_url], auth=auth, verify=False)
+    response = http_client.post(request_url, json=[rule_url], auth=auth, verify=False)
     print(" \t\t\t\t - Request POST add rule to contract {0} \t => {1}".format(request_url, response.status_code))
     response.raise_for_status()
 
 
-def add_contract_to_offer(contract: dict, offer: dict, auth: tuple) -> dict:
+def add_contract_to_offer(contract: dict, offer: dict, auth: tuple, links: connector_index.LinkBatch = None) -> dict:
+    if links is not None:
+        links.add(offer, 'contracts', contract)
+        return
     contract_url = contract["_links"]["self"]["href"]
     offer_url = offer["_links"]["self"]["href"]
     request_url = "{}/contracts".format(offer_url)
-    response = requests.post(request_url, json=[contract_url], auth=auth, verify=False)
+    response = http_client.post(request_url, json=[contract_url], auth=auth, verify=False)
     print(" \t\t\t\t - Request POST add contract to offer {0} \t => {1}".format(request_url, response.status_code))
     response.raise_for_status()
 
 
-def get_dataset_metadata(dataset: str, ckan_url: str = DATA_SOURCE_URL) -> dict:
+def get_dataset_metadata(dataset: str, ckan_url: str = None) -> dict:
 
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
     success, result = commons.ckan_api_request(ckan_url, endpoint="package_show", method="get",
                                                params={"id": dataset}, verbose=False)
     if success >= 0:
@@ -358,39 +292,140 @@ def get_dataset_metadata(dataset: str, ckan_url: str = DATA_SOURCE_URL) -> dict:
         raise Exception("ERROR: Cannot retrieve dataset {} from {}".format(dataset, ckan_url))
 
 
-def as_simple_text(text: str):
-    simple_text = lxml.html.fromstring(text).text_content().replace('\n', "").replace('\r', "")
-    return simple_text
-
-
-def get_keywords(metadata: dict) -> list:
-    keywords = []
-    for key in metadata["tag_string_schemaorg"].split(','):
-        tag = key.strip().upper()
-        if tag.endswith('-ES'):
-            tag = tag.rsplit('-', 1)[0]
-            if tag not in keywords:
-                keywords += [tag]
-    for key in str(metadata.get('original_tags', "")).split(','):
-        if key:
-            tag = key.strip().upper()
-            if tag not in keywords:
-                keywords += [tag]
-    return keywords
+def search_datasets_metadata(datasets=None, query: str = None, organization: str = None,
+                             ckan_url: str = None):
+    # bulk alternative to get_dataset_metadata: the datasets are selected by name/id, fq query or organization
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
+    if query:
+        yield from commons.ckan_package_search(ckan_url, fq=query, verbose=False)
+    elif organization:
+        yield from commons.ckan_package_search(ckan_url, fq='organization:"{}"'.format(organization), verbose=False)
+    else:
+        datasets = iter(datasets)
+        while True:
+            names = list(itertools.islice(datasets, SEARCH_IDS_CHUNK))
+            if not names:
+                break
+            chunk = ' OR '.join('"{}"'.format(d) for d in names)
+            found = []
+            for metadata in commons.ckan_package_search(ckan_url, fq='name:({0}) OR id:({0})'.format(chunk),
+                                                        verbose=False):
+                found += [metadata['name'], metadata['id']]
+                yield metadata
+            missing = [d for d in names if d not in found]
+            if missing:
+                print("\t\t - *WARNING* Datasets not found in {}: {}".format(ckan_url, ', '.join(missing)))
+
+
+def resource_key(metadata: dict, resource: dict) -> str:
+    # resource_id of the offer of a CKAN resource, its sample offer adds _SAMPLE
+    return "{}_{}".format(metadata['id'], resource['id'])
+
+
+def get_source_resources(datasets=None, query: str = None, organization: str = None,
+                         ckan_url: str = None) -> dict:
+    # resource_id of the offers and sample offers of the datasets found in CKAN => id of their organization,
+    # harvested in bulk: a CKAN failure stops here, before anything is taken for an orphan
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
+    resources = {}
+    for metadata in search_datasets_metadata(datasets, query, organization, ckan_url):
+        for resource in metadata['resources']:
+            if resource['format'] == 'CSV':
+                resources[resource_key(metadata, resource)] = metadata['organization']['id']
+                resources[resource_key(metadata, resource) + "_SAMPLE"] = metadata['organization']['id']
+    return resources
+
+
+def get_organizations_metadata(ckan_url: str = None) -> dict:
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
+    return commons.ckan_organization_list(ckan_url, verbose=False)
+
+
+def iter_datastore_pages(resource_id: str, ckan_url: str = None, page_size: int = None,
+                         row_budget: int = None):
+    # datastore_search results page by page, up to row_budget records
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
+    page_size = setting(page_size, 'DATASTORE_PAGE_SIZE')
+    row_budget = setting(row_budget, 'DATASTORE_ROW_BUDGET')
+    offset = 0
+    while offset < row_budget:
+        params = {"resource_id": resource_id, "limit": min(page_size, row_budget - offset), "offset": offset,
+                  "sort": "_id"}
+        success, result = commons.ckan_api_request(ckan_url, endpoint="datastore_search", method="get",
+                                                   params=params, verbose=False)
+        if success < 0:
+            if offset == 0:
+                return
+            raise Exception("ERROR: Cannot page datastore {} at offset {}: {}".format(resource_id, offset, result))
+        page = result['result']
+        yield page
+        offset += len(page['records'])
+        if len(page['records']) == 0 or offset >= page.get('total', offset + 1):
+            break
 
 
-def get_dataset_entities(metadata: dict, ckan_url: str = DATA_SOURCE_URL,
-                         provider_url: str = CONNECTOR_DOCKER_URL) -> dict:
+def sample_datastore(resource_id: str, ckan_url: str = None) -> 'schema_inference.DatastoreSampler':
+    # frictionless is only imported once a datastore is sampled
+    import config
+    import schema_inference
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
+    sampler = None
+    for page in iter_datastore_pages(resource_id, ckan_url):
+        if sampler is None:
+            sampler = schema_inference.DatastoreSampler(page['fields'], MAX_SAMPLE_RECORDS,
+                                                        config.INFERENCE_SAMPLE_ROWS,
+                                                        seed=resource_id)
+        sampler.add(page['records'])
+    return sampler
+
+
+def get_sample_version(resource: dict, metadata: dict, ckan_url: str = None) -> str:
+    # version of the sample of a datastore resource: its last_modified or, if CKAN has none, a fingerprint
+    # of the datastore from a one record request
+    import config
+    import sample_cache
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
+    resource_version = resource.get('last_modified')
+    if not resource_version:
+        params = {"resource_id": resource['id'], "limit": 1, "sort": "_id desc"}
+        success, result = commons.ckan_api_request(ckan_url, endpoint="datastore_search", method="get",
+                                                   params=params, verbose=False, cache=False)
+        if success < 0:
+            return None
+        resource_version = sample_cache.datastore_fingerprint(result['result'])
+    return sample_cache.sample_version(resource_version, metadata,
+                                       (MAX_SAMPLE_RECORDS, config.INFERENCE_SAMPLE_ROWS,
+                                        config.DATASTORE_ROW_BUDGET))
+
+
+def get_access_url(data_url: str) -> str:
+    # the connector downloads the data through the caching proxy when DOWNLOAD_PROXY_URL is set, the proxy
+    # module is only imported then
+    import config
+    if not config.DOWNLOAD_PROXY_URL:
+        return data_url
+    import download_proxy
+    return download_proxy.proxy_url(config.DOWNLOAD_PROXY_URL, data_url)
+
+
+def get_dataset_entities(metadata: dict, ckan_url: str = None,
+                         provider_url: str = None, organizations: dict = None) -> dict:
     # catalog / offers / representations-artifacts
-    id = metadata['id']
+    ckan_url = setting(ckan_url, 'DATA_SOURCE_URL')
+    provider_url = setting(provider_url, 'CONNECTOR_DOCKER_URL')
     source_url = metadata['url']
     organization_name = metadata['organization']['name']
 
-    organization_metadata = {}
-    success, result = commons.ckan_api_request(ckan_url, endpoint="organization_show", method="get",
-                                               params={"id": organization_name}, verbose=False)
-    if success >= 0:
-        organization_metadata = result['result']
+    # organizations harvested in bulk may lack the extra fields, then they are requested one by one
+    organization_metadata = (organizations or {}).get(organization_name, {})
+    if 'source' not in organization_metadata:
+        with profiling.stage('organization'):
+            success, result = commons.ckan_api_request(ckan_url, endpoint="organization_show", method="get",
+                                                       params={"id": organization_name}, verbose=False)
+        if success >= 0:
+            organization_metadata = result['result']
+            if organizations is not None:
+                organizations[organization_name] = organization_metadata
 
     catalog = {
         "title": "Catalog: " + json.loads(metadata['organization']['title'])["es"],
@@ -402,6 +437,30 @@ def get_dataset_entities(metadata: dict, ckan_url: str = DATA_SOURCE_URL,
         "organization_source": organization_metadata['source']
     }
 
+    # the datastore samples of the CSV resources, then the CPU-bound transforms of the dataset in one call,
+    # in a worker process when the transform pool is started. Samples of unchanged resources come from the
+    # sample cache, without downloading the datastore nor inferring its schema again.
+    import sample_cache
+    import transforms
+    cache = sample_cache.get_cache()
+    samples = {}
+    versions = {}
+    samplers = {}
+    for resource in metadata['resources']:
+        if resource['format'] == 'CSV':
+            if cache is not None:
+                versions[resource['id']] = get_sample_version(resource, metadata, ckan_url)
+                if versions[resource['id']] is not None:
+                    samples[resource['id']] = cache.get(resource['id'], versions[resource['id']])
+                if samples.get(resource['id']) is not None:
+                    continue
+            with profiling.stage('datastore'):
+                samplers[resource['id']] = sample_datastore(resource['id'], ckan_url)
+    datastore_infos = {k: sampler.datastore_info() for k, sampler in samplers.items() if sampler is not None}
+    if samplers or samples:
+        with profiling.stage('inference'):
+            transformed = transforms.run(transforms.transform_dataset, metadata, datastore_infos)
+
     entities = {'catalog': catalog, 'offers': []}
     for resource in metadata['resources']:
         resource_id = resource['id']
@@ -409,22 +468,23 @@ def get_dataset_entities(metadata: dict, ckan_url: str = DATA_SOURCE_URL,
         data_url = resource['url']
         sample = None
         if file_format == 'CSV':
-            success, result = commons.ckan_api_request(ckan_url, endpoint="datastore_search", method="get",
-                                                       params={"resource_id": resource_id}, verbose=False)
-            if success >= 0:
-                datastore_info = result['result']
-                datapackage = generate_datapackage(metadata, datastore_info, resource_id)
-                header = {k['id']: k['type'] for k in result['result']['fields']}
-                info = {k['id']: k.get('info') for k in result['result']['fields']}
+            sample = samples.get(resource_id)
+            sampler = samplers.get(resource_id)
+            if sampler is not None:
+                datastore_info = datastore_infos[resource_id]
+                datapackage = transformed['datapackages'][resource_id]
+                header = {k['id']: k['type'] for k in datastore_info['fields']}
+                info = {k['id']: k.get('info') for k in datastore_info['fields']}
                 sample = {'header': header, 'info': info, 'datapackage': datapackage,
-                          'records': result['result']['records'][:MAX_SAMPLE_RECORDS]}
+                          'records': sampler.sample_records()}
+                if versions.get(resource_id) is not None:
+                    cache.put(resource_id, versions[resource_id], sample)
             offer = {'data': {
-                                  "resource_id": "{}_{}".format(id, resource_id),
+                                  "resource_id": resource_key(metadata, resource),
                                   "resource_name": "{}_{}".format(metadata["name"], resource["name"]["es"]),
                                   "title": metadata["title"]["es"] + " - " + resource["name"]["es"],
-                                  "description": as_simple_text(metadata["notes"]["es"]) + " " +
-                                                 resource["description"]["es"],
-                                  "keywords": get_keywords(metadata),
+                                  "description": transformed['notes'] + " " + resource["description"]["es"],
+                                  "keywords": transformed['keywords'],
                                   "publisher": ckan_url,
                                   "language": "ES",
                                   "license": metadata["license_url"],
@@ -457,7 +517,7 @@ def get_dataset_entities(metadata: dict, ckan_url: str = DATA_SOURCE_URL,
             artifact = {
                             "title": offer["data"]["title"] + " (CSV data)",
                             "description": "Artifact as CSV data of resource: " + offer["data"]["description"],
-                            "accessUrl": data_url,
+                            "accessUrl": get_access_url(data_url),
                             "automatedDownload": True,
                             "organization_id": offer['data']["organization_id"],
                             "organization_name": catalog['organization_name'],
@@ -498,45 +558,132 @@ def get_dataset_entities(metadata: dict, ckan_url: str = DATA_SOURCE_URL,
     return entities
 
 
-def import_dataset(dataset: str, connector_url: str, auth: tuple) -> list:
+def upsert_run_catalog(catalog_data: dict, connector_url: str, auth: tuple,
+                       catalogs: policy_registry.SharedEntities) -> dict:
+    # the catalog of an organization is upserted once per run, other datasets of the organization wait for it
+    return catalogs.shared((connector_url, catalog_data["organization_id"]), upsert_catalog, catalog_data,
+                           connector_url, auth)
+
+
+def import_offer(offer_data: dict, catalog: dict, connector_url: str, auth: tuple,
+                 links: connector_index.LinkBatch = None):
+    sample = import_sample(offer_data, catalog, connector_url, auth, links)
+    offer_data['data']['samples'] = [sample['_links']['self']['href']]
+    offer_data['data']['ids:sample'] = sample['_links']['self']['href']
+
+    # upsert offer
+    print(" - Upsert offer: {}".format(offer_data["data"]["title"]))
+    offer = upsert_offer(offer_data['data'], connector_url, auth)
+    add_offer_to_catalog(offer, catalog, auth, links)
+    print(" - Upsert contract and rule: {}".format(offer_data['contract']["data"]["title"]))
+    contract = upsert_contract_and_rule(offer_data['contract']['data'], offer_data['contract']['rule'], connector_url,
+                                        auth, links)
+    add_contract_to_offer(contract, offer, auth, links)
+    # Add contract to offer
+    for representation_data in offer_data['representations']:
+        print(" - Upsert representation: {}".format(representation_data["data"]["title"]))
+        representation = upsert_resource_entity(representation_data['data'], 'representations', connector_url, auth)
+        artifact_data = representation_data['artifact']
+        print(" - Upsert artifact: {}".format(artifact_data["title"]))
+        artifact = upsert_resource_entity(artifact_data, 'artifacts', connector_url, auth)
+        print(" - Add artifact to representation: {} => {}".format(artifact_data["title"],
+                                                                   representation_data["data"]["title"]))
+        add_artifact_to_representation(artifact, representation, auth, links)
+        print(" - Add representation to offer: {} => {}".format(representation_data["data"]["title"],
+                                                                offer_data["data"]["title"]))
+        add_representation_to_offer(representation, offer, auth, links)
+
+
+def import_journaled_offer(offer_data: dict, catalog: dict, connector_url: str, auth: tuple,
+                           links: connector_index.LinkBatch, journal: 'import_journal.ImportJournal' = None,
+                           dataset: str = None):
+    # the links of the offer are kept in the journal with the offer, a resumed run sends them without
+    # importing the offer again
+    offer_links = connector_index.LinkBatch(links.index)
+    import_offer(offer_data, catalog, connector_url, auth, offer_links)
+    if journal is not None:
+        journal.record(dataset, 'offer', offer_data['data']['resource_id'], offer_links.pending())
+    links.extend(offer_links.pending())
+
+
+def settings_fingerprint() -> str:
+    # the settings that change the entities of a dataset, kept in its sync watermark: a dataset imported with
+    # other settings is not skipped even if CKAN did not modify it
+    import config
+    settings = {'download_proxy_url': config.DOWNLOAD_PROXY_URL, 'shared_contracts': config.SHARED_CONTRACTS,
+                'sample_format': config.SAMPLE_FORMAT, 'sample_gzip': config.SAMPLE_GZIP,
+                'sample_max_bytes': config.SAMPLE_MAX_BYTES,
+                'sample': (MAX_SAMPLE_RECORDS, config.INFERENCE_SAMPLE_ROWS, config.DATASTORE_ROW_BUDGET),
+                'rules': [policy_registry.policy_hash(get_rule(path))
+                          for path in (config.RULE_JSON, config.RULE_SAMPLE_JSON)]}
+    return connector_index.payload_hash(settings)
+
+
+def import_dataset(dataset: str, connector_url: str, auth: tuple, catalogs: policy_registry.SharedEntities = None,
+                   writer: ThreadPoolExecutor = None, state: 'sync_state.SyncState' = None,
+                   force_resync: bool = False, metadata: dict = None, organizations: dict = None,
+                   journal: 'import_journal.ImportJournal' = None, provider_url: str = None,
+                   router: 'sharding.ShardRouter' = None) -> list:
+    provider_url = setting(provider_url, 'CONNECTOR_DOCKER_URL')
     imported = []
-    metadata = get_dataset_metadata(dataset)
-    entities_data = get_dataset_entities(metadata)
-    catalog = upsert_catalog(entities_data['catalog'], connector_url, auth)
+    if metadata is None:
+        with profiling.stage('metadata', dataset):
+            metadata = get_dataset_metadata(dataset)
+    if router is not None:
+        # sharded import: the connector of the organization of the dataset, and its writers
+        connector_url, provider_url, writer = router.route(dataset, metadata)
+    if state is not None and not force_resync and state.is_unchanged(connector_url, dataset, metadata):
+        print("\t\t - Dataset {} not modified since last import ({}), skipped".format(
+            dataset, metadata.get('metadata_modified')))
+        return imported
+
+    with profiling.stage('entities', dataset):
+        entities_data = get_dataset_entities(metadata, provider_url=provider_url, organizations=organizations)
+    if catalogs is None:
+        catalogs = policy_registry.SharedEntities()
+    with profiling.stage('upserts', dataset):
+        catalog = upsert_run_catalog(entities_data['catalog'], connector_url, auth, catalogs)
     imported += [catalog]
+    if journal is not None:
+        journal.record(dataset, 'catalog', connector_index.entity_url(catalog))
 
+    # offers only depend on the catalog, they are written by the connector workers when available
+    links = connector_index.LinkBatch(connector_index.get_index(connector_url, auth))
+    imported_offers = journal.imported_offers(dataset) if journal is not None else {}
+    offers = []
     for offer_data in entities_data['offers']:
-        sample = import_sample(offer_data, catalog, connector_url, auth)
-        offer_data['data']['samples'] = [sample['_links']['self']['href']]
-        offer_data['data']['ids:sample'] = sample['_links']['self']['href']
-
-        # upsert offer
-        print(" - Upsert offer: {}".format(offer_data["data"]["title"]))
-        offer = upsert_offer(offer_data['data'], connector_url, auth)
-        add_offer_to_catalog(offer, catalog, auth)
-        print(" - Upsert contract and rule: {}".format(offer_data['contract']["data"]["title"]))
-        contract = upsert_resource_entity(offer_data['contract']['data'], 'contracts', connector_url, auth)
-        rule = upsert_resource_entity(offer_data['contract']['rule'], 'rules', connector_url, auth)
-        add_rule_to_contract(rule, contract, auth)
-        add_contract_to_offer(contract, offer, auth)
-        # Add contract to offer
-        for representation_data in offer_data['representations']:
-            print(" - Upsert representation: {}".format(representation_data["data"]["title"]))
-            representation = upsert_resource_entity(representation_data['data'], 'representations', connector_url, auth)
-            artifact_data = representation_data['artifact']
-            print(" - Upsert artifact: {}".format(artifact_data["title"]))
-            artifact = upsert_resource_entity(artifact_data, 'artifacts', connector_url, auth)
-            print(" - Add artifact to representation: {} => {}".format(artifact_data["title"],
-                                                                       representation_data["data"]["title"]))
-            add_artifact_to_representation(artifact, representation, auth)
-            print(" - Add representation to offer: {} => {}".format(representation_data["data"]["title"],
-                                                                    offer_data["data"]["title"]))
-            add_representation_to_offer(representation, offer, auth)
-
+        if offer_data['data']['resource_id'] in imported_offers:
+            print(" - Offer already imported: {}".format(offer_data["data"]["title"]))
+            links.extend(imported_offers[offer_data['data']['resource_id']])
+        else:
+            offers += [offer_data]
+    if writer is None:
+        for offer_data in offers:
+            profiling.call('upserts', dataset, import_journaled_offer, offer_data, catalog, connector_url, auth,
+                           links, journal, dataset)
+    else:
+        futures = [writer.submit(profiling.call, 'upserts', dataset, import_journaled_offer, offer_data, catalog,
+                                 connector_url, auth, links, journal, dataset)
+                   for offer_data in offers]
+        for future in futures:
+            future.result()
+
+    # the links of all the entities of the dataset, one request per parent entity
+    print(" - Add links of dataset: {}".format(dataset))
+    with profiling.stage('links', dataset):
+        links.flush()
+    if journal is not None:
+        journal.record(dataset, 'links')
+
+    if state is not None:
+        state.record(connector_url, dataset, metadata)
     return imported
 
 
-def import_sample(offer: dict, catalog: dict, connector_url: str, auth: tuple) -> dict:
+def import_sample(offer: dict, catalog: dict, connector_url: str, auth: tuple,
+                  links: connector_index.LinkBatch = None) -> dict:
+    import config
+    import sample_encoding
     sample_offer_data = {
             "resource_id": offer['data']['resource_id'] + "_SAMPLE",
             "resource_name": offer['data']['resource_name'] + "_SAMPLE",
@@ -546,13 +693,15 @@ def import_sample(offer: dict, catalog: dict, connector_url: str, auth: tuple) -
         }
     print(" - Upsert SAMPLE offer: {}".format(sample_offer_data["title"]))
     sample_offer = upsert_offer(sample_offer_data, connector_url, auth)
-    add_offer_to_catalog(sample_offer, catalog, auth)
+    add_offer_to_catalog(sample_offer, catalog, auth, links)
 
     # Add contract to offer
     sample_contract_data = {
         "resource_id": sample_offer['additional']['resource_id'],
         "title": offer["data"]["title"] + " SAMPLE (Contract)",
         "provider": offer['contract']['data']['provider'],
+        "organization_id": offer['data']['organization_id'],
+        "organization_name": offer['data']['organization_name'],
         "start": (datetime.datetime.now() - datetime.timedelta(days=3)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
         "end": (datetime.datetime.now() + datetime.timedelta(days=4 * 365))
         .strftime('%Y-%m-%dT%H:%M:%S.%fZ')
@@ -561,17 +710,34 @@ def import_sample(offer: dict, catalog: dict, connector_url: str, auth: tuple) -
     rule_sample_data = {
         "resource_id": sample_offer['additional']['resource_id'],
         "title": offer["data"]["title"] + "SAMPLE (Rule)",
-        "value": get_rule(RULE_SAMPLE_JSON)
+        "value": get_rule(config.RULE_SAMPLE_JSON)
     }
-    sample_contract = upsert_resource_entity(sample_contract_data, 'contracts', connector_url, auth)
-    sample_rule = upsert_resource_entity(rule_sample_data, 'rules', connector_url, auth)
-    add_rule_to_contract(sample_rule, sample_contract, auth)
-    add_contract_to_offer(sample_contract, sample_offer, auth)
-
-    # Add representation and artifact to offer
+    sample_contract = upsert_contract_and_rule(sample_contract_data, rule_sample_data, connector_url, auth, links)
+    add_contract_to_offer(sample_contract, sample_offer, auth, links)
+
+    # Add representation and artifact to offer. A compact sample references its schema document, stored once
+    # per distinct schema in an artifact shared by the sample representations. The schema artifact of a previous
+    # sample (another schema or the legacy format) is unlinked with the links. A CSV resource without
+    # datastore has no sample: its artifact keeps the null value, without schema.
+    sample = offer['sample_data']
+    legacy_value = json.dumps(sample)
+    schema_ref = None
+    if sample is None:
+        encoded = {'value': legacy_value, 'rows': 0, 'media_type': sample_encoding.MEDIA_TYPE, 'encoding': None}
+    elif config.SAMPLE_FORMAT == 'compact':
+        schema = sample_encoding.schema_document(sample)
+        schema_ref = sample_encoding.schema_hash(schema)
+        encoded = sample_encoding.encode_sample(sample, schema_ref, config.SAMPLE_GZIP,
+                                               config.SAMPLE_MAX_BYTES)
+    else:
+        encoded = {'value': legacy_value, 'rows': len(sample['records']), 'media_type': sample_encoding.MEDIA_TYPE,
+                   'encoding': None}
+    if sample is not None:
+        sample_encoding.record(len(legacy_value.encode('utf-8')), len(encoded['value'].encode('utf-8')),
+                               encoded['rows'] < len(sample['records']))
     representation_data = {
         "title": offer["data"]["title"] + " SAMPLE (CSV format)",
-        "mediaType": "application/json",
+        "mediaType": encoded['media_type'],
         "language": "https://w3id.org/idsa/code/ES",
         "resource_id": sample_offer['additional']['resource_id']
     }
@@ -579,69 +745,488 @@ def import_sample(offer: dict, catalog: dict, connector_url: str, auth: tuple) -
     representation = upsert_resource_entity(representation_data, 'representations', connector_url, auth)
     artifact_data = {
         "title": offer["data"]["title"] + " SAMPLE (CSV data)",
-        "value": json.dumps(offer['sample_data']),
+        "value": encoded['value'],
         "resource_id": sample_offer['additional']['resource_id'],
         "automatedDownload": True
     }
+    if schema_ref is not None:
+        # schema_hash is the key of the schema artifacts
+        artifact_data.update({"sample_format": sample_encoding.FORMAT, "sample_schema_hash": schema_ref})
+        if encoded['encoding']:
+            artifact_data["encoding"] = encoded['encoding']
     print(" - Upsert artifact: {}".format(artifact_data["title"]))
     artifact = upsert_resource_entity(artifact_data, 'artifacts', connector_url, auth)
     print(" - Add artifact to representation: {} => {}".format(artifact_data["title"],
                                                                representation_data["title"]))
-    add_artifact_to_representation(artifact, representation, auth)
+    add_artifact_to_representation(artifact, representation, auth, links)
+    if schema_ref is not None:
+        schema_artifact = SAMPLE_SCHEMAS.shared((connector_url, schema_ref), upsert_sample_schema, schema,
+                                                schema_ref, connector_url, auth)
+        add_artifact_to_representation(schema_artifact, representation, auth, links)
     print(" - Add representation to offer: {} => {}".format(representation_data["title"],
                                                             sample_offer["title"]))
-    add_representation_to_offer(representation, sample_offer, auth)
+    add_representation_to_offer(representation, sample_offer, auth, links)
 
     return sample_offer
 
 
+def upsert_sample_schema(schema: dict, schema_ref: str, connector_url: str, auth: tuple) -> dict:
+    # schema document of the compact samples, one artifact per distinct schema
+    import sample_encoding
+    artifact_data = {
+        "title": "Sample schema {}".format(schema_ref[:12]),
+        "description": "Datastore fields and Table Schema of the samples with schema_hash {}".format(schema_ref),
+        "value": sample_encoding.dumps(schema),
+        "schema_hash": schema_ref,
+        "automatedDownload": True
+    }
+    print(" - Upsert sample schema: {}".format(artifact_data["title"]))
+    artifact = upsert_resource_entity(artifact_data, 'artifacts', connector_url, auth, key='schema_hash')
+    sample_encoding.record_schema(len(artifact_data["value"].encode('utf-8')))
+    return artifact
+
+
 def post_broker_registration(metadata_broker_url, connector_url, auth) -> dict:
     request_url = "{0}/api/ids/connector/update?recipient={1}".format(connector_url, metadata_broker_url)
-    response = requests.post(request_url, data={}, auth=auth, verify=False)
+    response = http_client.post(request_url, data={}, auth=auth, verify=False)
     print(" \t\t\t\t - Request POST connector to broker {0}\t => {1}".format(request_url, response.status_code))
     response.raise_for_status()
     return response.content
 
 
-def main(metadata_broker_url: str = METADATA_BROKER_URL, metadata_broker_docker_url: str = METADATA_BROKER_DOCKER_URL,
-         connector_url: str = CONNECTOR_URL, connector_docker_url: str = CONNECTOR_DOCKER_URL,
-         connector_user: str = CONNECTOR_USER, connector_pw: str = CONNECTOR_PW, input_file: str = DATASET_LIST):
-
-    requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
-
-    print('Metadata Browser started... \n * Setup:')
-    print('\t - METADATA_BROKER_URL: {0} ({1})'.format(metadata_broker_url, metadata_broker_docker_url))
-    print('\t - CONNECTOR_URL: {0} ({1})'.format(connector_url, connector_docker_url))
-    print('\t - DATASET_LIST: {0}'.format(input_file))
-
-    connector_auth = (connector_user, connector_pw)
-
-    datasets = get_dataset_list()
-    print("\n * Importing {} datasets as resources: {}...] => OK".format(len(datasets), str(datasets)[:300]))
-    imported_resources = []
-    count = 1
-    for dataset in datasets:
-        print("\t\t - Importing dataset #{}/{}: {}...".format(count, len(datasets), dataset))
-        imported_resources += import_dataset(dataset, connector_url, connector_auth)
-        count += 1
-        print("\t\t\t ... done!\n")
-    print("\t\t ... Imported resources: {}... => OK".format(str(imported_resources)[:300]))
-
+def register_in_broker(metadata_broker_url: str, connector_url: str, auth: tuple, sync_state_db: str = None,
+                       full_registration: bool = None, workers: int = None):
+    sync_state_db = setting(sync_state_db, 'SYNC_STATE_DB')
+    full_registration = setting(full_registration, 'BROKER_FULL_REGISTRATION')
+    workers = setting(workers, 'BROKER_WORKERS')
+    # without a sync state nothing is known about previous registrations, the connector is registered again
+    if not sync_state_db:
+        broker_registration = post_broker_registration(metadata_broker_url, connector_url, auth)
+        print("\t\t ... Registered in Broker: {}... => OK".format(str(broker_registration)[:300]))
+        return
+
+    import broker_sync
+    registry = broker_sync.BrokerRegistry(sync_state_db)
+    sync = broker_sync.BrokerSync(registry, connector_index.get_index(connector_url, auth), metadata_broker_url,
+                                  workers)
+    plan = sync.plan(full_registration)
+    if plan['full']:
+        broker_registration = post_broker_registration(metadata_broker_url, connector_url, auth)
+        sync.registered(plan)
+        print("\t\t ... Registered in Broker: {}... => OK".format(str(broker_registration)[:300]))
+    else:
+        print("\t\t - {} new or modified offers, {} removed offers".format(len(plan['update']),
+                                                                           len(plan['unavailable'])))
+        print("\t\t ... Updated resources in Broker: {} => OK".format(sync.update_resources(plan)))
+    registry.close()
+
+
+def main(metadata_broker_url: str = None, metadata_broker_docker_url: str = None, connector_url: str = None,
+         connector_docker_url: str = None, connector_user: str = None, connector_pw: str = None, input_file: str = None,
+         ckan_workers: int = None, connector_workers: int = None, sync_state_db: str = None, force_resync: bool = None,
+         harvest_mode: str = None, dataset_query: str = None, dataset_organization: str = None, ckan_cache: str = None,
+         metrics_json: str = None, metrics_prometheus: str = None, log_format: str = None, profile_dir: str = None,
+         profile_cprofile: bool = None, profile_top: int = None, broker_full_registration: bool = None,
+         broker_workers: int = None, journal_db: str = None, journal_max_attempts: int = None, resume: bool = False,
+         transform_workers: int = None, sample_cache_db: str = None, sample_cache_max_mb: float = None,
+         datasets: list = None, register: bool = True, shard_connectors: str = None,
+         connector_limit_initial: int = None, connector_limit_max: int = None, journal_keep_runs: int = None):
+    # datasets: names or urls of the datasets to import instead of the dataset list of input_file
+    # shard_connectors: the catalogs of the organizations are spread over these connectors instead of connector_url
+
+    import config
+    import sharding
+    import sync_state
+    import import_journal
+    import sample_cache
+    import sample_encoding
+    import transforms
+    metadata_broker_url = setting(metadata_broker_url, 'METADATA_BROKER_URL')
+    metadata_broker_docker_url = setting(metadata_broker_docker_url, 'METADATA_BROKER_DOCKER_URL')
+    connector_url = setting(connector_url, 'CONNECTOR_URL')
+    connector_docker_url = setting(connector_docker_url, 'CONNECTOR_DOCKER_URL')
+    connector_user = setting(connector_user, 'CONNECTOR_USER')
+    connector_pw = setting(connector_pw, 'CONNECTOR_PW')
+    input_file = setting(input_file, 'DATASET_LIST')
+    ckan_workers = setting(ckan_workers, 'CKAN_WORKERS')
+    connector_workers = setting(connector_workers, 'CONNECTOR_WORKERS')
+    sync_state_db = setting(sync_state_db, 'SYNC_STATE_DB')
+    force_resync = setting(force_resync, 'FORCE_RESYNC')
+    harvest_mode = setting(harvest_mode, 'HARVEST_MODE')
+    dataset_query = setting(dataset_query, 'DATASET_QUERY')
+    dataset_organization = setting(dataset_organization, 'DATASET_ORGANIZATION')
+    ckan_cache = setting(ckan_cache, 'CKAN_CACHE')
+    metrics_json = setting(metrics_json, 'METRICS_JSON')
+    metrics_prometheus = setting(metrics_prometheus, 'METRICS_PROMETHEUS')
+    log_format = setting(log_format, 'LOG_FORMAT')
+    profile_dir = setting(profile_dir, 'PROFILE_DIR')
+    profile_cprofile = setting(profile_cprofile, 'PROFILE_CPROFILE')
+    profile_top = setting(profile_top, 'PROFILE_TOP')
+    broker_full_registration = setting(broker_full_registration, 'BROKER_FULL_REGISTRATION')
+    broker_workers = setting(broker_workers, 'BROKER_WORKERS')
+    journal_db = setting(journal_db, 'JOURNAL_DB')
+    journal_max_attempts = setting(journal_max_attempts, 'JOURNAL_MAX_ATTEMPTS')
+    transform_workers = setting(transform_workers, 'TRANSFORM_WORKERS')
+    sample_cache_db = setting(sample_cache_db, 'SAMPLE_CACHE')
+    sample_cache_max_mb = setting(sample_cache_max_mb, 'SAMPLE_CACHE_MAX_MB')
+    shard_connectors = setting(shard_connectors, 'SHARD_CONNECTORS')
+    connector_limit_initial = setting(connector_limit_initial, 'CONNECTOR_LIMIT_INITIAL')
+    connector_limit_max = setting(connector_limit_max, 'CONNECTOR_LIMIT_MAX')
+    journal_keep_runs = setting(journal_keep_runs, 'JOURNAL_KEEP_RUNS')
+    if log_format == 'json':
+        metrics.enable_json_log()
+    try:
+        run_metrics = metrics.reset()
+        connector_index.reset()
+        POLICIES.reset()
+        SAMPLE_SCHEMAS.reset()
+        sample_encoding.reset()
+        if profile_dir:
+            profiling.enable(profile_dir, cprofile=profile_cprofile, top=profile_top)
+        disable_insecure_warnings()
+
+        print('Metadata Browser started... \n * Setup:')
+        print('\t - METADATA_BROKER_URL: {0} ({1})'.format(metadata_broker_url, metadata_broker_docker_url))
+        shards = sharding.parse_connectors(shard_connectors)
+        if shards:
+            print('\t - SHARD_CONNECTORS: {0}'.format(', '.join('{} ({})'.format(*shard) for shard in shards.items())))
+        else:
+            print('\t - CONNECTOR_URL: {0} ({1})'.format(connector_url, connector_docker_url))
+        source = ','.join(datasets) if datasets else input_file
+        print('\t - DATASET_LIST: {0}'.format(source))
+        print('\t - HARVEST_MODE: {0} {1}'.format(harvest_mode, dataset_query or dataset_organization or ''))
+        print('\t - SYNC_STATE_DB: {0}{1}'.format(sync_state_db, ' (full resync)' if force_resync else ''))
+        print('\t - CKAN_CACHE: {0}'.format(ckan_cache))
+        print('\t - SAMPLE_CACHE: {0}{1}'.format(sample_cache_db, ' (max {} MB)'.format(sample_cache_max_mb)
+                                                 if sample_cache_db else ''))
+        print('\t - SHARED_CONTRACTS: {0}'.format(config.SHARED_CONTRACTS))
+        print('\t - SAMPLE_FORMAT: {0}{1}'.format(config.SAMPLE_FORMAT, ' (gzip)' if config.SAMPLE_GZIP else ''))
+        print('\t - DOWNLOAD_PROXY_URL: {0}'.format(config.DOWNLOAD_PROXY_URL))
+
+        connector_auth = (connector_user, connector_pw)
+        connectors = shards or {connector_url: connector_docker_url}
+        for url in connectors:
+            http_client.configure(url, auth=connector_auth, verify=False,
+                                  limiter=get_limiter(connector_limit_initial, connector_limit_max))
+        http_client.configure(metadata_broker_url, verify=False)
+        if ckan_cache:
+            commons.enable_cache(ckan_cache)
+        if sample_cache_db:
+            sample_cache.enable(sample_cache_db, int(sample_cache_max_mb * 1024 * 1024))
+
+        # datasets metadata and organizations harvested in bulk with package_search, or one by one with package_show,
+        # the dataset list is streamed: only the datasets in progress are kept in memory
+        organizations = {}
+        dataset_names = iter_dataset_names(datasets) if datasets else iter_dataset_list(input_file)
+        if harvest_mode == 'search':
+            dataset_list = dataset_names if datasets or not (dataset_query or dataset_organization) else None
+            print("\n * Harvesting datasets from {}...".format(config.DATA_SOURCE_URL))
+            with profiling.stage('metadata'):
+                organizations = get_organizations_metadata()
+            harvested = ((metadata['name'], metadata)
+                         for metadata in search_datasets_metadata(dataset_list, dataset_query, dataset_organization))
+        else:
+            harvested = ((dataset, None) for dataset in dataset_names)
+
+        journal = None
+        if journal_db:
+            journal = import_journal.ImportJournal(journal_db, journal_max_attempts, journal_keep_runs)
+            run_id = journal.start(','.join(sorted(connectors)), source, resume)
+            print("\n * Import journal {} run #{}{}".format(journal_db, run_id, ' (resumed)' if resume else ''))
+            pruned = journal.prune()
+            if pruned:
+                print("\t - {} old runs removed from the journal".format(pruned))
+        print("\n * Importing datasets as resources from {}...".format(source if harvest_mode != 'search' else
+                                                                        config.DATA_SOURCE_URL))
+        print("\t - Workers: {} CKAN, {} connector, {} transform processes".format(ckan_workers, connector_workers,
+                                                                                   transform_workers))
+        if connector_limit_max:
+            print("\t - Connector requests in flight: adaptive, from {} up to {} per endpoint class".format(
+                connector_limit_initial, connector_limit_max))
+        transforms.start_pool(transform_workers)
+        imported_resources = []
+        failed = {}
+        catalogs = policy_registry.SharedEntities()
+        state = sync_state.SyncState(sync_state_db, settings_fingerprint()) if sync_state_db else None
+        router = sharding.ShardRouter(shards, connector_workers, state) if shards else None
+        with ThreadPoolExecutor(max_workers=ckan_workers) as reader, \
+                ThreadPoolExecutor(max_workers=connector_workers) as writer:
+            futures = {}
+            count = 1
+
+            def collect(done):
+                nonlocal count, imported_resources
+                for future in done:
+                    dataset = futures.pop(future)
+                    try:
+                        imported_resources += future.result()
+                        if journal is not None:
+                            journal.record(dataset, 'done')
+                        print("\t\t - Imported dataset #{}: {} ... done!\n".format(count, dataset))
+                    except Exception as err:
+                        failed[dataset] = err
+                        if journal is not None:
+                            journal.record(dataset, 'failed', data=str(err))
+                        print("\t\t - *ERROR* Importing dataset #{}: {} => {}\n".format(count, dataset, err))
+                    count += 1
+
+            for dataset, metadata in harvested:
+                if journal is not None and not journal.should_import(dataset):
+                    continue
+                # a bounded number of datasets waiting for a reader
+                if len(futures) >= 2 * ckan_workers:
+                    collect(wait(futures, return_when=FIRST_COMPLETED).done)
+                futures[reader.submit(import_dataset, dataset, connector_url, connector_auth, catalogs, writer, state,
+                                      force_resync, metadata, organizations, journal, connector_docker_url,
+                                      router)] = dataset
+            collect(wait(futures).done)
+        transforms.shutdown_pool()
+        if router is not None:
+            router.shutdown()
+        if state is not None:
+            state.close()
+        print("\t\t ... Imported resources: {}... => OK".format(str(imported_resources)[:300]))
+        if failed:
+            print("\t\t ... Failed {} dataset(s): {}".format(len(failed), ', '.join(failed)))
+        if router is not None:
+            print("\t\t ... Shards: {}".format(router.report()))
+            for organization, (previous, current) in sorted(router.moved.items()):
+                # the catalog is imported in its new connector, the previous copy is left in place
+                print("\t\t ... Moved catalog of {}: {} => {}".format(organization, previous, current))
+        if journal is not None:
+            permanent = [d for d, failure in journal.failures().items() if failure['permanent']]
+            if permanent:
+                print("\t\t ... Permanently failed after {} attempts: {}".format(journal.max_attempts,
+                                                                                ', '.join(permanent)))
+            elif failed:
+                print("\t\t ... Run again with --resume to retry the failed datasets")
+            journal.finish()
+            journal.close()
+        if commons.get_cache() is not None:
+            print("\t\t ... CKAN cache: {}".format(commons.get_cache().report()))
+        print("\t\t ... Sample artifacts: {}".format(sample_encoding.report()))
+        if sample_cache.get_cache() is not None:
+            print("\t\t ... Sample cache: {}".format(sample_cache.get_cache().report()))
+            sample_cache.disable()
+        if profiling.get_profiler() is not None:
+            profiling.get_profiler().write()
+            print("\n * Import stages (profile written to {}):\n{}".format(profile_dir,
+                                                                          profiling.get_profiler().report()))
+            profiling.disable()
+
+        if register:
+            register_connectors(metadata_broker_url, metadata_broker_docker_url, list(connectors), connector_auth,
+                                sync_state_db, broker_full_registration, broker_workers)
+
+        report_metrics(run_metrics, metrics_json, metrics_prometheus)
+        http_client.close()
+        print("\t... DONE.")
+        # exit status of the command line: the run fails when a dataset failed
+        return 1 if failed else 0
+    finally:
+        metrics.disable_json_log()
+
+
+def register_connector(metadata_broker_url: str, metadata_broker_docker_url: str, connector_url: str, auth: tuple,
+                       sync_state_db: str = None, full_registration: bool = None, workers: int = None):
+    sync_state_db = setting(sync_state_db, 'SYNC_STATE_DB')
+    full_registration = setting(full_registration, 'BROKER_FULL_REGISTRATION')
+    workers = setting(workers, 'BROKER_WORKERS')
     print("\n * Requesting broker self-description...")
     broker_description = get_broker_description(metadata_broker_url)
     print("\t\t ... Got Broker Description: {}... => OK".format(str(broker_description)[:300]))
 
     print("\n * Requesting connector self-description...")
-    self_description = get_self_description(connector_url, connector_auth)
+    self_description = get_self_description(connector_url, auth)
     print("\t\t ... Got Self Description: {}... => OK".format(str(self_description)[:300]))
 
     print("\n * Register connector in the broker...")
-    broker_registration = post_broker_registration(metadata_broker_docker_url, connector_url, connector_auth)
-    print("\t\t ... Registered in Broker: {}... => OK".format(str(broker_registration)[:300]))
-
-    print("\t... DONE.")
+    register_in_broker(metadata_broker_docker_url, connector_url, auth, sync_state_db, full_registration, workers)
+
+
+def register_connectors(metadata_broker_url: str, metadata_broker_docker_url: str, connector_urls: list, auth: tuple,
+                        sync_state_db: str = None, full_registration: bool = None, workers: int = None):
+    # each shard is registered separately in the broker, the shards at the same time
+    sync_state_db = setting(sync_state_db, 'SYNC_STATE_DB')
+    full_registration = setting(full_registration, 'BROKER_FULL_REGISTRATION')
+    workers = setting(workers, 'BROKER_WORKERS')
+    if len(connector_urls) == 1:
+        register_connector(metadata_broker_url, metadata_broker_docker_url, connector_urls[0], auth, sync_state_db,
+                           full_registration, workers)
+        return
+    with ThreadPoolExecutor(max_workers=len(connector_urls)) as registrations:
+        futures = {registrations.submit(register_connector, metadata_broker_url, metadata_broker_docker_url, url,
+                                        auth, sync_state_db, full_registration, workers): url
+                   for url in connector_urls}
+        for future in futures:
+            try:
+                future.result()
+                print("\t\t ... Registered shard {} => OK".format(futures[future]))
+            except Exception as err:
+                print("\t\t - *ERROR* Registering shard {} => {}".format(futures[future], err))
+
+
+def get_limiter(initial: int = None, maximum: int = None) -> 'concurrency_limiter.ConcurrencyLimiter':
+    # no limiter with a maximum of 0: the requests in flight are only bound by the workers
+    import concurrency_limiter
+    initial = setting(initial, 'CONNECTOR_LIMIT_INITIAL')
+    maximum = setting(maximum, 'CONNECTOR_LIMIT_MAX')
+    return concurrency_limiter.ConcurrencyLimiter(initial, maximum=maximum) if maximum else None
+
+
+def report_metrics(run_metrics: metrics.Metrics, metrics_json: str = None, metrics_prometheus: str = None):
+    print("\n * Requests: {}".format(run_metrics.report()))
+    for host, limits in http_client.limits_report().items():
+        print("\t - Adaptive limits of {}:".format(host))
+        for name, limit in limits.items():
+            print("\t\t {:<8} limit {} (lowest {}), {} in flight at most, {} requests, {} throttled, {} errors, "
+                  "{} ms (baseline {} ms)".format(name, limit['limit'], limit['lowest'], limit.get('peak_in_flight', 0),
+                                                  limit.get('requests', 0), limit.get('throttled', 0),
+                                                  limit.get('errors', 0), limit['latency_ms'], limit['baseline_ms']))
+    if metrics_json:
+        run_metrics.write_json(metrics_json)
+        print("\t\t ... Metrics summary written to {}".format(metrics_json))
+    if metrics_prometheus:
+        run_metrics.write_prometheus(metrics_prometheus)
+        print("\t\t ... Prometheus metrics written to {}".format(metrics_prometheus))
+
+
+def register(metadata_broker_url: str = None, metadata_broker_docker_url: str = None, connector_url: str = None,
+             connector_user: str = None, connector_pw: str = None, sync_state_db: str = None,
+             broker_full_registration: bool = None, broker_workers: int = None, metrics_json: str = None,
+             metrics_prometheus: str = None, log_format: str = None, shard_connectors: str = None,
+             connector_limit_initial: int = None, connector_limit_max: int = None):
+    # the broker registration alone, of the resources already in the connector (or in each shard)
+    import sharding
+    metadata_broker_url = setting(metadata_broker_url, 'METADATA_BROKER_URL')
+    metadata_broker_docker_url = setting(metadata_broker_docker_url, 'METADATA_BROKER_DOCKER_URL')
+    connector_url = setting(connector_url, 'CONNECTOR_URL')
+    connector_user = setting(connector_user, 'CONNECTOR_USER')
+    connector_pw = setting(connector_pw, 'CONNECTOR_PW')
+    sync_state_db = setting(sync_state_db, 'SYNC_STATE_DB')
+    broker_full_registration = setting(broker_full_registration, 'BROKER_FULL_REGISTRATION')
+    broker_workers = setting(broker_workers, 'BROKER_WORKERS')
+    metrics_json = setting(metrics_json, 'METRICS_JSON')
+    metrics_prometheus = setting(metrics_prometheus, 'METRICS_PROMETHEUS')
+    log_format = setting(log_format, 'LOG_FORMAT')
+    shard_connectors = setting(shard_connectors, 'SHARD_CONNECTORS')
+    connector_limit_initial = setting(connector_limit_initial, 'CONNECTOR_LIMIT_INITIAL')
+    connector_limit_max = setting(connector_limit_max, 'CONNECTOR_LIMIT_MAX')
+    if log_format == 'json':
+        metrics.enable_json_log()
+    try:
+        run_metrics = metrics.reset()
+        disable_insecure_warnings()
+        connector_auth = (connector_user, connector_pw)
+        connector_urls = list(sharding.parse_connectors(shard_connectors)) or [connector_url]
+        for url in connector_urls:
+            http_client.configure(url, auth=connector_auth, verify=False,
+                                  limiter=get_limiter(connector_limit_initial, connector_limit_max))
+        http_client.configure(metadata_broker_url, verify=False)
+        register_connectors(metadata_broker_url, metadata_broker_docker_url, connector_urls, connector_auth,
+                            sync_state_db, broker_full_registration, broker_workers)
+        report_metrics(run_metrics, metrics_json, metrics_prometheus)
+        http_client.close()
+        print("\t... DONE.")
+    finally:
+        metrics.disable_json_log()
+
+
+def prune(metadata_broker_url: str = None, metadata_broker_docker_url: str = None, connector_url: str = None,
+          connector_user: str = None, connector_pw: str = None, input_file: str = None, dataset_query: str = None,
+          dataset_organization: str = None, connector_workers: int = None, sync_state_db: str = None,
+          broker_full_registration: bool = None, broker_workers: int = None, metrics_json: str = None,
+          metrics_prometheus: str = None, log_format: str = None, shard_connectors: str = None,
+          connector_limit_initial: int = None, connector_limit_max: int = None, dry_run: bool = False,
+          register: bool = True) -> dict:
+    # removes the entities of the importer that the current source set does not keep (orphans.py), in the
+    # connector or in each shard, then updates the broker
+    import sharding
+    import sync_state
+    import orphans
+    metadata_broker_url = setting(metadata_broker_url, 'METADATA_BROKER_URL')
+    metadata_broker_docker_url = setting(metadata_broker_docker_url, 'METADATA_BROKER_DOCKER_URL')
+    connector_url = setting(connector_url, 'CONNECTOR_URL')
+    connector_user = setting(connector_user, 'CONNECTOR_USER')
+    connector_pw = setting(connector_pw, 'CONNECTOR_PW')
+    input_file = setting(input_file, 'DATASET_LIST')
+    dataset_query = setting(dataset_query, 'DATASET_QUERY')
+    dataset_organization = setting(dataset_organization, 'DATASET_ORGANIZATION')
+    connector_workers = setting(connector_workers, 'CONNECTOR_WORKERS')
+    sync_state_db = setting(sync_state_db, 'SYNC_STATE_DB')
+    broker_full_registration = setting(broker_full_registration, 'BROKER_FULL_REGISTRATION')
+    broker_workers = setting(broker_workers, 'BROKER_WORKERS')
+    metrics_json = setting(metrics_json, 'METRICS_JSON')
+    metrics_prometheus = setting(metrics_prometheus, 'METRICS_PROMETHEUS')
+    log_format = setting(log_format, 'LOG_FORMAT')
+    shard_connectors = setting(shard_connectors, 'SHARD_CONNECTORS')
+    connector_limit_initial = setting(connector_limit_initial, 'CONNECTOR_LIMIT_INITIAL')
+    connector_limit_max = setting(connector_limit_max, 'CONNECTOR_LIMIT_MAX')
+    if log_format == 'json':
+        metrics.enable_json_log()
+    try:
+        run_metrics = metrics.reset()
+        connector_index.reset()
+        disable_insecure_warnings()
+        connector_auth = (connector_user, connector_pw)
+        connector_urls = list(sharding.parse_connectors(shard_connectors)) or [connector_url]
+        for url in connector_urls:
+            http_client.configure(url, auth=connector_auth, verify=False,
+                                  limiter=get_limiter(connector_limit_initial, connector_limit_max))
+        http_client.configure(metadata_broker_url, verify=False)
+
+        print('Pruning orphan entities{}... \n * Source: {}'.format(
+            ' (dry run)' if dry_run else '', dataset_query or dataset_organization or input_file))
+        dataset_list = iter_dataset_list(input_file) if not (dataset_query or dataset_organization) else None
+        resources = get_source_resources(dataset_list, dataset_query, dataset_organization)
+        if not resources:
+            raise Exception("*ERROR: No resources in the source, every entity would be an orphan: pruning stopped")
+        print("\t\t ... {} offers and sample offers expected".format(len(resources)))
+
+        ring = sharding.HashRing(connector_urls)
+        state = sync_state.SyncState(sync_state_db) if sync_state_db and not dry_run else None
+        reports = {}
+        for url in connector_urls:
+            print("\n * Looking for orphans in {}...".format(url))
+            expected = {key for key, organization in resources.items() if ring.get(organization) == url}
+            reconciler = orphans.Reconciler(connector_index.get_index(url, connector_auth), expected,
+                                            {resources[key] for key in expected}, connector_workers)
+            found = reconciler.orphans()
+            for collection, entities in found.items():
+                for entity_url, entity in sorted(entities.items()):
+                    print("\t\t - Orphan {}: {} ({})".format(collection, entity.get('title'), entity_url))
+            deleted = None
+            if not dry_run and any(found.values()):
+                deleted = reconciler.delete(found)
+                if state is not None:
+                    # the datasets of the removed entities are imported again if they come back to the source, or
+                    # right away if they are still in it (entities of a failed import, not linked)
+                    dataset_ids = {connector_index.entity_key(entity, 'dataset_id') or resource_id.split('_')[0]
+                                   for entities in found.values() for entity in entities.values()
+                                   for resource_id in [connector_index.entity_key(entity, 'resource_id')]
+                                   if resource_id}
+                    for dataset_id in sorted(dataset_ids):
+                        state.forget_dataset(url, dataset_id)
+            reports[url] = reconciler.report(found, deleted)
+            print("\t\t ... Orphans of {}: {}".format(url, reports[url]['total']))
+        if state is not None:
+            state.close()
+
+        if register and not dry_run and any(report['total'].get('deleted') for report in reports.values()):
+            register_connectors(metadata_broker_url, metadata_broker_docker_url, connector_urls, connector_auth,
+                                sync_state_db, broker_full_registration, broker_workers)
+        report_metrics(run_metrics, metrics_json, metrics_prometheus)
+        http_client.close()
+        print("\t... DONE.")
+        return reports
+    finally:
+        metrics.disable_json_log()
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    main()
+    # "python main.py [options]" is "python cli.py import [options]". cli.py imports this module as main, the one
+    # running here instead of a second copy
+    import cli
+    sys.modules['main'] = sys.modules[__name__]
+    sys.exit(cli.main(['import'] + sys.argv[1:]))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+import io
+import re
+import sys
+import json
+import time
+import datetime
+import threading
+from collections import Counter
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+# path segments replaced by {id} in the endpoint templates: uuids and long numbers (not the CKAN api version)
+ID_SEGMENT = re.compile(r'^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d{4,})$')
+
+# lines of the text log that are replaced by the request events in the JSON log
+REQUEST_LINE = re.compile(r'^\s*[-*] Request ')
+
+
+def endpoint_template(path: str) -> str:
+    segments = [('{id}' if ID_SEGMENT.match(segment) else segment) for segment in path.strip('/').split('/')]
+    return '/' + '/'.join(segments) if any(segments) else '/'
+
+
+class Series:
+    # counters and latency histogram of the requests to one (host, method, endpoint)
+
+    def __init__(self):
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @property
+    def count(self) -> int:
+        return sum(self.statuses.values()) + sum(self.errors[e] for e in self.errors if not e.startswith('http_'))
+
+    def observe(self, seconds: float):
+        self.seconds += seconds
+        for number, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[number] += 1
+                return
+        self.buckets[-1] += 1
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q quantile
+        total = sum(self.buckets)
+        if not total:
+            return 0.0
+        seen = 0
+        for number, count in enumerate(self.buckets):
+            seen += count
+            if seen >= q * total:
+                return LATENCY_BUCKETS[number] if number < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+    def to_dict(self) -> dict:
+        count = self.count
+        return {
+            "requests": count,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "errors": dict(self.errors),
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "seconds": round(self.seconds, 4),
+            "mean_seconds": round(self.seconds / count, 4) if count else 0.0,
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+        }
+
+
+class Metrics:
+    # Request metrics of a run, recorded by http_client for every request, by host, method and endpoint
+    # template (ids replaced by {id}). Shared by all the import workers.
+
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def get_series(self, host: str, method: str, endpoint: str) -> Series:
+        key = (host, method.upper(), endpoint)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series.setdefault(key, Series())
+        return series
+
+    def record(self, host: str, method: str, path: str, seconds: float, status: int = None, error: str = None,
+               retries: int = 0, bytes_sent: int = 0, bytes_received: int = 0):
+        with self.lock:
+            series = self.get_series(host, method, endpoint_template(path))
+            series.observe(seconds)
+            series.retries += retries
+            series.bytes_sent += bytes_sent
+            series.bytes_received += bytes_received
+            if status is not None:
+                series.statuses[status] += 1
+                if status >= 400:
+                    series.errors['http_{}xx'.format(status // 100)] += 1
+            if error is not None:
+                series.errors[error] += 1
+
+    def summary(self) -> dict:
+        with self.lock:
+            endpoints = [dict(host=host, method=method, endpoint=endpoint, **series.to_dict())
+                         for (host, method, endpoint), series in sorted(self.series.items())]
+        totals = Counter()
+        for endpoint in endpoints:
+            for k in ["requests", "retries", "bytes_sent", "bytes_received", "seconds"]:
+                totals[k] += endpoint[k]
+            totals["errors"] += sum(endpoint["errors"].values())
+        totals["seconds"] = round(totals["seconds"], 4)
+        return {"started": datetime.datetime.fromtimestamp(self.started).isoformat(),
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "totals": dict(totals),
+                "endpoints": sorted(endpoints, key=lambda e: -e["seconds"])}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            items = sorted(self.series.items())
+
+        def metric(name: str, kind: str, description: str):
+            lines.extend(["# HELP importer_{} {}".format(name, description),
+                          "# TYPE importer_{} {}".format(name, kind)])
+
+        def labels(host, method, endpoint, **extra) -> str:
+            values = dict(host=host, method=method, endpoint=endpoint, **extra)
+            return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                            for k, v in values.items())
+
+        metric("http_requests_total", "counter", "HTTP requests by response status")
+        for (host, method, endpoint), series in items:
+            for status, count in sorted(series.statuses.items()):
+                lines.append("importer_http_requests_total{{{}}} {}".format(labels(host, method, endpoint,
+                                                                                  status=status), count))
+        metric("http_errors_total", "counter", "HTTP requests failed with an error status or exception")
+        for (host, method, endpoint), series in items:
+            for error, count in sorted(series.errors.items()):
+                lines.append("importer_http_errors_total{{{}}} {}".format(labels(host, method, endpoint,
+                                                                                error=error), count))
+        metric("http_retries_total", "counter", "HTTP retries done by the client")
+        for (host, method, endpoint), series in items:
+            lines.append("importer_http_retries_total{{{}}} {}".format(labels(host, method, endpoint),
+                                                                       series.retries))
+        for name, attribute in [("sent", "bytes_sent"), ("received", "bytes_received")]:
+            metric("http_{}_bytes_total".format(name), "counter", "HTTP body bytes {}".format(name))
+            for (host, method, endpoint), series in items:
+                lines.append("importer_http_{}_bytes_total{{{}}} {}".format(name, labels(host, method, endpoint),
+                                                                            getattr(series, attribute)))
+        metric("http_request_duration_seconds", "histogram", "HTTP request latency")
+        for (host, method, endpoint), series in items:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], series.buckets):
+                cumulative += count
+                lines.append("importer_http_request_duration_seconds_bucket{{{}}} {}".format(
+                    labels(host, method, endpoint, le=bound), cumulative))
+            lines.append("importer_http_request_duration_seconds_sum{{{}}} {}".format(
+                labels(host, method, endpoint), round(series.seconds, 6)))
+            lines.append("importer_http_request_duration_seconds_count{{{}}} {}".format(
+                labels(host, method, endpoint), cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str):
+        with open(path, 'w') as target:
+            json.dump(self.summary(), target, indent=2)
+
+    def write_prometheus(self, path: str):
+        with open(path, 'w') as target:
+            target.write(self.to_prometheus())
+
+    def report(self, top: int = 10) -> str:
+        summary = self.summary()
+        lines = ["{requests} requests, {errors} errors, {retries} retries, {bytes_received} bytes received, "
+                 "{seconds}s in requests".format(**dict({"errors": 0, "requests": 0, "retries": 0,
+                                                         "bytes_received": 0, "seconds": 0}, **summary["totals"]))]
+        for e in summary["endpoints"][:top]:
+            lines.append("{:>10.3f}s {:>6} x {:<6} {}{} (p50 {}s, p95 {}s, {} errors)".format(
+                e["seconds"], e["requests"], e["method"], e["host"], e["endpoint"], e["p50_seconds"], e["p95_seconds"],
+                sum(e["errors"].values())))
+        return '\n'.join(lines)
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def reset() -> Metrics:
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+class JsonLog(io.TextIOBase):
+    # Replaces sys.stdout in the JSON log mode: every printed line becomes a {"time", "message"} record,
+    # except the request lines, which are replaced by the "request" events of log_request
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ''
+        self.lock = threading.Lock()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        with self.lock:
+            self.buffer += text
+            while '\n' in self.buffer:
+                line, self.buffer = self.buffer.split('\n', 1)
+                if line.strip() and not REQUEST_LINE.match(line):
+                    self.emit({"message": line.strip()})
+        return len(text)
+
+    def emit(self, record: dict):
+        self.stream.write(json.dumps(dict(time=datetime.datetime.now().isoformat(), **record), default=str) + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+
+_json_log = None
+
+
+def enable_json_log() -> JsonLog:
+    global _json_log
+    if _json_log is None:
+        _json_log = JsonLog(sys.stdout)
+        sys.stdout = _json_log
+    return _json_log
+
+
+def disable_json_log():
+    # back to the stream replaced by enable_json_log, after its last line
+    global _json_log
+    if _json_log is not None:
+        _json_log.write('\n')
+        if sys.stdout is _json_log:
+            sys.stdout = _json_log.stream
+        _json_log = None
+
+
+def log_request(method: str, url: str, seconds: float, status: int = None, error: str = None, retries: int = 0,
+                bytes_received: int = 0):
+    if _json_log is not None:
+        with _json_log.lock:
+            _json_log.emit({"event": "request", "method": method.upper(), "url": url, "status": status,
+                            "error": error, "retries": retries, "seconds": round(seconds, 4),
+                            "bytes": bytes_received})
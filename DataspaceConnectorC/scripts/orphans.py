@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+import http_client
+import connector_index
+
+COLLECTIONS = ['catalogs', 'offers', 'contracts', 'rules', 'representations', 'artifacts']
+# the relations linked by the importer, from the catalogs down to the rules and artifacts
+RELATIONS = {
+    'catalogs': ['offers'],
+    'offers': ['contracts', 'representations'],
+    'contracts': ['rules'],
+    'representations': ['artifacts'],
+}
+# 'additional' fields set by the importer: an entity without any of them was not created by it and is never removed
+IMPORTER_KEYS = ['resource_id', 'organization_id', 'policy_hash', 'contract_key', 'schema_hash']
+
+
+def is_imported(entity: dict) -> bool:
+    return any(connector_index.entity_key(entity, key) is not None for key in IMPORTER_KEYS)
+
+
+def entity_size(entity: dict) -> int:
+    # the JSON of the entity and, for the artifacts, the size of their data
+    size = len(json.dumps(entity, separators=(',', ':')).encode('utf-8'))
+    byte_size = entity.get('byteSize')
+    return size + (byte_size if isinstance(byte_size, int) else 0)
+
+
+class Reconciler:
+    # Mark and sweep of the entities of the importer in a connector. The catalogs of the expected organizations,
+    # their offers of the expected resources and everything linked below them are kept. The other entities with
+    # an importer key are orphans: the entities of the datasets removed from the source or deleted in CKAN, the
+    # catalogs moved to another shard, and the leftovers of failed imports that were never linked.
+
+    def __init__(self, index: connector_index.EntityIndex, resources: set, organizations: set, workers: int = 4):
+        self.index = index
+        self.resources = resources
+        self.organizations = organizations
+        self.workers = workers
+
+    def linked(self, parents: set, relation: str) -> set:
+        # the children of the parents, one relation listing per parent
+        children = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for urls in pool.map(lambda url: self.index.linked(url, relation), sorted(parents)):
+                children |= urls
+        return children
+
+    def mark(self) -> dict:
+        entities = {collection: self.index.load(collection) for collection in COLLECTIONS}
+        kept = {'catalogs': {url for url, catalog in entities['catalogs'].items()
+                             if connector_index.entity_key(catalog, 'organization_id') in self.organizations}}
+        kept['offers'] = {url for url in self.linked(kept['catalogs'], 'offers') if url in entities['offers'] and
+                          connector_index.entity_key(entities['offers'][url], 'resource_id') in self.resources}
+        for parent in ['offers', 'contracts', 'representations']:
+            for relation in RELATIONS[parent]:
+                kept[relation] = self.linked(kept[parent], relation)
+        return kept
+
+    def orphans(self) -> dict:
+        kept = self.mark()
+        return {collection: {url: entity for url, entity in self.index.load(collection).items()
+                             if url not in kept[collection] and is_imported(entity)}
+                for collection in COLLECTIONS}
+
+    def delete_entity(self, collection: str, url: str):
+        response = http_client.delete(url, auth=self.index.auth, verify=False)
+        print(" \t\t\t\t - Request DELETE {0} {1}\t => {2}".format(collection, url, response.status_code))
+        # already deleted, by another run or with its parent
+        if response.status_code != 404:
+            response.raise_for_status()
+        self.index.remove(collection, url)
+
+    def delete(self, orphans: dict) -> dict:
+        # the orphans are deleted in bulk by the workers, the failed ones are found again by the next run
+        stats = Counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.delete_entity, collection, url): (collection, url)
+                       for collection, entities in orphans.items() for url in entities}
+            for future in as_completed(futures):
+                collection, url = futures[future]
+                try:
+                    future.result()
+                    stats[collection] += 1
+                    stats['bytes'] += entity_size(orphans[collection][url])
+                except requests.RequestException as err:
+                    print("\t\t - *ERROR* Deleting {} {} => {}".format(collection, url, err))
+                    stats['failed'] += 1
+        return dict(stats)
+
+    def report(self, orphans: dict, deleted: dict = None) -> dict:
+        # the entities of each collection, its orphans and their size; the space reclaimed when deleted
+        report = {collection: {'entities': len(self.index.load(collection)) + (deleted or {}).get(collection, 0),
+                               'orphans': len(entities), 'bytes': sum(map(entity_size, entities.values()))}
+                  for collection, entities in orphans.items()}
+        report['total'] = {'orphans': sum(len(entities) for entities in orphans.values()),
+                           'bytes': sum(report[collection]['bytes'] for collection in orphans)}
+        if deleted is not None:
+            report['total'].update(deleted=sum(deleted.get(collection, 0) for collection in orphans),
+                                   reclaimed_bytes=deleted.get('bytes', 0), failed=deleted.get('failed', 0))
+        return report
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import json
+import hashlib
+import threading
+from concurrent.futures import Future
+
+
+def policy_hash(rule: str) -> str:
+    # hash of the policy content, the same JSON-LD policy with other formatting gives the same hash
+    try:
+        content = json.dumps(json.loads(rule), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    except ValueError:
+        content = rule.strip()
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def rule_data(rule: dict, rule_hash: str) -> dict:
+    # rule entity shared by all the contracts with the same policy
+    return {
+        "title": "Usage policy {}".format(rule_hash[:12]),
+        "description": "Rule shared by the contracts with this usage policy",
+        "value": rule['value'],
+        "policy_hash": rule_hash,
+    }
+
+
+def contract_data(contract: dict, rule_hash: str) -> dict:
+    # contract shared by the resources of an organization with the same policy
+    return {
+        "title": "{} (Contract)".format(contract['organization_name']),
+        "description": "Usage contract template for the resources of organization {} with usage policy {}".format(
+            contract['organization_name'], rule_hash[:12]),
+        "provider": contract['provider'],
+        "organization_id": contract['organization_id'],
+        "organization_name": contract['organization_name'],
+        "policy_hash": rule_hash,
+        "contract_key": "{}_{}".format(contract['organization_id'], rule_hash),
+        "start": contract['start'],
+        "end": contract['end'],
+    }
+
+
+class SharedEntities:
+    # Entities shared by the imports of a run: each one is upserted once, by the first import that needs it,
+    # and the other imports wait for it
+
+    def __init__(self):
+        self.entities = {}
+        self.lock = threading.Lock()
+
+    def shared(self, key: tuple, upsert, *args) -> dict:
+        with self.lock:
+            future = self.entities.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.entities[key] = future
+        if owner:
+            try:
+                future.set_result(upsert(*args))
+            except Exception as err:
+                future.set_exception(err)
+        return future.result()
+
+    def reset(self):
+        # a new run: the entities are checked again
+        with self.lock:
+            self.entities.clear()
+
+
+class PolicyRegistry(SharedEntities):
+    # Rule files, read once, and the entities shared between offers (rules, contracts)
+
+    def __init__(self):
+        super().__init__()
+        self.rules = {}
+
+    def rule(self, path: str) -> str:
+        with self.lock:
+            if path not in self.rules:
+                with open(path, 'r') as source:
+                    self.rules[path] = source.read()
+            return self.rules[path]
+
+    def reset(self):
+        # a new run: the rule files and entities are checked again
+        with self.lock:
+            self.rules.clear()
+        super().reset()
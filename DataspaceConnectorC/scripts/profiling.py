@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+import tracemalloc
+from collections import OrderedDict
+
+# stages of a dataset import, in pipeline order
+STAGES = ["metadata", "organization", "datastore", "inference", "entities", "upserts", "links"]
+
+_profiler = None
+_local = threading.local()
+
+
+class Frame:
+    # a running stage in a thread: times of its nested stages are subtracted from its own
+
+    def __init__(self, dataset: str, name: str, cprofile: cProfile.Profile = None):
+        self.dataset = dataset
+        self.name = name
+        self.cprofile = cprofile
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.peak = self.memory
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+
+
+class Profiler:
+    # Wall time, CPU time (of the running thread) and peak memory (tracemalloc) of each stage of each dataset
+    # import. Stages can nest: each one only accounts its own time, without the nested stages. tracemalloc
+    # is process-wide, so the memory peaks are only exact with one CKAN and one connector worker.
+
+    def __init__(self, path: str, cprofile: bool = False, top: int = 10):
+        self.path = path
+        self.cprofile = cprofile
+        self.top = top
+        self.datasets = OrderedDict()
+        self.profiles = {}
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        tracemalloc.start()
+
+    def stack(self) -> list:
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        return _local.stack
+
+    def _fold_peak(self, stack: list):
+        # the peak since the last reset belongs to all the running stages of the thread
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in stack:
+            frame.peak = max(frame.peak, peak)
+        tracemalloc.reset_peak()
+
+    def _cprofile(self, stage: str) -> cProfile.Profile:
+        # one profile per thread and stage, merged in the report
+        key = (threading.get_ident(), stage)
+        with self.lock:
+            if key not in self.profiles:
+                self.profiles[key] = cProfile.Profile()
+            return self.profiles[key]
+
+    def _enable(self, cprofile: cProfile.Profile) -> cProfile.Profile:
+        # newer Pythons only allow one active profiler in the process, other threads then go unprofiled
+        try:
+            cprofile.enable()
+        except ValueError:
+            return None
+        return cprofile
+
+    def enter(self, dataset: str, name: str):
+        stack = self.stack()
+        self._fold_peak(stack)
+        if dataset is None:
+            dataset = stack[-1].dataset if stack else None
+        cprofile = None
+        if self.cprofile:
+            if stack and stack[-1].cprofile is not None:
+                stack[-1].cprofile.disable()
+            cprofile = self._enable(self._cprofile(name))
+        stack.append(Frame(dataset, name, cprofile))
+
+    def exit(self):
+        stack = self.stack()
+        self._fold_peak(stack)
+        frame = stack.pop()
+        wall = time.perf_counter() - frame.wall
+        cpu = time.thread_time() - frame.cpu
+        if frame.cprofile is not None:
+            frame.cprofile.disable()
+            if stack and stack[-1].cprofile is not None:
+                self._enable(stack[-1].cprofile)
+        if stack:
+            stack[-1].child_wall += wall
+            stack[-1].child_cpu += cpu
+        with self.lock:
+            stages = self.datasets.setdefault(frame.dataset, OrderedDict())
+            stage = stages.setdefault(frame.name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_kb": 0.0})
+            stage["calls"] += 1
+            stage["wall"] += wall - frame.child_wall
+            stage["cpu"] += cpu - frame.child_cpu
+            stage["peak_kb"] = max(stage["peak_kb"], (frame.peak - frame.memory) / 1024)
+
+    def dataset_report(self) -> dict:
+        with self.lock:
+            report = {}
+            for dataset, stages in self.datasets.items():
+                report[dataset] = {name: {"calls": s["calls"], "wall": round(s["wall"], 4), "cpu": round(s["cpu"], 4),
+                                          "peak_kb": round(s["peak_kb"], 1)} for name, s in stages.items()}
+                report[dataset]["total"] = {"wall": round(sum(s["wall"] for s in stages.values()), 4),
+                                            "cpu": round(sum(s["cpu"] for s in stages.values()), 4)}
+        return report
+
+    def summary(self) -> dict:
+        datasets = self.dataset_report()
+        stages = OrderedDict((name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_kb": 0.0}) for name in STAGES)
+        for dataset_stages in datasets.values():
+            for name, s in dataset_stages.items():
+                if name == "total":
+                    continue
+                stage = stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "peak_kb": 0.0})
+                stage["calls"] += s["calls"]
+                stage["wall"] += s["wall"]
+                stage["cpu"] += s["cpu"]
+                stage["peak_kb"] = max(stage["peak_kb"], s["peak_kb"])
+        for stage in stages.values():
+            stage["wall"] = round(stage["wall"], 4)
+            stage["cpu"] = round(stage["cpu"], 4)
+            # share of the stage time spent on CPU, the rest is waiting for I/O
+            stage["cpu_ratio"] = round(stage["cpu"] / stage["wall"], 2) if stage["wall"] else 0.0
+        slowest = sorted(((d, s["total"]) for d, s in datasets.items() if d is not None),
+                         key=lambda item: -item[1]["wall"])[:self.top]
+        slowest_stages = sorted(((d, name, s) for d, dataset_stages in datasets.items()
+                                 for name, s in dataset_stages.items() if name != "total"),
+                                key=lambda item: -item[2]["wall"])[:self.top]
+        return {"stages": stages,
+                "slowest_datasets": [dict(dataset=d, **total) for d, total in slowest],
+                "slowest_stages": [dict(dataset=d, stage=name, **s) for d, name, s in slowest_stages]}
+
+    def write(self) -> dict:
+        with open(os.path.join(self.path, "datasets.json"), 'w') as target:
+            json.dump(self.dataset_report(), target, indent=2)
+        summary = self.summary()
+        with open(os.path.join(self.path, "summary.json"), 'w') as target:
+            json.dump(summary, target, indent=2)
+        if self.cprofile:
+            stats = {}
+            with self.lock:
+                profiles = list(self.profiles.items())
+            for (_, stage), profile in profiles:
+                if stage in stats:
+                    stats[stage].add(profile)
+                else:
+                    stats[stage] = pstats.Stats(profile)
+            for stage, stage_stats in stats.items():
+                stage_stats.dump_stats(os.path.join(self.path, "{}.prof".format(stage)))
+        return summary
+
+    def report(self) -> str:
+        summary = self.summary()
+        lines = ["{:<14} {:>6} {:>10} {:>10} {:>6} {:>10}".format("stage", "calls", "wall (s)", "cpu (s)", "cpu %",
+                                                                "peak (KB)")]
+        for name, s in summary["stages"].items():
+            lines.append("{:<14} {:>6} {:>10.3f} {:>10.3f} {:>5.0f}% {:>10.1f}".format(
+                name, s["calls"], s["wall"], s["cpu"], 100 * s["cpu_ratio"], s["peak_kb"]))
+        lines.append("slowest datasets:")
+        for d in summary["slowest_datasets"]:
+            lines.append("\t{:>10.3f}s wall {:>10.3f}s cpu  {}".format(d["wall"], d["cpu"], d["dataset"]))
+        return '\n'.join(lines)
+
+    def close(self):
+        tracemalloc.stop()
+
+
+def enable(path: str, cprofile: bool = False, top: int = 10) -> Profiler:
+    global _profiler
+    _profiler = Profiler(path, cprofile, top)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    if _profiler is not None:
+        _profiler.close()
+    _profiler = None
+
+
+def get_profiler() -> Profiler:
+    return _profiler
+
+
+@contextlib.contextmanager
+def stage(name: str, dataset_name: str = None):
+    # nested stages belong to the dataset of the enclosing stage
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    profiler.enter(dataset_name, name)
+    try:
+        yield
+    finally:
+        profiler.exit()
+
+
+def call(name: str, dataset_name: str, function, *args, **kwargs):
+    # runs function as a stage of dataset_name, for the functions sent to the worker pools
+    with stage(name, dataset_name):
+        return function(*args, **kwargs)
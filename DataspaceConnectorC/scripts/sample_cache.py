@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import threading
+from urllib.parse import quote
+from collections import Counter
+
+MAX_BYTES = 256 * 1024 * 1024
+
+# opt-in cache of the run, see enable
+_cache = None
+
+
+def sample_version(resource_version: str, metadata: dict, settings: tuple) -> str:
+    # version of the sample of a resource: the datastore version, the dataset metadata (part of the datapackage)
+    # and the sampling settings
+    dataset_version = metadata.get('metadata_modified') or json.dumps(metadata, sort_keys=True, default=str)
+    content = json.dumps([resource_version, dataset_version, list(settings)])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def datastore_fingerprint(page: dict) -> str:
+    # version of a datastore without last_modified: its fields, total and last record
+    content = json.dumps([page.get('fields'), page.get('total'), page.get('records')], sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class SampleCache:
+    # Samples of the datastore resources (header, info, records and generated datapackage) by resource id
+    # and version, compressed in a SQLite file. The least recently used entries are evicted once the file
+    # holds more than max_bytes of samples. A read_only cache is only inspected: no entry is written nor evicted.
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES, read_only: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        if read_only:
+            self.connection = sqlite3.connect('file:{}?mode=ro'.format(quote(os.path.abspath(path))), uri=True,
+                                              check_same_thread=False)
+            return
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS samples (
+                resource_id TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                data BLOB,
+                size INTEGER,
+                stored_at REAL,
+                used_at REAL
+            )""")
+        # the size bound may be lower than in the previous runs
+        self._evict()
+        self.connection.commit()
+
+    def get(self, resource_id: str, version: str) -> dict:
+        with self.lock:
+            row = self.connection.execute("SELECT version, data FROM samples WHERE resource_id = ?",
+                                          (resource_id,)).fetchone()
+            if row is None or row[0] != version:
+                self.stats['miss' if row is None else 'stale'] += 1
+                return None
+            self.connection.execute("UPDATE samples SET used_at = ? WHERE resource_id = ?",
+                                    (time.time(), resource_id))
+            self.connection.commit()
+            self.stats['hit'] += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def put(self, resource_id: str, version: str, sample: dict):
+        data = zlib.compress(json.dumps(sample, default=str).encode('utf-8'))
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?)",
+                                    (resource_id, version, data, len(data), time.time(), time.time()))
+            self.stats['store'] += 1
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM samples").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for resource_id, size in self.connection.execute(
+                "SELECT resource_id, size FROM samples ORDER BY used_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM samples WHERE resource_id = ?", (resource_id,))
+            total -= size
+            self.stats['evicted'] += 1
+            self.stats['evicted_bytes'] += size
+
+    def size(self) -> (int, int):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM samples").fetchone()
+
+    def report(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats.get('hit', 0) + stats.get('miss', 0) + stats.get('stale', 0)
+        stats['hit_ratio'] = round(stats.get('hit', 0) / lookups, 3) if lookups else 0.0
+        stats['entries'], stats['bytes'] = self.size()
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def enable(path: str, max_bytes: int = MAX_BYTES) -> SampleCache:
+    global _cache
+    _cache = SampleCache(path, max_bytes)
+    return _cache
+
+
+def get_cache() -> SampleCache:
+    return _cache
+
+
+def disable():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect or trim the cache of datastore samples")
+    parser.add_argument('path', help="file of the sample cache")
+    parser.add_argument('--max-mb', type=float, help="evict the least recently used samples down to this size")
+    args = parser.parse_args()
+    # without --max-mb the cache is only inspected, whatever its size
+    if args.max_mb is not None:
+        cache = SampleCache(args.path, int(args.max_mb * 1024 * 1024))
+    else:
+        cache = SampleCache(args.path, read_only=True)
+    json.dump(cache.report(), sys.stdout, indent=2)
+    print()
+    cache.close()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import gzip
+import json
+import base64
+import hashlib
+import threading
+from collections import Counter
+
+FORMAT = 'compact-sample/1'
+MAX_BYTES = 256 * 1024
+# the media type of the JSON sample, also when gzipped: the artifact value is then text (base64), its
+# 'encoding' additional field says how to decode it
+MEDIA_TYPE = 'application/json'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def dumps(data) -> str:
+    # canonical compact JSON: the same sample always gives the same artifact value, and the same payload hash
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def schema_document(sample: dict) -> dict:
+    # the part of a sample shared by the resources with the same structure: datastore types and info and the
+    # Table Schema of the datapackage, without the dataset metadata (already in the offer)
+    resources = (sample.get('datapackage') or {}).get('resources') or [{}]
+    return {'header': sample['header'], 'info': sample['info'], 'schema': resources[0].get('schema')}
+
+
+def schema_hash(document: dict) -> str:
+    return hashlib.sha256(dumps(document).encode('utf-8')).hexdigest()
+
+
+def columns(sample: dict) -> (list, dict):
+    # records stored column-wise, in the order of the datastore fields
+    names = list(sample['header'])
+    for record in sample['records']:
+        names += [name for name in record if name not in names]
+    return names, {name: [record.get(name) for record in sample['records']] for name in names}
+
+
+def encode_value(data: dict, compress: bool) -> str:
+    content = dumps(data).encode('utf-8')
+    if compress:
+        # artifact values are text: the gzip bytes (without timestamp, to keep the value stable) in base64
+        return base64.b64encode(gzip.compress(content, mtime=0)).decode('ascii')
+    return content.decode('utf-8')
+
+
+def encode_sample(sample: dict, schema_ref: str, compress: bool = False, max_bytes: int = MAX_BYTES) -> dict:
+    # compact sample: a reference to its schema document and the records column-wise. When the value does not
+    # fit in max_bytes, the rows at the end are dropped: the largest number of first rows that fits is searched
+    # by bisection (an empty sample is kept even if it does not fit).
+    names, values = columns(sample)
+    total = len(sample['records'])
+
+    def encode_rows(rows: int) -> str:
+        data = {'format': FORMAT, 'schema_hash': schema_ref, 'fields': names, 'rows': rows,
+                'columns': [values[name][:rows] for name in names]}
+        if rows < total:
+            data['truncated_from'] = total
+        return encode_value(data, compress)
+
+    def fits(value: str) -> bool:
+        return len(value.encode('utf-8')) <= max_bytes
+
+    rows, value = total, encode_rows(total)
+    if not fits(value):
+        # rows fit, too_many do not
+        rows, value, too_many = 0, encode_rows(0), total
+        while too_many - rows > 1:
+            middle = (rows + too_many) // 2
+            candidate = encode_rows(middle)
+            if fits(candidate):
+                rows, value = middle, candidate
+            else:
+                too_many = middle
+    return {'value': value, 'rows': rows, 'media_type': MEDIA_TYPE, 'encoding': 'gzip+base64' if compress else None}
+
+
+def record(legacy_bytes: int, value_bytes: int, truncated: bool = False):
+    with _stats_lock:
+        _stats['samples'] += 1
+        _stats['legacy_bytes'] += legacy_bytes
+        _stats['sample_bytes'] += value_bytes
+        _stats['truncated'] += 1 if truncated else 0
+
+
+def record_schema(schema_bytes: int):
+    # a schema document stored once in the run
+    with _stats_lock:
+        _stats['schemas'] += 1
+        _stats['schema_bytes'] += schema_bytes
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+
+def report() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stored = stats.get('sample_bytes', 0) + stats.get('schema_bytes', 0)
+    stats['saved_bytes'] = stats.get('legacy_bytes', 0) - stored
+    stats['ratio'] = round(stored / stats['legacy_bytes'], 3) if stats.get('legacy_bytes') else None
+    return stats
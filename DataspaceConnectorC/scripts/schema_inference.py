@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+import random
+import threading
+from frictionless import Field, settings
+from frictionless.fields import AnyField
+
+# same inference settings as frictionless describe
+SAMPLE_SIZE = settings.DEFAULT_SAMPLE_SIZE
+FIELD_CONFIDENCE = settings.DEFAULT_FIELD_CONFIDENCE
+MISSING_VALUES = settings.DEFAULT_MISSING_VALUES
+
+_candidates = []
+_candidates_lock = threading.Lock()
+
+
+def is_empty(value) -> bool:
+    return value is None or len(str(value)) == 0
+
+
+def get_candidates() -> list:
+    # candidate field types in frictionless order, each with its cell reader built once for the process
+    global _candidates
+    with _candidates_lock:
+        if not _candidates:
+            candidates = []
+            for descriptor in settings.DEFAULT_FIELD_CANDIDATES:
+                field = Field.from_descriptor(dict(descriptor, name="shared"))
+                candidates.append((field, field.create_cell_reader()))
+            _candidates = candidates
+        return _candidates
+
+
+def new_memos() -> list:
+    # the cells already read by each candidate type, kept for one inference only: their size is bound by the
+    # sampled rows, not by all the values seen by the process
+    return [{} for _ in get_candidates()]
+
+
+def can_read(candidate: tuple, cell, memo: dict) -> bool:
+    _, cell_reader = candidate
+    try:
+        key = (type(cell), cell)
+        readable = memo.get(key)
+    except TypeError:
+        return not cell_reader(cell)[1]
+    if readable is None:
+        readable = not cell_reader(cell)[1]
+        memo[key] = readable
+    return readable
+
+
+def infer_field(name: str, cells: list, memos: list = None) -> Field:
+    # the frictionless detector scoring, on a single column: the first candidate type that reads enough of
+    # the non-missing cells wins
+    candidates = get_candidates()
+    memos = new_memos() if memos is None else memos
+    scores = [0] * len(candidates)
+    max_score = len(cells)
+    threshold = len(cells) * (FIELD_CONFIDENCE - 1)
+    for cell in cells:
+        is_missing = cell in MISSING_VALUES
+        if is_missing:
+            max_score -= 1
+        for index, candidate in enumerate(candidates):
+            if scores[index] < threshold:
+                continue
+            if not is_missing:
+                scores[index] += 1 if can_read(candidate, cell, memos[index]) else -1
+            if max_score > 0 and scores[index] >= max_score * FIELD_CONFIDENCE:
+                return type(candidate[0])(name=name)
+    return AnyField(name=name)
+
+
+def infer_columns(fields: list, records: list, sample_rows: int = SAMPLE_SIZE - 1) -> (dict, dict):
+    # one columnar pass over the datastore records: the first non-empty value of each column as example and
+    # the column type inferred from the first sample_rows rows, as frictionless describe would do
+    names = [field['id'] for field in fields]
+    columns = {name: [] for name in names}
+    examples = {}
+    pending = set(names)
+    for number, record in enumerate(records):
+        if number >= sample_rows and not pending:
+            break
+        for name in names:
+            value = record.get(name)
+            if number < sample_rows:
+                columns[name].append(value)
+            if name in pending and not is_empty(value):
+                examples[name] = value
+                pending.discard(name)
+
+    memos = new_memos()
+    inferred_fields = {name: infer_field(name, cells, memos) for name, cells in columns.items()}
+    return examples, inferred_fields
+
+
+class Reservoir:
+    # uniform sample of k items of a stream of unknown length (algorithm R), kept in stream order
+
+    def __init__(self, size: int, rng: random.Random):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+
+    def add(self, item):
+        if len(self.items) < self.size:
+            self.items.append((self.seen, item))
+        else:
+            position = self.rng.randrange(self.seen + 1)
+            if position < self.size:
+                self.items[position] = (self.seen, item)
+        self.seen += 1
+
+    def values(self) -> list:
+        return [item for _, item in sorted(self.items, key=lambda i: i[0])]
+
+
+class DatastoreSampler:
+    # Streaming profile of the records of a datastore resource, fed page by page: the first non-empty value
+    # of each column and two reservoirs, the rows used for type inference and the rows kept as sample.
+    # Memory only depends on the reservoir sizes. The seed makes the samples stable between runs.
+
+    def __init__(self, fields: list, sample_size: int, inference_size: int, seed: str = None):
+        self.fields = fields
+        self.names = [field['id'] for field in fields]
+        self.examples = {}
+        self.pending = set(self.names)
+        rng = random.Random(seed)
+        self.sample = Reservoir(sample_size, rng)
+        self.inference = Reservoir(inference_size, rng)
+
+    def add(self, records: list):
+        for record in records:
+            if self.pending:
+                for name in list(self.pending):
+                    value = record.get(name)
+                    if not is_empty(value):
+                        self.examples[name] = value
+                        self.pending.discard(name)
+            self.sample.add(record)
+            self.inference.add(record)
+
+    @property
+    def total(self) -> int:
+        return self.sample.seen
+
+    def datastore_info(self) -> dict:
+        # same shape as a datastore_search result, with the inference rows as records
+        return {'fields': self.fields, 'records': self.inference.values(), 'examples': self.examples,
+                'total': self.total}
+
+    def sample_records(self) -> list:
+        return self.sample.values()
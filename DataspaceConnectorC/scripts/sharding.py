@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import bisect
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# points of each connector in the ring: the more points, the more even the organizations are spread. Changing it
+# moves most organizations, like a new set of connectors would.
+REPLICAS = 64
+
+
+def parse_connectors(value) -> dict:
+    # "url|docker_url,url|docker_url": the connectors of the shards, with the url seen by the broker (by default
+    # the same url). All the connectors share the CONNECTOR_USER and CONNECTOR_PW credentials.
+    connectors = {}
+    entries = value.split(',') if isinstance(value, str) else value or []
+    for entry in entries:
+        if entry.strip():
+            url, _, docker_url = entry.strip().partition('|')
+            connectors[url.strip().rstrip('/')] = docker_url.strip().rstrip('/') or url.strip().rstrip('/')
+    return connectors
+
+
+def ring_point(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    # Consistent hash of the organizations over the connectors. Each connector owns REPLICAS points of the ring
+    # and an organization goes to the connector of the next point, so a new connector only takes the
+    # organizations of the arcs before its points (about 1/n of them) and the other ones stay where they are.
+
+    def __init__(self, nodes: list, replicas: int = REPLICAS):
+        if not nodes:
+            raise ValueError("*ERROR: No connectors to shard the organizations")
+        self.nodes = sorted(set(nodes))
+        self.points = sorted((ring_point("{}#{}".format(node, replica)), node)
+                             for node in self.nodes for replica in range(replicas))
+        self.keys = [point for point, _ in self.points]
+
+    def get(self, key: str) -> str:
+        position = bisect.bisect(self.keys, ring_point(key)) % len(self.points)
+        return self.points[position][1]
+
+    def assign(self, keys) -> dict:
+        return {key: self.get(key) for key in keys}
+
+
+def moves(assignments: dict, ring: HashRing) -> dict:
+    # the organizations of the previous assignments that the ring puts in another connector
+    return {key: (previous, ring.get(key)) for key, previous in assignments.items() if ring.get(key) != previous}
+
+
+class ShardRouter:
+    # The connector of the catalog of each organization in a run, with a writer pool per connector so the
+    # shards are written in parallel. The assignments are kept in the sync state: a dataset of an organization
+    # moved to another connector (rebalancing) is imported again there and forgotten in the previous one.
+
+    def __init__(self, connectors: dict, workers: int, state=None):
+        self.connectors = connectors
+        self.ring = HashRing(list(connectors))
+        self.state = state
+        self.writers = {url: ThreadPoolExecutor(max_workers=workers) for url in self.ring.nodes}
+        self.lock = threading.Lock()
+        self.organizations = {}
+        self.previous = {}
+        self.moved = {}
+        self.datasets = Counter()
+
+    def route(self, dataset: str, metadata: dict) -> (str, str, ThreadPoolExecutor):
+        organization = metadata['organization']
+        connector_url = self.ring.get(organization['id'])
+        with self.lock:
+            self.datasets[connector_url] += 1
+            first = organization['id'] not in self.previous
+            if first:
+                # the connector of the organization before this run, read once: it is updated below
+                self.previous[organization['id']] = (self.state.shard(organization['id'])
+                                                     if self.state is not None else None)
+                self.organizations[organization['id']] = connector_url
+            previous = self.previous[organization['id']]
+            if previous is not None and previous != connector_url:
+                self.moved[organization['name']] = (previous, connector_url)
+        if self.state is not None:
+            if previous is not None and previous != connector_url:
+                self.state.forget(previous, dataset)
+            if first:
+                self.state.record_shard(organization['id'], organization['name'], connector_url)
+        return connector_url, self.connectors[connector_url], self.writers[connector_url]
+
+    def report(self) -> dict:
+        with self.lock:
+            return {'datasets': dict(self.datasets), 'organizations': dict(Counter(self.organizations.values())),
+                    'moved': len(self.moved)}
+
+    def shutdown(self):
+        for writer in self.writers.values():
+            writer.shutdown()
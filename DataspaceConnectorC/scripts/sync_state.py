@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+import json
+import sqlite3
+import threading
+import datetime
+
+
+def dataset_watermark(metadata: dict, settings: str = None) -> dict:
+    # modification dates of a CKAN dataset (package_show) and of each of its resources, and the fingerprint of
+    # the settings that change its entities (sample format, download proxy...)
+    resources = {}
+    for resource in metadata.get('resources', []):
+        resources[resource['id']] = resource.get('last_modified') or resource.get('metadata_modified')
+    return {'metadata_modified': metadata.get('metadata_modified'), 'resources': resources, 'settings': settings}
+
+
+class SyncState:
+    # Watermarks of the datasets imported in each connector, and the connector of each organization when the
+    # import is sharded (sharding.py), kept in a SQLite file between runs. A dataset imported with other
+    # settings (see main.settings_fingerprint) is not unchanged, whatever its CKAN dates.
+
+    def __init__(self, path: str, settings: str = None):
+        self.path = path
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS datasets (
+                connector_url TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                dataset_id TEXT,
+                metadata_modified TEXT,
+                resources TEXT,
+                synced_at TEXT,
+                settings TEXT,
+                PRIMARY KEY (connector_url, dataset)
+            );
+            CREATE TABLE IF NOT EXISTS shards (
+                organization_id TEXT PRIMARY KEY,
+                organization_name TEXT,
+                connector_url TEXT NOT NULL,
+                assigned_at TEXT
+            );""")
+        # sync states of the previous versions, their datasets are imported again once
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(datasets)")]
+        if 'settings' not in columns:
+            self.connection.execute("ALTER TABLE datasets ADD COLUMN settings TEXT")
+        self.connection.commit()
+
+    def get(self, connector_url: str, dataset: str) -> dict:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT metadata_modified, resources, settings FROM datasets WHERE connector_url = ? AND dataset = ?",
+                (connector_url, dataset)).fetchone()
+        if row is None:
+            return None
+        return {'metadata_modified': row[0], 'resources': json.loads(row[1]), 'settings': row[2]}
+
+    def is_unchanged(self, connector_url: str, dataset: str, metadata: dict) -> bool:
+        watermark = self.get(connector_url, dataset)
+        return watermark is not None and watermark == dataset_watermark(metadata, self.settings)
+
+    def record(self, connector_url: str, dataset: str, metadata: dict):
+        watermark = dataset_watermark(metadata, self.settings)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO datasets (connector_url, dataset, dataset_id, metadata_modified, resources, "
+                "synced_at, settings) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (connector_url, dataset, metadata.get('id'), watermark['metadata_modified'],
+                 json.dumps(watermark['resources'], sort_keys=True), datetime.datetime.now().isoformat(),
+                 watermark['settings']))
+            self.connection.commit()
+
+    def forget(self, connector_url: str, dataset: str):
+        # the dataset is imported again the next time it goes to the connector
+        with self.lock:
+            self.connection.execute("DELETE FROM datasets WHERE connector_url = ? AND dataset = ?",
+                                    (connector_url, dataset))
+            self.connection.commit()
+
+    def forget_dataset(self, connector_url: str, dataset_id: str):
+        # by CKAN id: the entities of the dataset were removed from the connector (orphans.py)
+        with self.lock:
+            self.connection.execute("DELETE FROM datasets WHERE connector_url = ? AND dataset_id = ?",
+                                    (connector_url, dataset_id))
+            self.connection.commit()
+
+    def shard(self, organization_id: str) -> str:
+        with self.lock:
+            row = self.connection.execute("SELECT connector_url FROM shards WHERE organization_id = ?",
+                                          (organization_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def record_shard(self, organization_id: str, organization_name: str, connector_url: str):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?)",
+                                    (organization_id, organization_name, connector_url,
+                                     datetime.datetime.now().isoformat()))
+            self.connection.commit()
+
+    def shards(self) -> dict:
+        # the connector of the catalog of each organization, by organization id
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT organization_id, organization_name, connector_url FROM shards").fetchall()
+        return {organization_id: {'name': name, 'connector_url': connector_url}
+                for organization_id, name, connector_url in rows}
+
+    def summary(self) -> dict:
+        # datasets synced in each connector and the last sync
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT connector_url, COUNT(*), MAX(synced_at) FROM datasets GROUP BY connector_url").fetchall()
+        return {connector_url: {'datasets': count, 'last_synced_at': synced_at}
+                for connector_url, count, synced_at in rows}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Upserts of unchanged contracts against the fake connector of the benchmarks: a contract that ends soon is
+# updated with new validity dates, the other ones are left as they are.
+#
+#   python -m pytest tests
+import os
+import sys
+import datetime
+import unittest
+
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SCRIPTS_PATH)
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, 'benchmarks'))
+
+from fake_servers import FakeConnector  # noqa: E402
+import http_client  # noqa: E402
+import connector_index  # noqa: E402
+import config  # noqa: E402
+import main  # noqa: E402
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+AUTH = ('admin', 'password')
+
+
+def contract_data(resource_id: str, days: int) -> dict:
+    now = datetime.datetime.now()
+    return {"resource_id": resource_id, "title": "Contract of {}".format(resource_id), "provider": "http://provider",
+            "start": (now - datetime.timedelta(days=3)).strftime(DATE_FORMAT),
+            "end": (now + datetime.timedelta(days=days)).strftime(DATE_FORMAT)}
+
+
+class ContractRenewalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = FakeConnector().start()
+        http_client.configure(self.connector.url, auth=AUTH, verify=False)
+        connector_index.reset()
+
+    def tearDown(self):
+        http_client.close()
+        self.connector.stop()
+
+    def store(self, data: dict) -> dict:
+        # a contract of a previous run, with the payload hash of the same contract data
+        with self.connector.lock:
+            return self.connector.create('contracts', connector_index.with_payload_hash(data))
+
+    def puts(self) -> int:
+        with self.connector.lock:
+            return sum(count for (method, _), count in self.connector.counts.items() if method == 'PUT')
+
+    def test_aged_contract_is_renewed(self):
+        stored = self.store(contract_data('aged', days=10))
+        data = contract_data('aged', days=4 * 365)
+        main.upsert_resource_entity(data, 'contracts', self.connector.url, AUTH)
+        self.assertEqual(self.puts(), 1)
+        self.assertEqual(stored['end'], data['end'])
+        self.assertFalse(connector_index.expires_within(stored, config.CONTRACT_RENEWAL_DAYS))
+
+    def test_valid_contract_is_unchanged(self):
+        stored = self.store(contract_data('valid', days=3 * 365))
+        end = stored['end']
+        main.upsert_resource_entity(contract_data('valid', days=4 * 365), 'contracts', self.connector.url, AUTH)
+        self.assertEqual(self.puts(), 0)
+        self.assertEqual(stored['end'], end)
+
+
+if __name__ == '__main__':
+    unittest.main()
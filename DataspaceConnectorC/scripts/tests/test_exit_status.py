@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# Exit status of an import against the fake CKAN and connector of the benchmarks: not 0 when a dataset failed,
+# passed through by the command line.
+#
+#   python -m pytest tests
+import io
+import os
+import sys
+import contextlib
+import unittest
+from unittest import mock
+
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SCRIPTS_PATH)
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, 'benchmarks'))
+
+from fake_servers import FakeCkan, FakeConnector  # noqa: E402
+import cli  # noqa: E402
+import config  # noqa: E402
+import main  # noqa: E402
+
+
+class ExitStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ckan = FakeCkan(datasets=2, organizations=1, resources=1).start()
+        self.connector = FakeConnector().start()
+        settings = {'DATA_SOURCE_URL': self.ckan.url,
+                    'RULE_JSON': os.path.join(SCRIPTS_PATH, 'input', 'rule.json'),
+                    'RULE_SAMPLE_JSON': os.path.join(SCRIPTS_PATH, 'input', 'rule_sample.json')}
+        self.settings = mock.patch.multiple(config, **settings)
+        self.settings.start()
+
+    def tearDown(self):
+        self.settings.stop()
+        self.ckan.stop()
+        self.connector.stop()
+
+    def run_import(self, datasets: list) -> int:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return main.main(metadata_broker_url=self.connector.url, metadata_broker_docker_url=self.connector.url,
+                             connector_url=self.connector.url, connector_docker_url=self.connector.url,
+                             connector_user='admin', connector_pw='password', datasets=datasets, sync_state_db='',
+                             journal_db='', ckan_cache='', sample_cache_db='', register=False)
+
+    def test_imported_datasets(self):
+        self.assertEqual(self.run_import(['dataset-0', 'dataset-1']), 0)
+
+    def test_failed_dataset(self):
+        self.assertEqual(self.run_import(['dataset-0', 'dataset-missing']), 1)
+
+    def test_command_line_status(self):
+        with mock.patch.object(main, 'main', return_value=1) as run:
+            self.assertEqual(cli.main(['import-one', 'dataset-missing']), 1)
+        self.assertEqual(run.call_args.kwargs['datasets'], ['dataset-missing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Pure, CPU-bound transforms of the CKAN metadata. They only take and return picklable data, so they can run in
+# the worker processes of the transform pool, see start_pool. Their heavy dependencies (dplib, frictionless,
+# lxml) are imported on the first call, the commands that do not transform metadata start without them.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def fix_multilingual(ckan_dataset_original: dict, resource_id: str, lang: str = 'es'):
+
+    ckan_dataset = ckan_dataset_original.copy()
+    ckan_dataset["notes"] = ckan_dataset["notes"].get(lang, ckan_dataset["notes"])
+    ckan_dataset["title"] = ckan_dataset["title"].get(lang, ckan_dataset["title"])
+    ckan_dataset["tags"] = [{"name": k, "display_name": k, "state": "active", "id": k, "vocabulary": None}
+                            for k in get_keywords(ckan_dataset)]
+
+    resources = []
+    for resource_original in ckan_dataset["resources"]:
+        resource = resource_original.copy()
+        if resource['id'] == resource_id:
+            resource["name"] = resource["name"].get(lang, resource["name"])
+            resource["description"] = resource["description"].get(lang, resource["description"])
+            resources = [resource]
+            break
+
+    ckan_dataset["resources"] = resources
+    return ckan_dataset
+
+
+def generate_datapackage(ckan_dataset: dict, datastore_info: dict, resource_id: str) -> dict:
+    from dplib.plugins.ckan.models import CkanPackage, CkanSchema
+    from dplib.models import Schema, IntegerField, GeopointField, NumberField, GeojsonField, YearmonthField, \
+        DatetimeField, DateField
+    import schema_inference
+
+    fixed_ckan_dataset = fix_multilingual(ckan_dataset, resource_id)
+
+    datapackage = CkanPackage.from_dict(fixed_ckan_dataset).to_dp()
+    ckan_schema = CkanSchema.from_dict(datastore_info).to_dp()
+
+    # guess data types, the records are already a bounded sample of the resource
+    examples, inferred_fields = schema_inference.infer_columns(datastore_info['fields'], datastore_info['records'],
+                                                               sample_rows=len(datastore_info['records']))
+    examples = datastore_info.get('examples', examples)
+
+    new_schema = Schema()
+    for field in ckan_schema.fields:
+
+        # add example value
+        example_value = examples.get(field.name)
+        field.example = example_value
+
+        field_new = inferred_fields.get(field.name, field)
+
+        if field.type == 'string' and field_new.type != 'string' and example_value is not None:
+            # print(field)
+            if field.title:
+                field_new.title = field.title
+            if field.description:
+                field_new.description = field.description
+            field_new.example = field.example
+
+            # print('=>', field_new)
+            match field_new.type:
+                case "integer":
+                    new_schema.add_field(IntegerField(**field_new.to_dict()))
+                case "number":
+                    new_schema.add_field(NumberField(**field_new.to_dict()))
+                case "geopoint":
+                    new_schema.add_field(GeopointField(**field_new.to_dict()))
+                case "geojson":
+                    new_schema.add_field(GeojsonField(**field_new.to_dict()))
+                case"yearmonth":
+                    new_schema.add_field(YearmonthField(**field_new.to_dict()))
+                case "datetime":
+                    new_schema.add_field(DatetimeField(**field_new.to_dict()))
+                case "date":
+                    new_schema.add_field(DateField(**field_new.to_dict()))
+                case _:
+                    raise Exception("Unknown type: " + field_new.type)
+        else:
+            new_schema.add_field(field)
+
+    datapackage.resources[0].schema = new_schema
+    datapackage.resources[0].type = "table"
+
+    return datapackage.to_dict()
+
+
+def as_simple_text(text: str):
+    import lxml.html
+    simple_text = lxml.html.fromstring(text).text_content().replace('\n', "").replace('\r', "")
+    return simple_text
+
+
+def get_keywords(metadata: dict) -> list:
+    keywords = []
+    for key in metadata["tag_string_schemaorg"].split(','):
+        tag = key.strip().upper()
+        if tag.endswith('-ES'):
+            tag = tag.rsplit('-', 1)[0]
+            if tag not in keywords:
+                keywords += [tag]
+    for key in str(metadata.get('original_tags', "")).split(','):
+        if key:
+            tag = key.strip().upper()
+            if tag not in keywords:
+                keywords += [tag]
+    return keywords
+
+
+def transform_dataset(metadata: dict, datastore_infos: dict) -> dict:
+    # all the transforms of a dataset in one call: the plain text notes, the keywords and the datapackage of
+    # each datastore resource (datastore_infos by resource id)
+    return {
+        'notes': as_simple_text(metadata["notes"]["es"]),
+        'keywords': get_keywords(metadata),
+        'datapackages': {resource_id: generate_datapackage(metadata, datastore_info, resource_id)
+                         for resource_id, datastore_info in datastore_infos.items()},
+    }
+
+
+def start_pool(workers: int) -> ProcessPoolExecutor:
+    # spawned workers: the importer threads hold locks and sockets that must not be forked
+    global _pool
+    with _pool_lock:
+        if _pool is None and workers > 0:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+
+
+def run(function, *args):
+    # in a worker process when the pool is started, else in the calling thread
+    pool = _pool
+    if pool is None:
+        return function(*args)
+    return pool.submit(function, *args).result()